@@ -0,0 +1,191 @@
+"""
+Офлайн калибровка уверенности по истории вопросов (questions.confidence_signals).
+
+Метки: вопрос, ответ AI на который остался без эскалации, — 1 (с весом
+--ai-answered-weight: его никто не проверял). Эскалированный вопрос с ответом
+админа — 1, если черновик AI (questions.ai_answer) совпал с ответом админа
+по косинусу эмбеддингов >= --agreement (эскалация была лишней), иначе 0.
+
+Модель обучается на train части и сравнивается на holdout с тем, что бот
+использовал (confidence_score) и с весами по умолчанию: Brier, log loss, ECE,
+таблица надежности, доля эскалаций и пропущенных плохих ответов по порогам.
+--save сохраняет модель, обученную на всех данных, в shared_state.
+    python -m benchmarks.confidence --days 90 --json confidence_report.json
+    python -m benchmarks.confidence --synthetic 2000   # проверка без истории
+"""
+
+import os
+import json
+import asyncio
+import argparse
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+os.environ.setdefault("METRICS_PORT", "0")
+
+import numpy as np
+from sqlalchemy import select
+from database import get_db
+from database.models import Question
+from utils.confidence import (
+    ConfidenceSignals, ConfidenceScorer, DEFAULT_MODEL,
+    fit, evaluate, recommend_threshold, save_calibration
+)
+
+THRESHOLDS = [round(t, 2) for t in np.arange(0.3, 0.95, 0.05)]
+
+
+async def load_history(args) -> Tuple[List[ConfidenceSignals], List[int], List[float], List[float]]:
+    """Returns: (сигналы, метки, веса, confidence_score, который использовал бот)"""
+    query = select(
+        Question.answered_by_ai, Question.answer_text, Question.ai_answer,
+        Question.confidence_signals, Question.confidence_score
+    ).where(
+        Question.confidence_signals.isnot(None),
+        Question.status == "answered",
+        Question.created_at >= datetime.utcnow() - timedelta(days=args.days)
+    ).order_by(Question.created_at.desc()).limit(args.limit)
+
+    with get_db() as db:
+        rows = db.execute(query).fetchall()
+
+    reviewed = [r for r in rows if not r.answered_by_ai and r.ai_answer and r.answer_text]
+    agreement = {}
+    if reviewed:
+        from bot.llm import get_llm
+
+        llm = get_llm()
+        drafts = await llm.generate_embeddings([r.ai_answer for r in reviewed])
+        finals = await llm.generate_embeddings([r.answer_text for r in reviewed])
+        for row, a, b in zip(reviewed, drafts, finals):
+            a, b = np.asarray(a), np.asarray(b)
+            agreement[id(row)] = float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b) or 1.0))
+
+    signals, labels, weights, used = [], [], [], []
+    for row in rows:
+        if row.answered_by_ai:
+            label, weight = 1, args.ai_answered_weight
+        elif id(row) in agreement:
+            label, weight = int(agreement[id(row)] >= args.agreement), 1.0
+        else:
+            continue
+        signals.append(ConfidenceSignals.from_dict(row.confidence_signals))
+        labels.append(label)
+        weights.append(weight)
+        used.append(row.confidence_score or 0.0)
+    return signals, labels, weights, used
+
+
+def synthetic(n: int, seed: int):
+    """Сигналы и метки из известной зависимости: проверка калибровки без истории"""
+    rng = np.random.default_rng(seed)
+    signals, labels = [], []
+    for _ in range(n):
+        has_context = rng.random() < 0.7
+        s = ConfidenceSignals(
+            self_reported=float(np.clip(rng.normal(0.75, 0.12), 0, 1)),
+            token=float(np.clip(rng.normal(0.85, 0.07), 0, 1)) if rng.random() < 0.8 else None,
+            similarity=float(rng.uniform(0.3, 0.95)) if has_context else 0.0,
+            has_context=has_context,
+            has_web=bool(rng.random() < 0.3)
+        )
+        token = s.token if s.token is not None else 0.85
+        z = -6.0 + 2.5 * s.self_reported + 4.0 * token + 2.5 * s.similarity + 0.3 * s.has_web
+        signals.append(s)
+        labels.append(int(rng.random() < 1 / (1 + np.exp(-z))))
+    used = [float(np.clip(s.self_reported + (0.15 if s.similarity > 0.8 else 0.0), 0, 1)) for s in signals]
+    return signals, labels, [1.0] * n, used
+
+
+def print_report(name: str, report: Dict):
+    print(f"\n📈 {name}: n={report['n']} Brier {report['brier']} log loss {report['log_loss']} ECE {report['ece']}")
+    for row in report["reliability"]:
+        print(f"   {row['bin']}: n={row['n']:<5} предсказано {row['predicted']:.2f} наблюдается {row['observed']:.2f}")
+
+
+def run(args) -> Dict:
+    if args.synthetic:
+        signals, labels, weights, used = synthetic(args.synthetic, args.seed)
+    else:
+        signals, labels, weights, used = asyncio.run(load_history(args))
+
+    if len(signals) < args.min_samples or len(set(labels)) < 2:
+        raise SystemExit(
+            f"❌ Мало данных для калибровки: {len(signals)} вопросов (нужно >= {args.min_samples} и обе метки)"
+        )
+
+    rng = np.random.default_rng(args.seed)
+    order = rng.permutation(len(signals))
+    cut = int(len(order) * (1 - args.holdout))
+    train, test = order[:cut], order[cut:]
+
+    model = fit([signals[i] for i in train], [labels[i] for i in train], [weights[i] for i in train], l2=args.l2)
+    scorer = ConfidenceScorer()
+    test_labels = [labels[i] for i in test]
+
+    reports = {
+        "used": evaluate([used[i] for i in test], test_labels, THRESHOLDS),
+        "default": evaluate([scorer.score(signals[i], DEFAULT_MODEL) for i in test], test_labels, THRESHOLDS),
+        "calibrated": evaluate([scorer.score(signals[i], model) for i in test], test_labels, THRESHOLDS),
+    }
+
+    current = float(os.getenv("CONFIDENCE_THRESHOLD", "0.7"))
+    baseline = min(reports["used"]["thresholds"], key=lambda t: abs(t["threshold"] - current))
+    recommended = recommend_threshold(reports["calibrated"], baseline["missed_bad_rate"])
+
+    print(f"🧪 Вопросов: {len(signals)} (train {len(train)}, holdout {len(test)}), доля «AI был прав»: {np.mean(labels):.2f}")
+    print_report("Уверенность бота (confidence_score)", reports["used"])
+    print_report("Веса по умолчанию", reports["default"])
+    print_report("Откалибровано", reports["calibrated"])
+
+    print("\n🎚 Порог → доля эскалаций / пропущенные плохие ответы (бот | калибровка)")
+    for used_row, calibrated_row in zip(reports["used"]["thresholds"], reports["calibrated"]["thresholds"]):
+        print(
+            f"   {used_row['threshold']:.2f}: {used_row['escalation_rate']:.3f} / {used_row['missed_bad_rate']:.3f}"
+            f"  |  {calibrated_row['escalation_rate']:.3f} / {calibrated_row['missed_bad_rate']:.3f}"
+        )
+
+    print(f"\n⚖️ Веса: {json.dumps(model['weights'], ensure_ascii=False)}, intercept {model['intercept']:.3f}")
+    if recommended is not None:
+        calibrated_row = next(t for t in reports["calibrated"]["thresholds"] if t["threshold"] == recommended)
+        print(
+            f"✅ CONFIDENCE_THRESHOLD={recommended}: эскалаций {calibrated_row['escalation_rate']:.1%} "
+            f"вместо {baseline['escalation_rate']:.1%} при пропущенных плохих "
+            f"{calibrated_row['missed_bad_rate']:.1%} (сейчас {baseline['missed_bad_rate']:.1%})"
+        )
+    else:
+        print("⚠️ Нет порога, который не увеличивает долю пропущенных плохих ответов")
+
+    result = {"model": model, "reports": reports, "current_threshold": current, "recommended_threshold": recommended}
+
+    if args.save and not args.synthetic:
+        full = fit(signals, labels, weights, l2=args.l2)
+        full["recommended_threshold"] = recommended
+        save_calibration(full)
+        print("💾 Калибровка сохранена, воркеры подхватят ее в течение CONFIDENCE_CALIBRATION_REFRESH")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False, indent=2)
+        print(f"💾 Отчет: {args.json}")
+    return result
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Калибровка уверенности по истории вопросов")
+    parser.add_argument("--days", type=int, default=90)
+    parser.add_argument("--limit", type=int, default=20000)
+    parser.add_argument("--agreement", type=float, default=0.85, help="косинус черновик/ответ админа для «AI был прав»")
+    parser.add_argument("--ai-answered-weight", type=float, default=0.5)
+    parser.add_argument("--holdout", type=float, default=0.3)
+    parser.add_argument("--l2", type=float, default=1.0)
+    parser.add_argument("--min-samples", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--synthetic", type=int, default=0, help="N синтетических вопросов вместо истории")
+    parser.add_argument("--save", action="store_true", help="сохранить модель для бота")
+    parser.add_argument("--json", default="")
+    return parser
+
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -0,0 +1,163 @@
+"""
+Бенчмарк локальных embedding бэкендов (torch / onnx / onnx-int8) на CPU:
+время загрузки, пропускная способность, пиковый RSS и паритет векторов с torch.
+
+Каждый бэкенд запускается в отдельном процессе, чтобы RSS не смешивался.
+Паритет: косинус с torch вектором того же текста и совпадение ближайшего
+соседа по корпусу; при --min-cosine ниже порога скрипт завершается с ошибкой.
+    python -m benchmarks.local_embeddings --backends torch,onnx,onnx-int8 --texts 512 --threads 4
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import tempfile
+from pathlib import Path
+from typing import Dict, List
+
+import numpy as np
+
+QUERIES_PATH = Path(__file__).parent / "data" / "retrieval_queries.json"
+
+
+def corpus(size: int) -> List[str]:
+    """Вопросы из размеченного набора, повторенные до size с номером (тексты не совпадают)"""
+    with open(QUERIES_PATH, encoding="utf-8") as f:
+        items = json.load(f)
+    base = sorted({item["query"] for item in items} | {item["expected"] for item in items})
+    return [base[i] if i < len(base) else f"{base[i % len(base)]} ({i // len(base)})" for i in range(size)]
+
+
+def worker(args):
+    """Запуск внутри дочернего процесса: печатает JSON с замерами, векторы пишет в --out"""
+    if args.threads:
+        os.environ["LOCAL_EMBEDDING_THREADS"] = str(args.threads)
+    os.environ["LOCAL_EMBEDDING_MAX_BATCH"] = str(args.batch)
+    from bot.llm.local_embeddings import LocalEmbedder
+
+    texts = corpus(args.texts)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    embedder = LocalEmbedder(backend=args.worker)
+    started = time.perf_counter()
+    embedder.load()
+    load_s = time.perf_counter() - started
+
+    embedder.encode(texts[:args.batch])  # прогрев
+
+    single = []
+    for text in texts[:args.single]:
+        started = time.perf_counter()
+        embedder.encode([text])
+        single.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    vectors = np.asarray(embedder.encode(texts), dtype=np.float32)
+    batch_s = time.perf_counter() - started
+    np.save(args.out, vectors)
+
+    single.sort()
+    print(json.dumps({
+        "backend": embedder._backend.name,
+        "load_s": round(load_s, 2),
+        "texts_per_s": round(len(texts) / batch_s, 1),
+        "single_p50_ms": round(single[len(single) // 2] * 1000, 2) if single else None,
+        "rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "rss_model_mb": round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024, 1),
+    }))
+
+
+def parity(reference: np.ndarray, vectors: np.ndarray) -> Dict:
+    cosines = np.sum(reference * vectors, axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(vectors, axis=1)
+    )
+    # совпадение ближайшего соседа (без самого текста) по корпусу
+    ref_sim, sim = reference @ reference.T, vectors @ vectors.T
+    np.fill_diagonal(ref_sim, -np.inf)
+    np.fill_diagonal(sim, -np.inf)
+    top1 = np.mean(np.argmax(ref_sim, axis=1) == np.argmax(sim, axis=1))
+    return {
+        "cos_mean": round(float(cosines.mean()), 5),
+        "cos_min": round(float(cosines.min()), 5),
+        "nn_agreement": round(float(top1), 4),
+    }
+
+
+def run(args) -> List[Dict]:
+    backends = [b for b in args.backends.split(",") if b]
+    rows, failed = [], False
+
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = {}
+        for backend in backends:
+            paths[backend] = os.path.join(tmp, f"{backend}.npy")
+            result = subprocess.run(
+                [
+                    sys.executable, "-m", "benchmarks.local_embeddings",
+                    "--worker", backend, "--out", paths[backend],
+                    "--texts", str(args.texts), "--batch", str(args.batch),
+                    "--threads", str(args.threads), "--single", str(args.single),
+                ],
+                capture_output=True,
+                text=True
+            )
+            if result.returncode != 0:
+                print(f"❌ {backend}: {result.stderr.strip().splitlines()[-1] if result.stderr.strip() else 'ошибка'}")
+                failed = True
+                continue
+            row = json.loads(result.stdout.strip().splitlines()[-1])
+            if row["backend"] != backend:
+                print(f"⚠️ {backend} недоступен, замер сделан на {row['backend']}")
+            rows.append({"requested": backend, **row})
+
+        reference = np.load(paths["torch"]) if "torch" in backends and os.path.exists(paths["torch"]) else None
+        for row in rows:
+            if reference is not None and row["requested"] != "torch":
+                row.update(parity(reference, np.load(paths[row["requested"]])))
+                if args.min_cosine and row["cos_min"] < args.min_cosine:
+                    failed = True
+
+    print(f"🧪 {args.texts} текстов, batch={args.batch}, threads={args.threads or 'auto'}")
+    for row in rows:
+        line = (
+            f"  {row['requested']:<10} загрузка {row['load_s']:>6} с  {row['texts_per_s']:>8} текст/с  "
+            f"1 текст p50 {row['single_p50_ms']} мс  RSS {row['rss_mb']} МБ (+{row['rss_model_mb']} модель)"
+        )
+        if "cos_mean" in row:
+            line += f"  cos {row['cos_mean']:.4f}/min {row['cos_min']:.4f}  NN {row['nn_agreement']:.3f}"
+        print(line)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(rows, f, ensure_ascii=False, indent=2)
+        print(f"💾 Отчет: {args.json}")
+
+    if failed:
+        raise SystemExit(f"❌ Паритет ниже {args.min_cosine} или бэкенд не запустился")
+    return rows
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Бенчмарк локальных embedding бэкендов")
+    parser.add_argument("--backends", default="torch,onnx,onnx-int8")
+    parser.add_argument("--texts", type=int, default=512)
+    parser.add_argument("--batch", type=int, default=32)
+    parser.add_argument("--threads", type=int, default=0, help="0 — по умолчанию библиотеки")
+    parser.add_argument("--single", type=int, default=50, help="замеров латентности одного текста")
+    parser.add_argument("--min-cosine", type=float, default=0.98, help="минимальный косинус с torch (0 — не проверять)")
+    parser.add_argument("--json", default="")
+    parser.add_argument("--worker", default="", help=argparse.SUPPRESS)
+    parser.add_argument("--out", default="", help=argparse.SUPPRESS)
+    return parser
+
+
+if __name__ == "__main__":
+    parsed = build_parser().parse_args()
+    if parsed.worker:
+        worker(parsed)
+    else:
+        run(parsed)
@@ -0,0 +1,163 @@
+"""
+Политика эскалации (utils/escalation_policy.py) против прежних проверок
+подстрокой: время на сообщение и расхождения по языку, интентам
+и решению об эскалации на вопросах из retrieval_queries.json и small talk.
+
+    python -m benchmarks.policy --repeat 200 --show-diff
+"""
+
+import os
+import json
+import time
+import argparse
+import tempfile
+from typing import Dict, List, Set
+import yaml
+
+os.environ.setdefault("METRICS_PORT", "0")
+
+from utils.escalation_policy import PolicyLoader, load_policy, RULES_PATH
+
+QUERIES = os.path.join(os.path.dirname(__file__), "data", "retrieval_queries.json")
+
+SMALL_TALK = [
+    "Спасибо!", "Привет", "Понятно, спасибо", "ok", "Thanks a lot", "Got it, thank you",
+    "Olá, bom dia", "Obrigada!", "tchau", "Да", "no", "Hello there",
+    "Oi", "hey", "thx", "ty", "Привет, Сергей", "Спасибо, понятно",
+    "Спасибо, а что если мне отказали в визе и нужна апелляция?",
+    "I know nothing about NHR, is it simple?",
+    "Is there a court appeal after refusal?",
+]
+
+LEGACY_SIMPLE = ['спасибо', 'thanks', 'obrigado', 'понятно', 'ясно', 'got it', 'ok', 'да', 'нет', 'yes', 'no']
+LEGACY_ESCALATION_SIMPLE = [
+    'привет', 'спасибо', 'здравствуй', 'пока', 'благодарю',
+    'hi', 'hello', 'thanks', 'thank you', 'bye', 'olá', 'obrigado', 'tchau'
+]
+LEGACY_CRITICAL = [
+    'депортация', 'отказ', 'судебный', 'апелляция',
+    'deportation', 'refusal', 'court', 'appeal', 'deportação', 'recusa', 'tribunal'
+]
+LEGACY_PT = [
+    'você', 'não', 'sim', 'obrigado', 'obrigada', 'por favor', 'está', 'também', 'quando',
+    'olá', 'bom dia', 'boa tarde', 'boa noite', 'tchau'
+]
+
+
+def legacy_analyze(text: str) -> Dict:
+    """Прежние detect_language, is_simple_question и ключевые слова should_escalate_to_admin"""
+    lower = text.lower()
+    if any(c in 'абвгдежзийклмнопрстуфхцчшщъыьэюя' for c in lower):
+        language = 'ru'
+    elif any(word in lower for word in LEGACY_PT):
+        language = 'pt'
+    else:
+        language = 'en'
+    short = len(text.split()) < 10
+    intents = set()
+    if any(p in lower for p in LEGACY_SIMPLE) and short:
+        intents.add("simple")
+    if any(kw in lower for kw in LEGACY_ESCALATION_SIMPLE) and short:
+        intents.add("greeting")
+    if any(kw in lower for kw in LEGACY_CRITICAL):
+        intents.add("critical")
+    return {"language": language, "intents": intents}
+
+
+def legacy_escalate(analysis: Dict, confidence: float, threshold: float, context_available: bool) -> bool:
+    if "greeting" in analysis["intents"]:
+        return False
+    if context_available and confidence >= 0.65:
+        return False
+    if confidence >= threshold:
+        return False
+    return True
+
+
+def corpus() -> List[str]:
+    with open(QUERIES, encoding="utf-8") as f:
+        queries = [item["query"] for item in json.load(f)]
+    return queries + SMALL_TALK
+
+
+def timed(fn, texts: List[str], repeat: int) -> float:
+    """Микросекунды на сообщение"""
+    started = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            fn(text)
+    return (time.perf_counter() - started) / (repeat * len(texts)) * 1e6
+
+
+def check_reload(path: str) -> bool:
+    """Правка файла правил подхватывается без перезапуска"""
+    with open(path, encoding="utf-8") as f:
+        rules = yaml.safe_load(f)
+    with tempfile.TemporaryDirectory() as tmp:
+        rules_path = os.path.join(tmp, "rules.yaml")
+        with open(rules_path, "w", encoding="utf-8") as f:
+            yaml.safe_dump(rules, f, allow_unicode=True)
+        loader = PolicyLoader(rules_path, check_interval=0)
+        before = "pension" in loader.get().analyze("my pension question").intents
+
+        rules.setdefault("intents", {})["pension"] = {"min_confidence": 0.9, "keywords": ["pension*"]}
+        with open(rules_path, "w", encoding="utf-8") as f:
+            yaml.safe_dump(rules, f, allow_unicode=True)
+        os.utime(rules_path, (time.time() + 1, time.time() + 1))
+        after = "pension" in loader.get().analyze("my pension question").intents
+    return not before and after
+
+
+def run(args):
+    texts = corpus()
+    policy = load_policy(args.rules)
+
+    legacy_us = timed(legacy_analyze, texts, args.repeat)
+    policy_us = timed(policy.analyze, texts, args.repeat)
+
+    differences = []
+    for text in texts:
+        old, new = legacy_analyze(text), policy.analyze(text)
+        diff: Set[str] = set()
+        if old["language"] != new.language:
+            diff.add(f"язык {old['language']}→{new.language}")
+        if ("simple" in old["intents"]) != new.is_simple:
+            diff.add(f"дешевая модель {'-' if 'simple' in old['intents'] else '+'}")
+        # прежний is_simple_question сравнивается с is_simple, а не с именем интента;
+        # прежний greeting — с любым интентом small talk (с reply)
+        new_intents = {"greeting" if policy.intent_rules[intent].get("reply") else intent for intent in new.intents}
+        for intent in sorted((old["intents"] ^ new_intents) - {"simple"}):
+            diff.add(f"{intent} {'-' if intent in old['intents'] else '+'}")
+        for confidence, context_available in ((0.5, False), (0.7, True)):
+            old_escalate = legacy_escalate(old, confidence, args.threshold, context_available)
+            new_escalate, reason = policy.decide(new, confidence, args.threshold, context_available)
+            if old_escalate != new_escalate:
+                diff.add(f"эскалация@{confidence}{'+KB' if context_available else ''} {old_escalate}→{new_escalate} ({reason})")
+        if diff:
+            differences.append((text, sorted(diff)))
+
+    print(f"🧪 Сообщений: {len(texts)}, повторов: {args.repeat}")
+    print(f"⏱ Прежние проверки: {legacy_us:.1f} мкс/сообщение")
+    print(f"⏱ Политика:         {policy_us:.1f} мкс/сообщение ({legacy_us / policy_us:.1f}x)")
+    print(f"🔀 Расхождений: {len(differences)}")
+    if args.show_diff:
+        for text, diff in differences:
+            print(f"   {text[:60]!r}: {', '.join(diff)}")
+
+    reloaded = check_reload(args.rules)
+    print(f"{'✅' if reloaded else '❌'} Перечитывание правил при изменении файла")
+    if not reloaded:
+        raise SystemExit(1)
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Политика эскалации против прежних проверок подстрокой")
+    parser.add_argument("--rules", default=RULES_PATH)
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--threshold", type=float, default=float(os.getenv("CONFIDENCE_THRESHOLD", "0.7")))
+    parser.add_argument("--show-diff", action="store_true")
+    return parser
+
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -0,0 +1,93 @@
+"""
+Профиль старта бота: время импорта bot.main по модулям (python -X importtime)
+в отдельном процессе, сборка Application и, опционально, загрузка локальной
+embedding модели.
+
+    python -m benchmarks.startup --top 20
+    LLM_PROVIDER=groq python -m benchmarks.startup --local-model
+"""
+
+import os
+import sys
+import time
+import argparse
+import subprocess
+from typing import Dict, List, Tuple
+
+ENTRYPOINT = "bot.main"
+
+
+def profile_imports(module: str) -> Tuple[float, List[Tuple[str, int, int]]]:
+    """Returns: (время процесса, [(модуль, self мкс, cumulative мкс)])"""
+    env = {**os.environ, "METRICS_PORT": "0"}
+    started = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        env=env
+    )
+    wall = time.perf_counter() - started
+    if result.returncode != 0:
+        raise SystemExit(f"❌ import {module} упал:\n{result.stderr[-2000:]}")
+
+    modules = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        # после "|" идет пробел, дальше по два пробела на уровень вложенности
+        modules.append((name[1:].rstrip(), int(self_us), int(cumulative_us)))
+    return wall, modules
+
+
+def by_package(modules: List[Tuple[str, int, int]]) -> Dict[str, int]:
+    """Собственное (self) время импорта, просуммированное по корневому пакету"""
+    totals: Dict[str, int] = {}
+    for name, self_us, _ in modules:
+        package = name.strip().split(".")[0]
+        totals[package] = totals.get(package, 0) + self_us
+    return totals
+
+
+def run(args):
+    wall, modules = profile_imports(args.module)
+    packages = by_package(modules)
+    total_us = sum(packages.values())
+
+    print(f"⏱ import {args.module}: {total_us / 1e6:.2f} с импорта, {wall:.2f} с процесс целиком")
+    print(f"\n📦 Пакеты (сумма self), топ-{args.top}:")
+    for package, us in sorted(packages.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"   {us / 1000:>9.1f} мс  {package}")
+
+    print(f"\n🐢 Самые тяжелые модули (self), топ-{args.top}:")
+    for name, self_us, _ in sorted(modules, key=lambda item: -item[1])[:args.top]:
+        print(f"   {self_us / 1000:>9.1f} мс  {name.strip()}")
+
+    heavy = [p for p in ("torch", "sentence_transformers", "transformers", "groq", "openai") if p in packages]
+    print(f"\n🔎 Тяжелые SDK в графе импорта: {', '.join(heavy) or 'нет'}")
+
+    os.environ.setdefault("METRICS_PORT", "0")
+    started = time.perf_counter()
+    from bot.main import build_application
+    build_application(os.getenv("TELEGRAM_BOT_TOKEN") or "0:startup-profile")
+    print(f"\n🏗 Import + build_application в этом процессе: {time.perf_counter() - started:.2f} с")
+
+    if args.local_model:
+        from bot.llm.local_embeddings import get_local_embedder
+
+        started = time.perf_counter()
+        get_local_embedder().encode(["прогрев"])
+        print(f"🧠 Загрузка локальной embedding модели + первый encode: {time.perf_counter() - started:.2f} с")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Профиль времени старта бота")
+    parser.add_argument("--module", default=ENTRYPOINT)
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--local-model", action="store_true", help="замерить загрузку sentence-transformers")
+    return parser
+
+
+if __name__ == "__main__":
+    run(build_parser().parse_args())
@@ -0,0 +1,204 @@
+"""
+Заглушки для офлайн бенчмарков: LLM, Tavily сервер и объекты Telegram
+"""
+
+import re
+import json
+import random
+import asyncio
+import hashlib
+from itertools import count
+from typing import List, Optional, Sequence, Tuple
+import numpy as np
+from bot.llm.base import BaseLLM, LLMResponse
+from bot.metrics import track_stage, record_tokens
+from bot.tracing import span
+from database.models import VECTOR_DIM
+
+
+class _Usage:
+    def __init__(self, prompt_tokens: int, completion_tokens: int):
+        self.prompt_tokens = prompt_tokens
+        self.completion_tokens = completion_tokens
+
+
+class StubLLM(BaseLLM):
+    """
+    LLM без сети: настраиваемая задержка, длина ответа и CONFIDENCE.
+    Эмбеддинги детерминированы по тексту, поэтому одинаковые вопросы
+    находят друг друга в pgvector.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.5,
+        embedding_latency: float = 0.05,
+        output_tokens: int = 200,
+        confidences: Sequence[float] = (0.9, 0.8, 0.5),
+        dim: int = VECTOR_DIM
+    ):
+        self.latency = latency
+        self.embedding_latency = embedding_latency
+        self.output_tokens = output_tokens
+        self.confidences = list(confidences)
+        self.dim = dim
+        self.model = "stub"
+        self.embedding_model = "stub-embedding"
+
+    async def generate_answer(
+        self,
+        question: str,
+        context: List[Tuple[str, str]] = None,
+        conversation_history: List[Tuple[str, str]] = None,
+        web_context: Optional[str] = None,
+        **kwargs
+    ) -> LLMResponse:
+        with track_stage("llm_completion"), span("stub.chat"):
+            await asyncio.sleep(random.expovariate(1 / self.latency) if self.latency else 0)
+
+        confidence = random.choice(self.confidences)
+        content = " ".join(["слово"] * self.output_tokens) + f"\n\nCONFIDENCE: {confidence}"
+        usage = _Usage(len(question.split()) * 2 + 300, self.output_tokens)
+        record_tokens("stub", usage)
+
+        match = re.search(r'CONFIDENCE:\s*(0?\.\d+|1\.0|0|1)', content, re.IGNORECASE)
+        clean_answer = re.sub(r'\n*CONFIDENCE:\s*[\d\.]+\s*', '', content, flags=re.IGNORECASE).strip()
+
+        return LLMResponse(
+            answer=clean_answer,
+            confidence=float(match.group(1)),
+            reasoning=f"stub, context: {len(context) if context else 0} items",
+            model=self.model,
+            prompt_tokens=usage.prompt_tokens,
+            completion_tokens=usage.completion_tokens
+        )
+
+    async def generate_embedding(self, text: str) -> List[float]:
+        with span("stub.embedding"):
+            await asyncio.sleep(self.embedding_latency)
+
+        seed = int.from_bytes(hashlib.sha256(text.strip().lower().encode()).digest()[:8], "little")
+        vector = np.random.default_rng(seed).standard_normal(self.dim).astype(np.float32)
+        return (vector / np.linalg.norm(vector)).tolist()
+
+
+class StubTavilyServer:
+    """Минимальный HTTP сервер на localhost, отвечающий как Tavily /search"""
+
+    def __init__(self, latency: float = 0.3, host: str = "127.0.0.1", port: int = 0):
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.requests = 0
+        self._server: Optional[asyncio.base_events.Server] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}/search"
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._server:
+            self._server.close()
+            await self._server.wait_closed()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            headers = await reader.readuntil(b"\r\n\r\n")
+            length = 0
+            for line in headers.decode("latin-1").split("\r\n"):
+                if line.lower().startswith("content-length:"):
+                    length = int(line.split(":", 1)[1])
+            payload = json.loads(await reader.readexactly(length) or b"{}")
+
+            self.requests += 1
+            await asyncio.sleep(self.latency)
+
+            body = json.dumps({
+                "query": payload.get("query", ""),
+                "answer": "Стаб-ответ из веб-поиска.",
+                "results": [
+                    {
+                        "title": f"Источник {i}",
+                        "url": f"https://example.org/{i}",
+                        "content": "Описание " * 40,
+                        "raw_content": "Полный текст " * 2000,
+                    }
+                    for i in range(payload.get("max_results", 5))
+                ],
+            }).encode()
+
+            writer.write(
+                b"HTTP/1.1 200 OK\r\nContent-Type: application/json\r\n"
+                + f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode()
+                + body
+            )
+            await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError):
+            # Клиент отменил запрос (спекулятивный веб-поиск)
+            pass
+        finally:
+            writer.close()
+
+
+_message_ids = count(1)
+
+
+class FakeBot:
+    """Бот, который только имитирует задержку Telegram API"""
+
+    def __init__(self, latency: float = 0.05):
+        self.latency = latency
+        self.sent = 0
+
+    async def send_message(self, chat_id: int, text: str, **kwargs):
+        await asyncio.sleep(self.latency)
+        self.sent += 1
+
+
+class FakeChat:
+    def __init__(self, chat_id: int, bot: FakeBot):
+        self.id = chat_id
+        self._bot = bot
+
+    async def send_action(self, action: str):
+        await asyncio.sleep(self._bot.latency / 2)
+
+
+class FakeUser:
+    def __init__(self, user_id: int):
+        self.id = user_id
+        self.username = f"bench{user_id}"
+        self.first_name = "Bench"
+        self.last_name = str(user_id)
+
+
+class FakeMessage:
+    def __init__(self, text: str, chat: FakeChat, bot: FakeBot):
+        self.text = text
+        self.chat = chat
+        self.message_id = next(_message_ids)
+        self._bot = bot
+
+    async def reply_text(self, text: str, **kwargs):
+        await self._bot.send_message(self.chat.id, text)
+
+
+class FakeUpdate:
+    """Подмножество telegram.Update, которое используют хендлеры"""
+
+    def __init__(self, user_id: int, text: str, bot: FakeBot):
+        self.update_id = next(_message_ids)
+        self.effective_user = FakeUser(user_id)
+        self.effective_chat = FakeChat(user_id, bot)
+        self.message = FakeMessage(text, self.effective_chat, bot)
+        self.effective_message = self.message
+
+
+class FakeContext:
+    def __init__(self, bot: FakeBot, args: Optional[List[str]] = None):
+        self.bot = bot
+        self.args = args or []
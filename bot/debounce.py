@@ -0,0 +1,143 @@
+"""
+Склейка вопроса, разбитого на несколько сообщений подряд:
+сообщения чата копятся, пока между ними меньше DEBOUNCE_WINDOW секунд
+(но не дольше DEBOUNCE_MAX_WAIT от первого), затем уходят в конвейер
+одним вопросом.
+
+Склеенные вопросы обрабатываются в отдельных задачах; их число ограничено
+UPDATE_WORKERS: новый буфер ждет свободного места, поэтому очередь апдейтов
+(и 503 в webhook режиме) по-прежнему сдерживает нагрузку на LLM
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Awaitable, Callable, Dict, List, Optional, Set
+from bot.metrics import Counter, REGISTRY, ERRORS
+from bot.tracing import span
+
+logger = logging.getLogger(__name__)
+
+MESSAGES_MERGED = REGISTRY.register(Counter(
+    "fsoul_debounce_merged_messages_total",
+    "Messages folded into an earlier message of the same question"
+))
+
+Callback = Callable[[object, object, str], Awaitable[None]]
+
+
+class _Pending:
+    def __init__(self):
+        self.texts: List[str] = []
+        self.first_at = time.monotonic()
+        self.update = None
+        self.context = None
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class MessageDebouncer:
+    def __init__(
+        self,
+        callback: Callback,
+        window: float = None,
+        max_wait: float = None,
+        max_messages: int = 10,
+        concurrency: int = None
+    ):
+        self.callback = callback
+        self.window = window if window is not None else float(os.getenv("DEBOUNCE_WINDOW", "1.5"))
+        self.max_wait = max_wait if max_wait is not None else float(os.getenv("DEBOUNCE_MAX_WAIT", "6"))
+        self.max_messages = max_messages
+        self.concurrency = concurrency if concurrency is not None else int(os.getenv("UPDATE_WORKERS", "8"))
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self._pending: Dict[int, _Pending] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._running: Dict[int, int] = {}
+        self._tasks: Set[asyncio.Task] = set()
+
+    async def submit(self, chat_id: int, update, context, text: str):
+        """Добавляет сообщение в буфер чата; конвейер запустится по таймеру"""
+        if self.window <= 0:
+            await self.callback(update, context, text)
+            return
+
+        pending = self._pending.get(chat_id)
+        if pending is None:
+            # Место занимается на весь путь буфера: накопление, ожидание лока чата и ответ
+            await self._slots.acquire()
+            pending = self._pending.get(chat_id)
+            if pending is None:
+                pending = self._pending[chat_id] = _Pending()
+            else:
+                self._slots.release()
+                MESSAGES_MERGED.inc()
+        else:
+            MESSAGES_MERGED.inc()
+
+        pending.texts.append(text)
+        pending.update = update
+        pending.context = context
+
+        if pending.timer:
+            pending.timer.cancel()
+
+        remaining = self.max_wait - (time.monotonic() - pending.first_at)
+        if len(pending.texts) >= self.max_messages or remaining <= 0:
+            self._flush(chat_id)
+            return
+
+        pending.timer = asyncio.get_running_loop().call_later(
+            min(self.window, remaining), self._flush, chat_id
+        )
+
+    def _flush(self, chat_id: int):
+        pending = self._pending.pop(chat_id, None)
+        if pending is None:
+            return
+        if pending.timer:
+            pending.timer.cancel()
+
+        task = asyncio.create_task(self._run(chat_id, pending))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, chat_id: int, pending: _Pending):
+        # Следующая порция того же чата ждет, пока ответим на предыдущую
+        lock = self._locks.setdefault(chat_id, asyncio.Lock())
+        self._running[chat_id] = self._running.get(chat_id, 0) + 1
+        try:
+            async with lock:
+                if len(pending.texts) > 1:
+                    logger.info(f"🧩 Склеено {len(pending.texts)} сообщений чата {chat_id}")
+                with span("question.debounced", chat_id=chat_id, messages=len(pending.texts)):
+                    await self.callback(pending.update, pending.context, "\n".join(pending.texts))
+        except Exception as e:
+            await self._report_error(chat_id, pending, e)
+        finally:
+            self._slots.release()
+            self._running[chat_id] -= 1
+            if not self._running[chat_id]:
+                del self._running[chat_id]
+                del self._locks[chat_id]
+
+    async def _report_error(self, chat_id: int, pending: _Pending, error: Exception):
+        """Задача оторвана от апдейта — передаем ошибку в error handlers приложения (ответ пользователю)"""
+        application = getattr(pending.context, "application", None)
+        if application is not None:
+            try:
+                await application.process_error(pending.update, error)
+                return
+            except Exception as e:
+                logger.error(f"❌ Ошибка в обработчике ошибок для чата {chat_id}: {e}")
+        logger.error(f"❌ Ошибка обработки вопроса чата {chat_id}: {error}", exc_info=error)
+        ERRORS.inc(provider="bot", stage="handler")
+
+    async def drain(self):
+        """
+        Отправляет в конвейер все накопленное и дожидается ответов.
+        Вызывается из post_stop, пока бот еще может отправлять сообщения
+        """
+        for chat_id in list(self._pending):
+            self._flush(chat_id)
+        await asyncio.gather(*self._tasks, return_exceptions=True)
@@ -1,8 +1,10 @@
 from telegram import Update
 from telegram.ext import ContextTypes
 from database import get_db
-from database.models import Question, User, PendingQuestion
+from database.models import Question, User, PendingQuestion, KnowledgeBase
 from utils.improved_rag import ImprovedRAGSystemWithTavily
+from utils.kb_usage import hot_set
+from utils.response_cache import response_cache
 from bot.llm import get_llm
 import os
 from datetime import datetime
@@ -187,5 +189,113 @@ async def stats_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if total_questions > 0:
             ai_percentage = (answered_by_ai / total_questions) * 100
             message += f"\n💡 AI решает *{ai_percentage:.1f}%* вопросов автоматически"
+
+        llm = get_llm()
+        hit_rate = llm.cache.hit_rate() if hasattr(llm, "cache") else None
+        if hit_rate is not None:
+            message += f"\n🧮 Кеш эмбеддингов: `{hit_rate * 100:.0f}%` попаданий\n"
+
+        if hasattr(llm, "health"):
+            message += "\n\n🔌 *LLM провайдеры:*\n"
+            for p in llm.health():
+                latency = f"p50 {p['p50']:.1f}с, p95 {p['p95']:.1f}с" if p["p50"] is not None else "нет данных"
+                message += f"`{p['provider']}`: `{p['state']}`, ok {p['ok']:.0f}, ошибок {p['errors']:.0f}, {latency}\n"
+
+        await update.message.reply_text(message, parse_mode="Markdown")
+
+
+async def review_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Показывает непроверенные записи KB, собранные из веб-поиска"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ Эта команда доступна только администраторам")
+        return
+    
+    with get_db() as db:
+        entries = db.query(KnowledgeBase).filter(
+            KnowledgeBase.verified == False,
+            KnowledgeBase.source == "web"
+        ).order_by(KnowledgeBase.usage_count.desc(), KnowledgeBase.created_at.desc()).limit(10).all()
+        
+        if not entries:
+            await update.message.reply_text("✅ Нет веб-ответов на проверке!")
+            return
+        
+        message = "🌐 Веб-ответы на проверке:\n\n"
+        
+        for entry in entries:
+            answer_preview = entry.answer
+            if len(answer_preview) > 300:
+                answer_preview = answer_preview[:297] + "..."
+            
+            message += (
+                f"#{entry.id} | использований: {entry.usage_count or 0}\n"
+                f"❓ {entry.question[:200]}\n"
+                f"💬 {answer_preview}\n\n"
+            )
+        
+        message += "✅ /promote <ID> [исправленный ответ]\n🗑 /reject <ID>"
+        
+        await update.message.reply_text(message)
+
+
+async def promote_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    Подтверждает веб-ответ (при необходимости с исправленным текстом)
+    Формат: /promote <ID записи> [ответ]
+    """
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ Эта команда доступна только администраторам")
+        return
+    
+    try:
+        entry_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("❌ Используй: /promote <ID записи> [исправленный ответ]")
+        return
+    
+    with get_db() as db:
+        entry = db.query(KnowledgeBase).filter(KnowledgeBase.id == entry_id).first()
+        
+        if not entry:
+            await update.message.reply_text(f"❌ Запись #{entry_id} не найдена")
+            return
+        
+        if len(context.args) > 1:
+            entry.answer = " ".join(context.args[1:])
+        entry.verified = True
+        entry.source = "admin"
+        response_cache.invalidate(db, [entry.id])
+        db.commit()
+    
+    hot_set.invalidate()
+    await update.message.reply_text(f"✅ Запись #{entry_id} подтверждена и используется как проверенная")
+
+
+async def reject_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Удаляет непроверенный веб-ответ из базы знаний"""
+    if not is_admin(update.effective_user.id):
+        await update.message.reply_text("⛔ Эта команда доступна только администраторам")
+        return
+    
+    try:
+        entry_id = int(context.args[0])
+    except (IndexError, ValueError):
+        await update.message.reply_text("❌ Используй: /reject <ID записи>")
+        return
+    
+    with get_db() as db:
+        entry = db.query(KnowledgeBase).filter(
+            KnowledgeBase.id == entry_id,
+            KnowledgeBase.verified == False
+        ).first()
+        
+        if not entry:
+            await update.message.reply_text(f"❌ Непроверенная запись #{entry_id} не найдена")
+            return
         
-        await update.message.reply_text(message, parse_mode="Markdown")
\ No newline at end of file
+        response_cache.invalidate(db, [entry.id])
+        db.delete(entry)
+        db.commit()
+    
+    hot_set.invalidate()
+    await update.message.reply_text(f"🗑 Запись #{entry_id} удалена")
@@ -5,9 +5,25 @@ from database.models import User, Question, PendingQuestion
 from utils.improved_rag import ImprovedRAGSystemWithTavily
 from bot.llm import get_llm
 from bot.handlers.admin import is_admin
+from bot.metrics import track_stage, QUESTIONS
+from bot.tracing import span
+from bot.debounce import MessageDebouncer
+from utils.rate_limit import check_rate_limit, should_notify_throttled, current_requester
+from utils.question_embeddings import should_persist, question_backfill
+from utils.web_knowledge import web_knowledge
+from utils.escalation_policy import get_policy
+import logging
 import os
 from datetime import datetime
 
+logger = logging.getLogger(__name__)
+
+THROTTLE_MESSAGES = {
+    'ru': "Вы отправляете сообщения слишком часто. Пожалуйста, подождите {seconds} с и повторите вопрос.",
+    'en': "You're sending messages too quickly. Please wait {seconds} s and ask again.",
+    'pt': "Você está enviando mensagens rápido demais. Aguarde {seconds} s e pergunte novamente."
+}
+
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик команды /start"""
@@ -32,7 +48,10 @@ async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "Доступные команды:\n"
             "/pending - вопросы в ожидании\n"
             "/stats - статистика бота\n"
-            "/answer <ID> <текст> - ответить на вопрос"
+            "/answer <ID> <текст> - ответить на вопрос\n"
+            "/review - веб-ответы на проверке\n"
+            "/promote <ID> [текст] - подтвердить веб-ответ\n"
+            "/reject <ID> - удалить веб-ответ"
         )
     else:
         await update.message.reply_text(
@@ -53,7 +72,10 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
             "👨‍💼 Команды:\n"
             "/pending - очередь вопросов\n"
             "/stats - статистика\n"
-            "/answer <ID> <текст> - ответить\n\n"
+            "/answer <ID> <текст> - ответить\n"
+            "/review - веб-ответы на проверке\n"
+            "/promote <ID> [текст] - подтвердить\n"
+            "/reject <ID> - удалить\n\n"
             "🤖 Бот автоматически учится на ваших ответах!"
         )
     else:
@@ -69,40 +91,51 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 async def handle_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Складывает сообщения чата в debounce буфер — вопрос может прийти несколькими сообщениями"""
+    await debouncer.submit(update.effective_chat.id, update, context, update.message.text)
+
+
+async def answer_question(update: Update, context: ContextTypes.DEFAULT_TYPE, question_text: str):
     """Улучшенный обработчик вопросов с контекстом"""
-    question_text = update.message.text
     user_tg_id = update.effective_user.id
     
-    lang = detect_language(question_text)
+    policy = get_policy()
+    analysis = policy.analyze(question_text)
+    lang = analysis.language
+    
+    if not is_admin(user_tg_id):
+        allowed, retry_after = check_rate_limit(user_tg_id)
+        if not allowed:
+            logger.info(f"🚦 Ограничение частоты для {user_tg_id}, повтор через {retry_after:.0f} с")
+            if should_notify_throttled(user_tg_id, retry_after):
+                await update.message.reply_text(
+                    THROTTLE_MESSAGES.get(lang, THROTTLE_MESSAGES['ru']).format(seconds=max(1, round(retry_after)))
+                )
+            return
+    
+    current_requester.set(user_tg_id)
+    
+    if analysis.small_talk:
+        await answer_small_talk(update, question_text, policy.reply(analysis.small_talk, lang))
+        return
     
     await update.message.chat.send_action("typing")
     
     with get_db() as db:
-        user = db.query(User).filter(User.telegram_id == user_tg_id).first()
-        if not user:
-            user = User(
-                telegram_id=user_tg_id,
-                username=update.effective_user.username,
-                first_name=update.effective_user.first_name,
-                last_name=update.effective_user.last_name
-            )
-            db.add(user)
-            db.commit()
-            db.refresh(user)
+        user = get_or_create_user(db, update)
         
         llm = get_llm()
-        question_embedding = await llm.generate_embedding(question_text)
         
-        question = Question(
-            user_id=user.id,
-            message_id=update.message.message_id,
-            question_text=question_text,
-            question_embedding=question_embedding,
-            status="processing"
-        )
-        db.add(question)
-        db.commit()
-        db.refresh(question)
+        with track_stage("db_write"):
+            question = Question(
+                user_id=user.id,
+                message_id=update.message.message_id,
+                question_text=question_text,
+                status="processing"
+            )
+            db.add(question)
+            db.commit()
+            db.refresh(question)
         
         rag = ImprovedRAGSystemWithTavily(
         llm=llm,
@@ -113,41 +146,58 @@ async def handle_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
             question=question_text,
             user_id=user.id,
             use_web_search=False,  
-            search_depth="basic"
+            search_depth="basic",
+            analysis=analysis
         )
                 
         threshold = float(os.getenv("CONFIDENCE_THRESHOLD", "0.7"))
         
-        should_escalate = should_escalate_to_admin(
-            question_text=question_text,
+        should_escalate = policy.should_escalate(
+            analysis=analysis,
             confidence=confidence,
             threshold=threshold,
             context_available=len(context_data) > 0
         )
         
-        print(f"📊 Q: {question_text[:50]}... | Conf: {confidence:.2%} | Escalate: {should_escalate}")
+        logger.info(f"📊 Q: {question_text[:50]}... | Conf: {confidence:.2%} | Escalate: {should_escalate}")
+        signals = rag.confidence_signals.to_dict() if rag.confidence_signals else None
         
         if not should_escalate:
-            question.answer_text = answer
-            question.confidence_score = confidence
-            question.answered_by_ai = True
-            question.status = "answered"
-            question.answered_at = datetime.utcnow()
-            db.commit()
+            QUESTIONS.inc(outcome="answered")
             
-            await update.message.reply_text(answer)
+            with track_stage("db_write"):
+                question.answer_text = answer
+                question.confidence_score = confidence
+                question.confidence_signals = signals
+                question.answered_by_ai = True
+                question.status = "answered"
+                question.answered_at = datetime.utcnow()
+                attach_embedding(question, rag)
+                db.commit()
+            
+            with track_stage("telegram_send"):
+                await update.message.reply_text(answer)
+            
+            if any(source == "Web Search" for source, _ in context_data):
+                web_knowledge.record(rag.llm, question_text, answer, confidence)
             
         else:
-            question.confidence_score = confidence
-            question.status = "escalated"
-            db.commit()
+            QUESTIONS.inc(outcome="escalated")
             
-            pending = PendingQuestion(
-                question_id=question.id,
-                user_telegram_id=user_tg_id
-            )
-            db.add(pending)
-            db.commit()
+            with track_stage("db_write"):
+                question.confidence_score = confidence
+                question.confidence_signals = signals
+                question.ai_answer = answer
+                question.status = "escalated"
+                attach_embedding(question, rag)
+                db.commit()
+                
+                pending = PendingQuestion(
+                    question_id=question.id,
+                    user_telegram_id=user_tg_id
+                )
+                db.add(pending)
+                db.commit()
             
             escalation_messages = {
                 'ru': "Ваш вопрос требует детального изучения. Я проконсультируюсь с коллегами и вернусь с точным ответом в ближайшее время.",
@@ -155,61 +205,60 @@ async def handle_question(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 'pt': "Sua pergunta requer análise detalhada. Vou consultar colegas e retornarei com uma resposta precisa em breve."
             }
             
-            await update.message.reply_text(escalation_messages.get(lang, escalation_messages['ru']))
-            
-            await notify_admins(update, context, question.id, user, question_text, confidence)
+            with track_stage("telegram_send"):
+                await update.message.reply_text(escalation_messages.get(lang, escalation_messages['ru']))
+                
+                await notify_admins(update, context, question.id, user, question_text, confidence)
 
 
-def should_escalate_to_admin(
-    question_text: str,
-    confidence: float,
-    threshold: float,
-    context_available: bool
-) -> bool:
-    """
-    Умная логика эскалации к админу
-    """
-    
-    simple_keywords = [
-        'привет', 'спасибо', 'здравствуй', 'пока', 'благодарю',
-        'hi', 'hello', 'thanks', 'thank you', 'bye',
-        'olá', 'obrigado', 'tchau'
-    ]
-    
-    q_lower = question_text.lower()
-    if any(kw in q_lower for kw in simple_keywords) and len(question_text.split()) < 10:
-        return False
-    
-    if context_available and confidence >= 0.65:
-        return False
-    
-    if confidence >= threshold:
-        return False
-    
-    critical_keywords = [
-        'депортация', 'отказ', 'судебный', 'апелляция',
-        'deportation', 'refusal', 'court', 'appeal',
-        'deportação', 'recusa', 'tribunal'
-    ]
-    
-    if any(kw in q_lower for kw in critical_keywords) and confidence < 0.75:
-        return True
-    
-    return confidence < threshold
+def attach_embedding(question: Question, rag: ImprovedRAGSystemWithTavily):
+    """Сохраняет эмбеддинг из поиска по KB, если он нужен политике; пропуски досчитает backfill"""
+    if not should_persist(question.status):
+        return
+    if rag.query_embedding is not None:
+        question.question_embedding = rag.query_embedding
+    else:
+        question_backfill.request(rag.llm)
 
 
-def detect_language(text: str) -> str:
-    """Простое определение языка вопроса"""
-    text_lower = text.lower()
-    
-    if any(c in 'абвгдежзийклмнопрстуфхцчшщъыьэюя' for c in text_lower):
-        return 'ru'
+def get_or_create_user(db, update: Update) -> User:
+    with track_stage("user_lookup"):
+        user = db.query(User).filter(User.telegram_id == update.effective_user.id).first()
+        if not user:
+            user = User(
+                telegram_id=update.effective_user.id,
+                username=update.effective_user.username,
+                first_name=update.effective_user.first_name,
+                last_name=update.effective_user.last_name
+            )
+            db.add(user)
+            db.commit()
+            db.refresh(user)
+    return user
+
+
+async def answer_small_talk(update: Update, question_text: str, answer: str):
+    """Шаблонный ответ без эмбеддинга, KB и LLM — в базу пишется только строка вопроса"""
+    with get_db() as db:
+        user = get_or_create_user(db, update)
+        
+        with track_stage("db_write"):
+            db.add(Question(
+                user_id=user.id,
+                message_id=update.message.message_id,
+                question_text=question_text,
+                answer_text=answer,
+                confidence_score=1.0,
+                answered_by_ai=True,
+                status="answered",
+                answered_at=datetime.utcnow()
+            ))
+            db.commit()
     
-    pt_words = ['você', 'não', 'sim', 'obrigado', 'por favor', 'está', 'também', 'quando']
-    if any(word in text_lower for word in pt_words):
-        return 'pt'
+    QUESTIONS.inc(outcome="template")
     
-    return 'en'
+    with track_stage("telegram_send"):
+        await update.message.reply_text(answer)
 
 
 async def notify_admins(
@@ -238,6 +287,10 @@ async def notify_admins(
     
     for admin_id in admin_ids:
         try:
-            await bot.send_message(chat_id=admin_id, text=message_text)
+            with span("telegram.send_message", chat_id=admin_id):
+                await bot.send_message(chat_id=admin_id, text=message_text)
         except Exception as e:
-            print(f"⚠️ Не удалось отправить админу {admin_id}: {e}")
\ No newline at end of file
+            logger.warning(f"⚠️ Не удалось отправить админу {admin_id}: {e}")
+
+
+debouncer = MessageDebouncer(answer_question)
@@ -1,16 +1,62 @@
 import os
+import importlib
+from typing import Optional
 from bot.llm.base import BaseLLM
-from bot.llm.groq import GroqLLM
-from bot.llm.openai import ImprovedOpenAILLM
+
+# Модуль провайдера (и его SDK) импортируется только когда провайдер выбран
+PROVIDERS = {
+    "openai": "bot.llm.openai:ImprovedOpenAILLM",
+    "groq": "bot.llm.groq:GroqLLM",
+}
+
+# Провайдеры без своего embeddings API — им нужна локальная модель
+LOCAL_EMBEDDING_PROVIDERS = {"groq"}
+
+_llm: Optional[BaseLLM] = None
+
+
+def create_provider(name: str) -> BaseLLM:
+    if name not in PROVIDERS:
+        raise ValueError(f"Unknown LLM provider: {name}")
+    module_name, class_name = PROVIDERS[name].split(":")
+    return getattr(importlib.import_module(module_name), class_name)()
 
 
 def get_llm() -> BaseLLM:
-    """Factory для получения LLM провайдера"""
+    """
+    Factory для получения LLM провайдера.
+    С LLM_FALLBACK_PROVIDERS (через запятую) основной провайдер оборачивается
+    в RoutingLLM, с EMBEDDING_CACHE эмбеддинги идут через кеш.
+    Экземпляр общий на процесс — circuit breakers и клиенты
+    переживают отдельные запросы
+    """
+    global _llm
+    if _llm is not None:
+        return _llm
+
     provider = os.getenv("LLM_PROVIDER", "ollama").lower()
-    
-    if provider == "openai":
-        return ImprovedOpenAILLM()
-    elif provider == "groq":
-        return GroqLLM()
+    fallbacks = [
+        name.strip().lower()
+        for name in os.getenv("LLM_FALLBACK_PROVIDERS", "").split(",")
+        if name.strip() and name.strip().lower() != provider
+    ]
+
+    if fallbacks:
+        from bot.llm.router import RoutingLLM
+
+        _llm = RoutingLLM([(name, create_provider(name)) for name in [provider] + fallbacks])
     else:
-        raise ValueError(f"Unknown LLM provider: {provider}")
\ No newline at end of file
+        _llm = create_provider(provider)
+
+    from utils.embedding_cache import EMBEDDING_CACHE_ENABLED
+    if EMBEDDING_CACHE_ENABLED:
+        from utils.embedding_cache import CachedEmbeddingsLLM, embedding_cache
+
+        _llm = CachedEmbeddingsLLM(_llm, embedding_cache)
+
+    return _llm
+
+
+def needs_local_embeddings() -> bool:
+    """Эмбеддинги основного провайдера считаются локальной моделью"""
+    return os.getenv("LLM_PROVIDER", "ollama").lower() in LOCAL_EMBEDDING_PROVIDERS
@@ -1,12 +1,24 @@
+import os
 from abc import ABC, abstractmethod
-from typing import Tuple, List
+from typing import Tuple, List, Optional
 from pydantic import BaseModel
 
+# Детерминированная генерация: temperature=0 и фиксированный seed —
+# одинаковый вход дает одинаковый ответ, его можно кешировать
+DETERMINISTIC = os.getenv("LLM_DETERMINISTIC", "false").lower() == "true"
+DETERMINISTIC_SEED = int(os.getenv("LLM_SEED", "42"))
+
 
 class LLMResponse(BaseModel):
     answer: str
-    confidence: float  # 0.0 - 1.0
+    confidence: float  # 0.0 - 1.0, самооценка модели
+    token_confidence: Optional[float] = None  # средняя вероятность токенов (logprobs)
     reasoning: str = ""
+    failed: bool = False  # провайдер вернул заглушку из-за ошибки API
+    truncated: bool = False  # ответ оборван по max_tokens
+    model: str = ""
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
 
 
 class BaseLLM(ABC):
@@ -41,4 +53,17 @@ class BaseLLM(ABC):
         Returns:
             Вектор эмбеддинга
         """
-        pass
\ No newline at end of file
+        pass
+
+    async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Эмбеддинги для пачки текстов (провайдеры переопределяют одним запросом)"""
+        return [await self.generate_embedding(text) for text in texts]
+
+    @property
+    def embedding_model_id(self) -> str:
+        """Идентификатор embedding модели — часть ключа кеша эмбеддингов"""
+        return type(self).__name__
+
+    async def prefetch_embeddings(self, texts: List[str]) -> int:
+        """Прогрев кеша эмбеддингов перед пакетной задачей (без кеша — ничего)"""
+        return 0
\ No newline at end of file
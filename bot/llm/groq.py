@@ -1,8 +1,17 @@
 import os
-import re
-from typing import List, Tuple
-from bot.llm.base import BaseLLM, LLMResponse
-from groq import Groq
+import logging
+from typing import List, Tuple, Optional
+from bot.llm.base import BaseLLM, LLMResponse, DETERMINISTIC, DETERMINISTIC_SEED
+from bot.metrics import track_stage, record_tokens, ERRORS
+from bot.tracing import span
+from bot.llm.tiers import LARGE, SMALL, max_tokens_for
+from bot.llm.structured import (
+    MISSING_CONFIDENCE, output_instructions, response_format, parse_completion, is_truncated
+)
+from bot.llm.local_embeddings import get_local_embedder
+from groq import AsyncGroq
+
+logger = logging.getLogger(__name__)
 
 
 class GroqLLM(BaseLLM):
@@ -11,15 +20,23 @@ class GroqLLM(BaseLLM):
         if not self.api_key:
             raise ValueError("GROQ_API_KEY not found in environment variables")
         
-        self.client = Groq(api_key=self.api_key)
+        self.client = AsyncGroq(api_key=self.api_key)
         self.model = os.getenv("GROQ_MODEL", "llama-3.3-70b-versatile")
+        self.models = {
+            LARGE: self.model,
+            SMALL: os.getenv("GROQ_SMALL_MODEL", "llama-3.1-8b-instant"),
+        }
     
     async def generate_answer(
         self, 
         question: str, 
-        context: List[Tuple[str, str]] = None
+        context: List[Tuple[str, str]] = None,
+        conversation_history: List[Tuple[str, str]] = None,
+        web_context: Optional[str] = None,
+        tier: str = LARGE
     ) -> LLMResponse:
         """Генерирует ответ через Groq API"""
+        model = self.models.get(tier, self.model)
         
         system_prompt = """Ты — Сергей, профессиональный консультант по иммиграции в Португалию.
 
@@ -42,9 +59,6 @@ class GroqLLM(BaseLLM):
 Сначала дай прямой ответ на вопрос, потом детали и объяснения. Пиши так, будто набираешь на телефоне - естественно и без вычурности.
 
 ОЦЕНКА УВЕРЕННОСТИ:
-В конце КАЖДОГО ответа ОБЯЗАТЕЛЬНО добавь строку:
-CONFIDENCE: [число от 0.0 до 1.0]
-
 Критерии уверенности:
 - 0.9-1.0: Точная информация из базы знаний, полностью уверен
 - 0.7-0.8: Хорошее понимание темы, общая информация корректна
@@ -57,10 +71,16 @@ CONFIDENCE: [число от 0.0 до 1.0]
 - Базируйся на информации из базы знаний
 - Если информации недостаточно, честно признай это и поставь низкую уверенность
 - Не придумывай факты, лучше признать незнание
-- НИКАКОГО MARKDOWN - только простой текст!"""
+- НИКАКОГО MARKDOWN - только простой текст!""" + output_instructions()
 
         user_prompt = f"Вопрос клиента: {question}\n\n"
         
+        if conversation_history and len(conversation_history) > 0:
+            user_prompt += "📜 История нашего разговора:\n"
+            for q, a in conversation_history[-3:]:
+                user_prompt += f"Клиент: {q}\nТы: {a[:100]}...\n\n"
+            user_prompt += "---\n\n"
+        
         if context and len(context) > 0:
             user_prompt += "📚 Релевантная информация из базы знаний:\n\n"
             for i, (q, a) in enumerate(context[:3], 1):
@@ -71,79 +91,77 @@ CONFIDENCE: [число от 0.0 до 1.0]
         else:
             user_prompt += "⚠️ В базе знаний не найдено похожих вопросов. Отвечай на основе общих знаний, но будь осторожен с уверенностью.\n\n"
         
-        user_prompt += "Дай структурированный ответ от имени Сергея с оценкой уверенности в конце."
+        if web_context:
+            user_prompt += f"🌐 Актуальная информация из интернета:\n{web_context}\n\n"
+        
+        user_prompt += "Дай структурированный ответ от имени Сергея с оценкой уверенности."
         
         try:
-            chat_completion = self.client.chat.completions.create(
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                model=self.model,
-                temperature=0.7,
-                max_tokens=1500,
-                top_p=1,
-                stream=False
-            )
-            
-            content = chat_completion.choices[0].message.content
-            
-            confidence = self._extract_confidence(content)
+            with track_stage("llm_completion"), span("groq.chat", model=model, tier=tier):
+                chat_completion = await self.client.chat.completions.create(
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    model=model,
+                    temperature=0.0 if DETERMINISTIC else 0.7,
+                    max_tokens=max_tokens_for(tier, 1500),
+                    top_p=1,
+                    seed=DETERMINISTIC_SEED if DETERMINISTIC else None,
+                    response_format=response_format(),
+                    stream=False
+                )
+            record_tokens("groq", chat_completion.usage)
             
-            clean_answer = re.sub(
-                r'\n*CONFIDENCE:\s*[\d\.]+\s*', 
-                '', 
-                content, 
-                flags=re.IGNORECASE
-            ).strip()
+            choice = chat_completion.choices[0]
+            clean_answer, confidence = parse_completion(choice.message.content)
+            truncated = is_truncated(choice.finish_reason)
+            if truncated:
+                logger.warning(f"⚠️ Ответ Groq оборван по max_tokens ({model})")
+            elif confidence is None:
+                logger.warning(f"⚠️ Самооценка не найдена в ответе LLM, используем {MISSING_CONFIDENCE}")
             
             return LLMResponse(
                 answer=clean_answer,
-                confidence=confidence,
-                reasoning=f"Groq API ({self.model}), context items: {len(context) if context else 0}"
+                confidence=MISSING_CONFIDENCE if confidence is None else confidence,
+                truncated=truncated,
+                reasoning=f"Groq API ({model}), context items: {len(context) if context else 0}",
+                model=model,
+                prompt_tokens=chat_completion.usage.prompt_tokens if chat_completion.usage else 0,
+                completion_tokens=chat_completion.usage.completion_tokens if chat_completion.usage else 0
             )
             
         except Exception as e:
-            print(f"❌ Groq API error: {e}")
+            logger.error(f"❌ Groq API error: {e}")
+            ERRORS.inc(provider="groq", stage="llm_completion")
             return LLMResponse(
                 answer="Извините, произошла техническая ошибка. Пожалуйста, повторите вопрос через несколько минут.",
                 confidence=0.0,
-                reasoning=f"Error: {str(e)}"
+                reasoning=f"Error: {str(e)}",
+                failed=True
             )
     
-    def _extract_confidence(self, text: str) -> float:
-        """Извлекает значение confidence из текста"""
-        match = re.search(r'CONFIDENCE:\s*(0?\.\d+|1\.0|0|1)', text, re.IGNORECASE)
-        if match:
-            try:
-                confidence_value = float(match.group(1))
-                return max(0.0, min(1.0, confidence_value))
-            except ValueError:
-                pass
-        
-        print("⚠️ CONFIDENCE не найдена в ответе LLM, используем 0.5")
-        return 0.5
-    
+    @property
+    def embedding_model_id(self) -> str:
+        return f"local:{get_local_embedder().model_name}"
+
     async def generate_embedding(self, text: str) -> List[float]:
         """
         Groq не предоставляет embeddings API.
         Используем локальную модель sentence-transformers.
         """
+        return (await self.generate_embeddings([text]))[0]
+
+    async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Пачка эмбеддингов одним проходом локальной модели"""
+        if not texts:
+            return []
         try:
-            from sentence_transformers import SentenceTransformer
-            
-            if not hasattr(self, '_embedding_model'):
-                print("🔄 Загрузка embedding модели...")
-                self._embedding_model = SentenceTransformer('sentence-transformers/all-mpnet-base-v2')
-            
-            embedding = self._embedding_model.encode(text)
-            return embedding.tolist()
-            
+            with span("local.embedding", batch=len(texts)):
+                return await get_local_embedder().aencode(texts)
         except ImportError:
-            raise ImportError(
-                "sentence-transformers not installed. "
-                "Install it with: pip install sentence-transformers"
-            )
+            raise
         except Exception as e:
-            print(f"❌ Embedding generation error: {e}")
-            return [0.0] * 768
\ No newline at end of file
+            logger.error(f"❌ Embedding generation error: {e}")
+            ERRORS.inc(provider="groq", stage="embedding")
+            return [[0.0] * 768 for _ in texts]
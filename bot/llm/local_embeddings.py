@@ -0,0 +1,328 @@
+"""
+Локальная embedding модель — одна на процесс, бэкенд задается LOCAL_EMBEDDING_BACKEND:
+- torch (по умолчанию) — sentence-transformers в полной точности
+- onnx — модель, экспортированная в ONNX, через onnxruntime
+- onnx-int8 — то же с динамическим int8 квантованием весов (быстрее и легче на CPU)
+
+ONNX модель экспортируется один раз и хранится в LOCAL_EMBEDDING_CACHE_DIR,
+рантайму нужны только onnxruntime и tokenizers. Тяжелые библиотеки
+импортируются при первой загрузке, prewarm() загружает модель в фоне.
+Одновременные aencode() собираются в один батч (LOCAL_EMBEDDING_BATCH_WAIT_MS).
+"""
+
+import os
+import asyncio
+import logging
+import threading
+from typing import List, Optional, Tuple
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+LOCAL_EMBEDDING_MODEL = os.getenv("LOCAL_EMBEDDING_MODEL", "sentence-transformers/all-mpnet-base-v2")
+LOCAL_EMBEDDING_BACKEND = os.getenv("LOCAL_EMBEDDING_BACKEND", "torch").lower()
+LOCAL_EMBEDDING_CACHE_DIR = os.getenv("LOCAL_EMBEDDING_CACHE_DIR", ".cache/embeddings")
+# 0 — решает библиотека (обычно все ядра)
+LOCAL_EMBEDDING_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", "0"))
+LOCAL_EMBEDDING_MAX_BATCH = int(os.getenv("LOCAL_EMBEDDING_MAX_BATCH", "32"))
+LOCAL_EMBEDDING_MAX_LENGTH = int(os.getenv("LOCAL_EMBEDDING_MAX_LENGTH", "384"))
+LOCAL_EMBEDDING_BATCH_WAIT_MS = float(os.getenv("LOCAL_EMBEDDING_BATCH_WAIT_MS", "5"))
+
+
+class TorchBackend:
+    """sentence-transformers на PyTorch"""
+
+    name = "torch"
+
+    def __init__(self, model_name: str, threads: int = LOCAL_EMBEDDING_THREADS):
+        self.model_name = model_name
+        self.threads = threads
+        self._model = None
+
+    def load(self):
+        try:
+            from sentence_transformers import SentenceTransformer
+        except ImportError:
+            raise ImportError(
+                "sentence-transformers not installed. "
+                "Install it with: pip install sentence-transformers"
+            )
+        if self.threads > 0:
+            import torch
+            torch.set_num_threads(self.threads)
+        self._model = SentenceTransformer(self.model_name)
+
+    def encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        return self._model.encode(texts, batch_size=batch_size, convert_to_numpy=True)
+
+
+class OnnxBackend:
+    """
+    Экспортированная модель в onnxruntime: mean pooling по attention mask
+    и L2 нормализация, как у sentence-transformers моделей семейства all-*
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        quantized: bool = False,
+        cache_dir: str = LOCAL_EMBEDDING_CACHE_DIR,
+        threads: int = LOCAL_EMBEDDING_THREADS,
+        max_length: int = LOCAL_EMBEDDING_MAX_LENGTH
+    ):
+        self.model_name = model_name
+        self.quantized = quantized
+        self.name = "onnx-int8" if quantized else "onnx"
+        self.directory = os.path.join(cache_dir, model_name.replace("/", "__"))
+        self.threads = threads
+        self.max_length = max_length
+        self._session = None
+        self._tokenizer = None
+        self._inputs: List[str] = []
+
+    @property
+    def model_path(self) -> str:
+        return os.path.join(self.directory, "model.int8.onnx" if self.quantized else "model.onnx")
+
+    def load(self):
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError:
+            raise ImportError(
+                "onnxruntime not installed. "
+                "Install it with: pip install onnxruntime"
+            )
+
+        if not os.path.exists(self.model_path):
+            export_onnx(self.model_name, self.directory, quantize=self.quantized)
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if self.threads > 0:
+            options.intra_op_num_threads = self.threads
+        options.inter_op_num_threads = 1
+        self._session = ort.InferenceSession(self.model_path, options, providers=["CPUExecutionProvider"])
+        self._inputs = [i.name for i in self._session.get_inputs()]
+
+        self._tokenizer = Tokenizer.from_file(os.path.join(self.directory, "tokenizer.json"))
+        self._tokenizer.enable_truncation(max_length=self.max_length)
+
+    def encode(self, texts: List[str], batch_size: int) -> np.ndarray:
+        # сортировка по длине — в батч попадают тексты близкой длины, меньше паддинга
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        sorted_vectors = np.concatenate([
+            self._encode_batch([texts[i] for i in order[start:start + batch_size]])
+            for start in range(0, len(order), batch_size)
+        ])
+        result = np.empty_like(sorted_vectors)
+        result[order] = sorted_vectors
+        return result
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self._tokenizer.encode_batch(texts)
+        length = max(len(e.ids) for e in encodings)
+        input_ids = np.zeros((len(texts), length), dtype=np.int64)
+        attention_mask = np.zeros((len(texts), length), dtype=np.int64)
+        for row, encoding in enumerate(encodings):
+            input_ids[row, :len(encoding.ids)] = encoding.ids
+            attention_mask[row, :len(encoding.ids)] = 1
+
+        feed = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self._inputs:
+            feed["token_type_ids"] = np.zeros_like(input_ids)
+        hidden = self._session.run(None, {k: v for k, v in feed.items() if k in self._inputs})[0]
+
+        mask = attention_mask[:, :, None].astype(np.float32)
+        pooled = (hidden * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        return pooled / np.clip(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12, None)
+
+
+def export_onnx(model_name: str, directory: str, quantize: bool = False) -> str:
+    """
+    Экспортирует transformer модели в ONNX (и int8 копию) в directory.
+    Нужны torch и transformers — один раз, при сборке образа или первой загрузке.
+    Returns: путь к model.onnx
+    """
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, "model.onnx")
+
+    if not os.path.exists(path):
+        logger.info(f"📦 Экспорт {model_name} в ONNX → {directory}")
+        tokenizer = AutoTokenizer.from_pretrained(model_name)
+        tokenizer.save_pretrained(directory)
+        model = AutoModel.from_pretrained(model_name).eval()
+
+        sample = tokenizer(["export sample"], return_tensors="pt")
+        names = [n for n in ("input_ids", "attention_mask", "token_type_ids") if n in sample]
+        axes = {n: {0: "batch", 1: "sequence"} for n in names}
+        axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+        tmp_path = path + ".tmp"
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                tuple(sample[n] for n in names),
+                tmp_path,
+                input_names=names,
+                output_names=["last_hidden_state"],
+                dynamic_axes=axes,
+                opset_version=17,
+                dynamo=False
+            )
+        os.replace(tmp_path, path)
+
+    if quantize:
+        int8_path = os.path.join(directory, "model.int8.onnx")
+        if not os.path.exists(int8_path):
+            from onnxruntime.quantization import QuantType, quantize_dynamic
+
+            logger.info(f"📦 int8 квантование {path}")
+            tmp_path = int8_path + ".tmp"
+            quantize_dynamic(path, tmp_path, weight_type=QuantType.QInt8)
+            os.replace(tmp_path, int8_path)
+
+    return path
+
+
+def make_backend(name: str, model_name: str):
+    if name == "torch":
+        return TorchBackend(model_name)
+    if name in ("onnx", "onnx-int8"):
+        return OnnxBackend(model_name, quantized=name == "onnx-int8")
+    raise ValueError(f"Unknown LOCAL_EMBEDDING_BACKEND: {name}")
+
+
+class MicroBatcher:
+    """
+    Собирает одновременные запросы одного event loop в один батч:
+    ждет до wait секунд или пока не наберется max_batch текстов
+    """
+
+    def __init__(self, encode, max_batch: int, wait: float):
+        self.encode = encode
+        self.max_batch = max_batch
+        self.wait = wait
+        self.loop = asyncio.get_running_loop()
+        self._pending: List[Tuple[List[str], asyncio.Future]] = []
+        self._size = 0
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def submit(self, texts: List[str]) -> List[List[float]]:
+        future = self.loop.create_future()
+        self._pending.append((texts, future))
+        self._size += len(texts)
+
+        if self._size >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = self.loop.call_later(self.wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending, self._size = self._pending, [], 0
+        if batch:
+            self.loop.create_task(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[List[str], asyncio.Future]]):
+        texts = [text for request, _ in batch for text in request]
+        try:
+            vectors = await asyncio.to_thread(self.encode, texts)
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        offset = 0
+        for request, future in batch:
+            if not future.done():
+                future.set_result(vectors[offset:offset + len(request)])
+            offset += len(request)
+
+
+class LocalEmbedder:
+    def __init__(self, model_name: str = LOCAL_EMBEDDING_MODEL, backend: str = LOCAL_EMBEDDING_BACKEND):
+        self.model_name = model_name
+        self.backend_name = backend
+        self.max_batch = LOCAL_EMBEDDING_MAX_BATCH
+        self._backend = None
+        self._lock = threading.Lock()
+        # один инференс за раз: параллельные прогоны только делят ядра
+        self._infer_lock = threading.Lock()
+        self._batcher: Optional[MicroBatcher] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self._backend is not None
+
+    def load(self):
+        """Загружает бэкенд (потокобезопасно, один раз); ONNX без onnxruntime → torch"""
+        if self._backend is not None:
+            return self._backend
+
+        with self._lock:
+            if self._backend is None:
+                logger.info(f"🔄 Загрузка embedding модели {self.model_name} ({self.backend_name})...")
+                backend = make_backend(self.backend_name, self.model_name)
+                try:
+                    backend.load()
+                except ImportError as e:
+                    if backend.name == "torch":
+                        raise
+                    logger.warning(f"⚠️ {backend.name} недоступен ({e}), используем torch")
+                    backend = make_backend("torch", self.model_name)
+                    backend.load()
+                self._backend = backend
+        return self._backend
+
+    def prewarm(self) -> Optional[threading.Thread]:
+        """Загружает модель в фоне, не задерживая старт"""
+        if self.loaded:
+            return None
+
+        def run():
+            try:
+                self.load()
+                logger.info("🔥 Embedding модель прогрета")
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось прогреть embedding модель: {e}")
+
+        thread = threading.Thread(target=run, name="embedding-prewarm", daemon=True)
+        thread.start()
+        return thread
+
+    def encode(self, texts: List[str]) -> List[List[float]]:
+        backend = self.load()
+        with self._infer_lock:
+            vectors = backend.encode(texts, self.max_batch)
+        return [vector.tolist() for vector in vectors]
+
+    async def aencode(self, texts: List[str]) -> List[List[float]]:
+        """encode в отдельном потоке; одновременные вызовы объединяются в батч"""
+        if LOCAL_EMBEDDING_BATCH_WAIT_MS <= 0:
+            return await asyncio.to_thread(self.encode, texts)
+
+        loop = asyncio.get_running_loop()
+        if self._batcher is None or self._batcher.loop is not loop:
+            self._batcher = MicroBatcher(self.encode, self.max_batch, LOCAL_EMBEDDING_BATCH_WAIT_MS / 1000)
+        return await self._batcher.submit(texts)
+
+
+_embedder: Optional[LocalEmbedder] = None
+
+
+def get_local_embedder() -> LocalEmbedder:
+    global _embedder
+    if _embedder is None:
+        _embedder = LocalEmbedder()
+    return _embedder
@@ -1,10 +1,20 @@
 import os
-import re
+import logging
 from typing import List, Tuple, Optional
-from bot.llm.base import BaseLLM, LLMResponse
+from bot.llm.base import BaseLLM, LLMResponse, DETERMINISTIC, DETERMINISTIC_SEED
+from bot.metrics import track_stage, record_tokens, ERRORS
+from bot.tracing import span
+from bot.llm.tiers import LARGE, SMALL, max_tokens_for
+from bot.llm.structured import (
+    LOGPROBS, MISSING_CONFIDENCE, output_instructions, response_format, parse_completion, token_confidence,
+    is_truncated
+)
+from bot.llm.local_embeddings import get_local_embedder
 from openai import AsyncOpenAI
 import httpx
 
+logger = logging.getLogger(__name__)
+
 
 class ImprovedOpenAILLM(BaseLLM):
     def __init__(self):
@@ -16,7 +26,7 @@ class ImprovedOpenAILLM(BaseLLM):
         http_client = None
         
         if proxy_url:
-            print(f"🔐 Using proxy for OpenAI: {proxy_url}")
+            logger.info(f"🔐 Using proxy for OpenAI: {proxy_url}")
             http_client = httpx.AsyncClient(
                 proxy=proxy_url,
                 timeout=30.0
@@ -28,6 +38,10 @@ class ImprovedOpenAILLM(BaseLLM):
         )
         
         self.model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
+        self.models = {
+            LARGE: self.model,
+            SMALL: os.getenv("OPENAI_SMALL_MODEL", "gpt-4o-mini"),
+        }
         self.embedding_model = os.getenv("OPENAI_EMBEDDING_MODEL", "text-embedding-3-small")
     
     
@@ -36,8 +50,10 @@ class ImprovedOpenAILLM(BaseLLM):
         question: str, 
         context: List[Tuple[str, str]] = None,
         conversation_history: List[Tuple[str, str]] = None,
-        web_context: Optional[str] = None
+        web_context: Optional[str] = None,
+        tier: str = LARGE
     ) -> LLMResponse:
+        model = self.models.get(tier, self.model)
         
         system_prompt = """
             Вы — Сергей, эксперт по иммиграции, бизнесу и юридическим вопросам в Португалии.
@@ -102,12 +118,7 @@ class ImprovedOpenAILLM(BaseLLM):
             ✅ Говорите на языке вопроса (русский / английский / португальский)  
             ✅ Отвечайте как эксперт, а не как модель  
             ✅ Не извиняйтесь без причины  
-            ✅ Не переусложняйте ответы — клиент должен понять всё сразу  
-            ✅ В конце каждого ответа добавляйте:  
-            CONFIDENCE: [число от 0.0 до 1.0]
-
-            В конце ответа ОБЯЗАТЕЛЬНО добавь:
-            CONFIDENCE: [число 0.0-1.0]"""
+            ✅ Не переусложняйте ответы — клиент должен понять всё сразу""" + output_instructions()
 
         user_prompt = f"Вопрос клиента: {question}\n\n"
         
@@ -132,97 +143,87 @@ class ImprovedOpenAILLM(BaseLLM):
         user_prompt += "Дай профессиональный ответ с правильной оценкой уверенности."
         
         try:
-            response = await self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                temperature=0.5, 
-                max_tokens=2000,
-                top_p=0.9
-            )
-            
-            content = response.choices[0].message.content
+            with track_stage("llm_completion"), span("openai.chat", model=model, tier=tier) as call:
+                response = await self.client.chat.completions.create(
+                    model=model,
+                    messages=[
+                        {"role": "system", "content": system_prompt},
+                        {"role": "user", "content": user_prompt}
+                    ],
+                    temperature=0.0 if DETERMINISTIC else 0.5, 
+                    max_tokens=max_tokens_for(tier, 2000),
+                    top_p=1.0 if DETERMINISTIC else 0.9,
+                    seed=DETERMINISTIC_SEED if DETERMINISTIC else None,
+                    response_format=response_format(),
+                    logprobs=LOGPROBS
+                )
+                if response.usage:
+                    call.set(completion_tokens=response.usage.completion_tokens)
+            record_tokens("openai", response.usage)
             
-            confidence = self._extract_confidence(content)
-            
-            clean_answer = re.sub(
-                r'\n*CONFIDENCE:\s*[\d\.]+\s*', 
-                '', 
-                content, 
-                flags=re.IGNORECASE
-            ).strip()
-            
-            if context and len(context) > 0:
-                confidence = max(confidence, 0.75)  
+            choice = response.choices[0]
+            clean_answer, confidence = parse_completion(choice.message.content)
+            truncated = is_truncated(choice.finish_reason)
+            if truncated:
+                logger.warning(f"⚠️ Ответ OpenAI оборван по max_tokens ({model})")
+            elif confidence is None:
+                logger.warning(f"⚠️ Самооценка не найдена, используем {MISSING_CONFIDENCE}")
             
             return LLMResponse(
                 answer=clean_answer,
-                confidence=confidence,
-                reasoning=f"OpenAI {self.model}, context: {len(context) if context else 0} items"
+                confidence=MISSING_CONFIDENCE if confidence is None else confidence,
+                token_confidence=token_confidence(choice.logprobs),
+                truncated=truncated,
+                reasoning=f"OpenAI {model}, context: {len(context) if context else 0} items",
+                model=model,
+                prompt_tokens=response.usage.prompt_tokens if response.usage else 0,
+                completion_tokens=response.usage.completion_tokens if response.usage else 0
             )
             
         except Exception as e:
-            print(f"❌ OpenAI API error: {e}")
+            logger.error(f"❌ OpenAI API error: {e}")
+            ERRORS.inc(provider="openai", stage="llm_completion")
             return LLMResponse(
                 answer="Извините, произошла техническая ошибка. Пожалуйста, повторите вопрос через минуту.",
                 confidence=0.0,
-                reasoning=f"Error: {str(e)}"
+                reasoning=f"Error: {str(e)}",
+                failed=True
             )
     
-    def _extract_confidence(self, text: str) -> float:
-        """Извлекает значение confidence из текста с улучшенной логикой"""
-        match = re.search(r'CONFIDENCE:\s*(0?\.\d+|1\.0|0|1)', text, re.IGNORECASE)
-        if match:
-            try:
-                confidence_value = float(match.group(1))
-                return max(0.0, min(1.0, confidence_value))
-            except ValueError:
-                pass
-        
-        text_lower = text.lower()
-        
-        if any(phrase in text_lower for phrase in [
-            'точно могу сказать',
-            'определенно',
-            'согласно закон',
-            'официально',
-            'требуется следующее'
-        ]):
-            print("ℹ️ Высокая уверенность определена по тексту")
-            return 0.85
-        
-        if any(phrase in text_lower for phrase in [
-            'не уверен',
-            'рекомендую проконсультироваться',
-            'лучше уточнить',
-            'может потребоваться',
-            'не могу точно сказать'
-        ]):
-            print("ℹ️ Низкая уверенность определена по тексту")
-            return 0.4
-        
-        print("⚠️ CONFIDENCE не найдена, используем 0.6")
-        return 0.6
-    
+    @property
+    def embedding_model_id(self) -> str:
+        return f"openai:{self.embedding_model}"
+
     async def generate_embedding(self, text: str) -> List[float]:
         """Генерирует эмбеддинг через OpenAI API"""
         try:
-            response = await self.client.embeddings.create(
-                model=self.embedding_model,
-                input=text,
-                encoding_format="float"
-            )
+            with span("openai.embeddings", model=self.embedding_model):
+                response = await self.client.embeddings.create(
+                    model=self.embedding_model,
+                    input=text,
+                    encoding_format="float"
+                )
             return response.data[0].embedding
         except Exception as e:
-            print(f"❌ OpenAI Embedding error: {e}")
-            try:
-                from sentence_transformers import SentenceTransformer
-                if not hasattr(self, '_embedding_model'):
-                    print("🔄 Fallback: loading local embedding model...")
-                    self._embedding_model = SentenceTransformer('sentence-transformers/all-mpnet-base-v2')
-                embedding = self._embedding_model.encode(text)
-                return embedding.tolist()
-            except ImportError:
-                raise ImportError("sentence-transformers not installed for fallback")
\ No newline at end of file
+            logger.error(f"❌ OpenAI Embedding error: {e}")
+            ERRORS.inc(provider="openai", stage="embedding")
+            logger.info("🔄 Fallback: local embedding model")
+            embeddings = await get_local_embedder().aencode([text])
+            return embeddings[0]
+
+    async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """Пачка эмбеддингов одним запросом к OpenAI API"""
+        if not texts:
+            return []
+        try:
+            with span("openai.embeddings", model=self.embedding_model, batch=len(texts)):
+                response = await self.client.embeddings.create(
+                    model=self.embedding_model,
+                    input=texts,
+                    encoding_format="float"
+                )
+            return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+        except Exception as e:
+            logger.error(f"❌ OpenAI batch embedding error: {e}")
+            ERRORS.inc(provider="openai", stage="embedding")
+            return await super().generate_embeddings(texts)
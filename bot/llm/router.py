@@ -0,0 +1,232 @@
+"""
+Маршрутизация между LLM провайдерами: circuit breaker на каждого,
+переключение на следующего при ошибке или таймауте и опциональный
+hedging — если первый не уложился в LLM_HEDGE_AFTER, параллельно
+запускается следующий, побеждает первый успешный ответ.
+"""
+
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+from bot.llm.base import BaseLLM, LLMResponse
+from bot.llm.tiers import LARGE
+from bot.metrics import Counter, Gauge, Histogram, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+PROVIDER_REQUESTS = REGISTRY.register(Counter(
+    "fsoul_llm_provider_requests_total",
+    "LLM completions per provider and result",
+    ["provider", "result"]
+))
+PROVIDER_LATENCY = REGISTRY.register(Histogram(
+    "fsoul_llm_provider_latency_seconds",
+    "Successful LLM completion latency per provider",
+    ["provider"]
+))
+PROVIDER_HEALTH = REGISTRY.register(Gauge(
+    "fsoul_llm_provider_up",
+    "1 if the provider circuit is closed, 0 if open",
+    ["provider"]
+))
+HEDGED_REQUESTS = REGISTRY.register(Counter(
+    "fsoul_llm_hedged_requests_total",
+    "Extra LLM requests fired after the latency SLO was missed"
+))
+
+FAILURE_ANSWER = "Извините, произошла техническая ошибка. Пожалуйста, повторите вопрос через минуту."
+
+
+class CircuitBreaker:
+    """
+    closed → open после failure_threshold ошибок подряд.
+    Через reset_timeout пропускает одну пробную попытку (half-open):
+    успех закрывает цепь, ошибка снова открывает
+    """
+
+    def __init__(self, failure_threshold: int = 3, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at: Optional[float] = None
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at >= self.reset_timeout:
+            return "half_open"
+        return "open"
+
+    def allow(self) -> bool:
+        state = self.state
+        if state == "closed":
+            return True
+        if state == "half_open":
+            # Следующая проба — не раньше чем через reset_timeout
+            self.opened_at = time.monotonic()
+            return True
+        return False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self):
+        self.failures += 1
+        if self.opened_at is not None or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+
+class Provider:
+    def __init__(self, name: str, llm: BaseLLM, breaker: CircuitBreaker):
+        self.name = name
+        self.llm = llm
+        self.breaker = breaker
+        PROVIDER_HEALTH.set(1, provider=name)
+
+
+class RoutingLLM(BaseLLM):
+    """
+    Оборачивает несколько провайдеров в порядке приоритета.
+    Эмбеддинги всегда считает первый провайдер: векторы разных
+    моделей несовместимы с уже сохраненными в pgvector
+    """
+
+    def __init__(
+        self,
+        providers: List[Tuple[str, BaseLLM]],
+        timeout: float = None,
+        hedge_after: float = None,
+        failure_threshold: int = None,
+        reset_timeout: float = None
+    ):
+        if not providers:
+            raise ValueError("RoutingLLM requires at least one provider")
+
+        self.timeout = timeout if timeout is not None else float(os.getenv("LLM_TIMEOUT", "30"))
+        self.hedge_after = hedge_after if hedge_after is not None else float(os.getenv("LLM_HEDGE_AFTER", "0"))
+        failure_threshold = failure_threshold or int(os.getenv("LLM_BREAKER_FAILURES", "3"))
+        reset_timeout = reset_timeout or float(os.getenv("LLM_BREAKER_RESET", "30"))
+
+        self.providers = [
+            Provider(name, llm, CircuitBreaker(failure_threshold, reset_timeout))
+            for name, llm in providers
+        ]
+
+    @property
+    def model(self) -> str:
+        return getattr(self.providers[0].llm, "model", self.providers[0].name)
+
+    @property
+    def embedding_model(self) -> str:
+        return getattr(self.providers[0].llm, "embedding_model", self.providers[0].name)
+
+    async def _call(self, provider: Provider, kwargs: Dict) -> Optional[LLMResponse]:
+        """Один запрос к провайдеру; None — ошибка или таймаут"""
+        started = time.perf_counter()
+        try:
+            response = await asyncio.wait_for(provider.llm.generate_answer(**kwargs), self.timeout)
+            error = (response.reasoning or "error response") if response.failed else None
+        except asyncio.TimeoutError:
+            response, error = None, f"timeout {self.timeout}s"
+        except Exception as e:
+            response, error = None, str(e)
+
+        if error:
+            provider.breaker.record_failure()
+            PROVIDER_REQUESTS.inc(provider=provider.name, result="error")
+            PROVIDER_HEALTH.set(0 if provider.breaker.state != "closed" else 1, provider=provider.name)
+            logger.warning(f"⚠️ LLM {provider.name} недоступен ({error}), circuit: {provider.breaker.state}")
+            return None
+
+        provider.breaker.record_success()
+        PROVIDER_REQUESTS.inc(provider=provider.name, result="ok")
+        PROVIDER_LATENCY.observe(time.perf_counter() - started, provider=provider.name)
+        PROVIDER_HEALTH.set(1, provider=provider.name)
+        return response
+
+    async def generate_answer(
+        self,
+        question: str,
+        context: List[Tuple[str, str]] = None,
+        conversation_history: List[Tuple[str, str]] = None,
+        web_context: Optional[str] = None,
+        tier: str = LARGE
+    ) -> LLMResponse:
+        kwargs = dict(
+            question=question,
+            context=context,
+            conversation_history=conversation_history,
+            web_context=web_context,
+            tier=tier
+        )
+        candidates = iter(self.providers)
+        pending: Dict[asyncio.Task, Provider] = {}
+
+        def launch() -> bool:
+            for provider in candidates:
+                if provider.breaker.allow():
+                    pending[asyncio.create_task(self._call(provider, kwargs))] = provider
+                    return True
+                PROVIDER_REQUESTS.inc(provider=provider.name, result="skipped")
+            return False
+
+        has_more = launch()
+        try:
+            while pending:
+                timeout = self.hedge_after if self.hedge_after and has_more else None
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+
+                if not done:
+                    # Первый не уложился в SLO — дублируем запрос следующему провайдеру
+                    has_more = launch()
+                    if has_more:
+                        HEDGED_REQUESTS.inc()
+                    continue
+
+                for task in done:
+                    pending.pop(task)
+                    response = task.result()
+                    if response is not None:
+                        return response
+
+                if not pending:
+                    has_more = launch()
+        finally:
+            for task in pending:
+                task.cancel()
+
+        logger.error("❌ Все LLM провайдеры недоступны")
+        return LLMResponse(
+            answer=FAILURE_ANSWER,
+            confidence=0.0,
+            reasoning="All LLM providers failed",
+            failed=True
+        )
+
+    async def generate_embedding(self, text: str) -> List[float]:
+        return await self.providers[0].llm.generate_embedding(text)
+
+    async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return await self.providers[0].llm.generate_embeddings(texts)
+
+    @property
+    def embedding_model_id(self) -> str:
+        return self.providers[0].llm.embedding_model_id
+
+    def health(self) -> List[Dict]:
+        """Состояние и латентность провайдеров для /stats"""
+        return [
+            {
+                "provider": p.name,
+                "state": p.breaker.state,
+                "ok": PROVIDER_REQUESTS.value(provider=p.name, result="ok"),
+                "errors": PROVIDER_REQUESTS.value(provider=p.name, result="error"),
+                "p50": PROVIDER_LATENCY.quantile(0.50, provider=p.name),
+                "p95": PROVIDER_LATENCY.quantile(0.95, provider=p.name),
+            }
+            for p in self.providers
+        ]
@@ -0,0 +1,112 @@
+"""
+Формат ответа LLM и сигналы уверенности провайдера.
+
+LLM_STRUCTURED_OUTPUT=true — модель возвращает JSON {"answer", "confidence"}
+(response_format json_object), иначе строку CONFIDENCE: в конце текста.
+LLM_LOGPROBS=true — провайдеры с logprobs (OpenAI) отдают среднюю
+вероятность токенов ответа. Итоговую уверенность считает utils/confidence.py.
+"""
+
+import os
+import re
+import json
+import math
+from typing import Optional, Tuple
+
+STRUCTURED_OUTPUT = os.getenv("LLM_STRUCTURED_OUTPUT", "true").lower() == "true"
+LOGPROBS = os.getenv("LLM_LOGPROBS", "true").lower() == "true"
+
+# Самооценка, если модель ее не дала (logit = 0 — нейтральный сигнал)
+MISSING_CONFIDENCE = 0.5
+
+CONFIDENCE_LINE = re.compile(r"\n*CONFIDENCE:\s*(0?\.\d+|1\.0|0|1)\s*", re.IGNORECASE)
+FENCED = re.compile(r"^```(?:json)?\s*(.*?)\s*```$", re.DOTALL)
+# Поля из JSON, оборванного по max_tokens: строка answer может быть не закрыта
+ANSWER_FIELD = re.compile(r'"answer"\s*:\s*"((?:[^"\\]|\\.)*)', re.DOTALL)
+CONFIDENCE_FIELD = re.compile(r'"confidence"\s*:\s*(-?[0-9.]+)')
+PARTIAL_ESCAPE = re.compile(r"\\(u[0-9a-fA-F]{0,3})?$")
+
+FREE_TEXT_INSTRUCTIONS = """
+
+В конце ответа ОБЯЗАТЕЛЬНО добавь строку:
+CONFIDENCE: [число от 0.0 до 1.0]"""
+
+JSON_INSTRUCTIONS = """
+
+ФОРМАТ ВЫВОДА:
+Верни только JSON объект, без текста вокруг:
+{"answer": "ответ клиенту", "confidence": число от 0.0 до 1.0}
+В answer — обычный текст ответа без markdown, абзацы разделяй \\n\\n."""
+
+
+def output_instructions(structured: bool = STRUCTURED_OUTPUT) -> str:
+    """Хвост системного промпта с форматом ответа"""
+    return JSON_INSTRUCTIONS if structured else FREE_TEXT_INSTRUCTIONS
+
+
+def response_format(structured: bool = STRUCTURED_OUTPUT) -> Optional[dict]:
+    return {"type": "json_object"} if structured else None
+
+
+def _clip(value) -> Optional[float]:
+    try:
+        return max(0.0, min(1.0, float(value)))
+    except (TypeError, ValueError):
+        return None
+
+
+def _partial_json(text: str) -> Tuple[str, Optional[float]]:
+    """answer и confidence из невалидного или оборванного JSON"""
+    match = ANSWER_FIELD.search(text)
+    if not match:
+        return "", None
+    raw = PARTIAL_ESCAPE.sub("", match.group(1))
+    try:
+        answer = json.loads(f'"{raw}"')
+    except ValueError:
+        answer = raw.replace("\\n", "\n").replace('\\"', '"')
+    confidence = CONFIDENCE_FIELD.search(text)
+    return answer.strip(), _clip(confidence.group(1)) if confidence else None
+
+
+def parse_completion(content: str) -> Tuple[str, Optional[float]]:
+    """
+    Текст ответа и самооценка модели: JSON, затем строка CONFIDENCE:.
+    Сырой JSON наружу не отдается: из оборванного берется строка answer.
+    Returns: (answer, confidence или None, если оценки нет)
+    """
+    text = (content or "").strip()
+    fenced = FENCED.match(text)
+    if fenced:
+        text = fenced.group(1)
+    elif text.startswith("```"):
+        # оборванный блок кода без закрывающих ```
+        text = re.sub(r"^```(?:json)?\s*", "", text)
+
+    if text.startswith("{"):
+        try:
+            data = json.loads(text)
+            answer = str(data.get("answer", "")).strip()
+            if answer:
+                return answer, _clip(data.get("confidence"))
+        except (ValueError, AttributeError):
+            pass
+        return _partial_json(text)
+
+    match = CONFIDENCE_LINE.search(content or "")
+    confidence = _clip(match.group(1)) if match else None
+    return CONFIDENCE_LINE.sub("", content or "").strip(), confidence
+
+
+def is_truncated(finish_reason: Optional[str]) -> bool:
+    """Ответ оборван по max_tokens — такой ответ не отправляется клиенту без проверки"""
+    return finish_reason == "length"
+
+
+def token_confidence(logprobs) -> Optional[float]:
+    """exp(среднего logprob) по токенам completion; None, если провайдер их не вернул"""
+    tokens = getattr(logprobs, "content", None) or []
+    values = [t.logprob for t in tokens if t.logprob is not None]
+    if not values:
+        return None
+    return math.exp(sum(values) / len(values))
@@ -0,0 +1,87 @@
+"""
+Выбор модели по сложности вопроса: простые вопросы и уверенные
+совпадения с KB идут в дешевую модель с коротким ответом,
+остальное — в основную.
+"""
+
+import os
+import logging
+from typing import List, Tuple
+from bot.metrics import Counter, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SMALL = "small"
+LARGE = "large"
+
+ROUTING_ENABLED = os.getenv("LLM_TIER_ROUTING", "true").lower() == "true"
+SMALL_TIER_SIMILARITY = float(os.getenv("LLM_SMALL_TIER_SIMILARITY", "0.85"))
+SMALL_TIER_MAX_WORDS = int(os.getenv("LLM_SMALL_TIER_MAX_WORDS", "40"))
+SMALL_MAX_TOKENS = int(os.getenv("LLM_SMALL_MAX_TOKENS", "500"))
+
+# USD за 1M токенов (prompt, completion)
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "llama-3.3-70b-versatile": (0.59, 0.79),
+    "llama-3.1-8b-instant": (0.05, 0.08),
+}
+
+ROUTE_DECISIONS = REGISTRY.register(Counter(
+    "fsoul_llm_route_decisions_total",
+    "Model tier chosen for a question",
+    ["tier", "reason"]
+))
+LLM_COST = REGISTRY.register(Counter(
+    "fsoul_llm_cost_usd_total",
+    "Estimated LLM spend",
+    ["model"]
+))
+
+
+def choose_tier(
+    question: str,
+    kb_context: List[Tuple[str, str, float]],
+    is_simple: bool,
+    has_web_context: bool = False
+) -> Tuple[str, str]:
+    """Возвращает (tier, причина)"""
+    if not ROUTING_ENABLED:
+        return LARGE, "disabled"
+
+    # is_simple — сообщение целиком подтверждение (интент simple с match: full)
+    if is_simple:
+        return SMALL, "simple"
+
+    if has_web_context:
+        return LARGE, "web"
+
+    top_similarity = kb_context[0][2] if kb_context else 0.0
+    if top_similarity >= SMALL_TIER_SIMILARITY and len(question.split()) <= SMALL_TIER_MAX_WORDS:
+        return SMALL, "kb_match"
+
+    return LARGE, "kb_low" if kb_context else "no_kb"
+
+
+def max_tokens_for(tier: str, default: int) -> int:
+    return SMALL_MAX_TOKENS if tier == SMALL else default
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    prompt_price, completion_price = MODEL_PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def record_route(tier: str, reason: str, response, latency: float):
+    """Логирует решение маршрутизации вместе с фактической латентностью и стоимостью"""
+    cost = estimate_cost(response.model, response.prompt_tokens, response.completion_tokens)
+    ROUTE_DECISIONS.inc(tier=tier, reason=reason)
+    if response.model:
+        LLM_COST.inc(cost, model=response.model)
+
+    logger.info(
+        f"🧭 Модель: {tier} ({reason}) → {response.model or 'n/a'}, "
+        f"{latency:.2f} с, {response.prompt_tokens}+{response.completion_tokens} токенов, ${cost:.5f}"
+    )
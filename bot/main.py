@@ -1,18 +1,35 @@
 import os
+import asyncio
+import logging
 from dotenv import load_dotenv
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
 
-from database import init_db
-from bot.handlers.user import start_command, help_command, handle_question
-from bot.handlers.admin import answer_command, pending_command, stats_command
+from database import init_db, engine
+from database.partitions import start_maintenance, stop_maintenance
+from bot.handlers.user import start_command, help_command, handle_question, debouncer
+from bot.handlers.admin import (
+    answer_command, pending_command, stats_command,
+    review_command, promote_command, reject_command
+)
+from utils.kb_usage import usage_tracker, hot_set
+from utils.improved_rag import TavilyWebSearch
+from utils.web_knowledge import web_knowledge
+from utils.question_embeddings import question_backfill
+from bot.metrics import start_metrics_server, ERRORS
+from bot.llm import needs_local_embeddings
+from bot.llm.local_embeddings import get_local_embedder
+from bot.tracing import configure_logging, instrument_sqlalchemy, traced_handler
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Обработчик ошибок"""
-    print(f"Update {update} caused error {context.error}")
+    logger.error(f"Update {update} caused error {context.error}", exc_info=context.error)
+    ERRORS.inc(provider="bot", stage="handler")
     
     if update and update.effective_message:
         await update.effective_message.reply_text(
@@ -20,8 +37,73 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
 
 
+async def post_init(application: Application):
+    """Прогрев горячего кеша KB и запуск фонового учета использования"""
+    if needs_local_embeddings() and os.getenv("LOCAL_EMBEDDING_PREWARM", "true").lower() == "true":
+        get_local_embedder().prewarm()
+    hot_set.load()
+    usage_tracker.start()
+    web_knowledge.start()
+    question_backfill.start()
+    start_maintenance()
+
+
+async def post_stop(application: Application):
+    """Отвечает на склеиваемые вопросы, пока бот еще инициализирован (до shutdown)"""
+    await debouncer.drain()
+
+
+async def post_shutdown(application: Application):
+    """Сбрасывает накопленные счетчики KB и останавливает фоновые задачи перед выходом"""
+    await usage_tracker.stop()
+    await web_knowledge.stop()
+    await question_backfill.stop()
+    await stop_maintenance()
+    await TavilyWebSearch.aclose()
+
+
+# Обрабатываем только сообщения (текст и команды) — остальные типы не запрашиваем
+ALLOWED_UPDATES = [Update.MESSAGE]
+
+
+def build_application(token: str, with_updater: bool = True) -> Application:
+    """Создает Application со всеми хендлерами"""
+    builder = (
+        Application.builder()
+        .token(token)
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .post_shutdown(post_shutdown)
+    )
+    if not with_updater:
+        builder = builder.updater(None)
+    
+    application = builder.build()
+    
+    application.add_handler(CommandHandler("start", traced_handler(start_command)))
+    application.add_handler(CommandHandler("help", traced_handler(help_command)))
+    
+    application.add_handler(CommandHandler("answer", traced_handler(answer_command)))
+    application.add_handler(CommandHandler("pending", traced_handler(pending_command)))
+    application.add_handler(CommandHandler("stats", traced_handler(stats_command)))
+    application.add_handler(CommandHandler("review", traced_handler(review_command)))
+    application.add_handler(CommandHandler("promote", traced_handler(promote_command)))
+    application.add_handler(CommandHandler("reject", traced_handler(reject_command)))
+    
+    application.add_handler(
+        MessageHandler(filters.TEXT & ~filters.COMMAND, traced_handler(handle_question))
+    )
+    
+    application.add_error_handler(error_handler)
+    
+    return application
+
+
 def main():
     """Запуск бота"""
+    configure_logging()
+    instrument_sqlalchemy(engine)
+    
     print("🔧 Инициализация базы данных...")
     init_db()
     
@@ -29,27 +111,32 @@ def main():
     if not token:
         raise ValueError("TELEGRAM_BOT_TOKEN не установлен в .env")
     
-    application = Application.builder().token(token).build()
-    
-    application.add_handler(CommandHandler("start", start_command))
-    application.add_handler(CommandHandler("help", help_command))
-    
-    application.add_handler(CommandHandler("answer", answer_command))
-    application.add_handler(CommandHandler("pending", pending_command))
-    application.add_handler(CommandHandler("stats", stats_command))
-    
-    application.add_handler(
-        MessageHandler(filters.TEXT & ~filters.COMMAND, handle_question)
-    )
-    
-    application.add_error_handler(error_handler)
+    mode = os.getenv("BOT_MODE", "polling").lower()
+    workers = int(os.getenv("BOT_WORKERS", "1"))
     
     print("🚀 Бот запущен!")
     print(f"📊 LLM Provider: {os.getenv('LLM_PROVIDER', 'ollama')}")
     print(f"🎯 Confidence Threshold: {os.getenv('CONFIDENCE_THRESHOLD', '0.7')}")
+    print(f"📡 Режим: {mode}, воркеров: {workers}")
+    
+    start_metrics_server()
+    
+    if mode not in ("polling", "webhook"):
+        raise ValueError(f"Unknown BOT_MODE: {mode}")
     
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    if workers > 1:
+        from bot.workers import run_multiworker
+        
+        run_multiworker(token, workers, mode, ALLOWED_UPDATES)
+    elif mode == "webhook":
+        from bot.webhook import run_webhook
+        
+        application = build_application(token, with_updater=False)
+        asyncio.run(run_webhook(application, ALLOWED_UPDATES))
+    else:
+        application = build_application(token)
+        application.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,334 @@
+"""
+Трассировка запросов: trace ID на каждый Telegram update, спаны этапов,
+структурированные JSON логи и опциональный экспорт в OTLP коллектор
+"""
+
+import os
+import json
+import time
+import queue
+import random
+import logging
+import secrets
+import threading
+import functools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Доля трасс, которые пишутся целиком; ошибки и медленные спаны пишутся всегда
+SAMPLE_RATE = float(os.getenv("TRACE_SAMPLE_RATE", "0.01"))
+SLOW_SPAN_MS = float(os.getenv("TRACE_SLOW_SPAN_MS", "0"))
+OTLP_ENDPOINT = os.getenv("OTEL_EXPORTER_OTLP_ENDPOINT", "")
+SERVICE_NAME = os.getenv("OTEL_SERVICE_NAME", "fsoul-bot")
+
+trace_logger = logging.getLogger("fsoul.trace")
+
+
+@dataclass
+class Span:
+    """Один этап обработки запроса"""
+    name: str
+    trace_id: str
+    span_id: str
+    parent_id: Optional[str]
+    sampled: bool
+    start_ns: int = field(default_factory=time.time_ns)
+    end_ns: Optional[int] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    error: Optional[str] = None
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.end_ns or time.time_ns()
+        return (end - self.start_ns) / 1e6
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current_span.get()
+
+
+def current_trace_id() -> Optional[str]:
+    span = _current_span.get()
+    return span.trace_id if span else None
+
+
+def _new_span(name: str, attributes: Dict[str, Any]) -> Span:
+    parent = _current_span.get()
+    if parent:
+        return Span(
+            name=name,
+            trace_id=parent.trace_id,
+            span_id=secrets.token_hex(8),
+            parent_id=parent.span_id,
+            sampled=parent.sampled,
+            attributes=attributes
+        )
+    return Span(
+        name=name,
+        trace_id=secrets.token_hex(16),
+        span_id=secrets.token_hex(8),
+        parent_id=None,
+        sampled=random.random() < SAMPLE_RATE,
+        attributes=attributes
+    )
+
+
+def _finish(span: Span):
+    span.end_ns = span.end_ns or time.time_ns()
+
+    slow = SLOW_SPAN_MS and span.duration_ms >= SLOW_SPAN_MS
+    if not (span.sampled or span.error or slow):
+        return
+
+    # Обычные сэмплированные спаны — DEBUG, чтобы включенная трассировка не умножала объем логов
+    level = logging.INFO if span.error or slow else logging.DEBUG
+    trace_logger.log(
+        level,
+        "span",
+        extra={
+            "span_record": {
+                "span_name": span.name,
+                "trace_id": span.trace_id,
+                "span_id": span.span_id,
+                "parent_span_id": span.parent_id,
+                "duration_ms": round(span.duration_ms, 3),
+                "attributes": span.attributes,
+                "error": span.error,
+            }
+        }
+    )
+
+    if _exporter:
+        _exporter.submit(span)
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Открывает спан. Без активного родителя начинается новый trace.
+    """
+    current = _new_span(name, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        _current_span.reset(token)
+        _finish(current)
+
+
+def record_span(name: str, start_ns: int, end_ns: int, error: Optional[str] = None, **attributes):
+    """Регистрирует уже завершившийся спан (для хуков вроде событий SQLAlchemy)"""
+    if _current_span.get() is None:
+        return
+    finished = _new_span(name, attributes)
+    finished.start_ns, finished.end_ns, finished.error = start_ns, end_ns, error
+    _finish(finished)
+
+
+def traced_handler(handler):
+    """Оборачивает Telegram handler в корневой спан с trace ID на update"""
+    @functools.wraps(handler)
+    async def wrapper(update, context):
+        attributes = {"handler": handler.__name__}
+        if update is not None:
+            attributes["update_id"] = getattr(update, "update_id", None)
+            if getattr(update, "effective_user", None):
+                attributes["user_id"] = update.effective_user.id
+            if getattr(update, "effective_chat", None):
+                attributes["chat_id"] = update.effective_chat.id
+
+        with span("telegram.update", **attributes):
+            return await handler(update, context)
+
+    return wrapper
+
+
+class TraceContextFilter(logging.Filter):
+    """Добавляет trace_id/span_id активного спана в каждую запись лога"""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        current = _current_span.get()
+        record.trace_id = current.trace_id if current else None
+        record.span_id = current.span_id if current else None
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Форматирует записи лога как одну JSON строку"""
+
+    def format(self, record: logging.LogRecord) -> str:
+        payload = {
+            "ts": datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "trace_id": getattr(record, "trace_id", None),
+            "span_id": getattr(record, "span_id", None),
+        }
+
+        span_record = getattr(record, "span_record", None)
+        if span_record:
+            payload.update(span_record)
+
+        if record.exc_info:
+            payload["exception"] = self.formatException(record.exc_info)
+
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+def configure_logging():
+    """
+    Настраивает корневой логгер.
+    LOG_FORMAT=json — структурированные логи, иначе обычный текст с trace_id.
+    """
+    handler = logging.StreamHandler()
+    handler.addFilter(TraceContextFilter())
+
+    if os.getenv("LOG_FORMAT", "json").lower() == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(
+            "%(asctime)s %(levelname)s %(name)s [%(trace_id)s] %(message)s"
+        ))
+
+    root = logging.getLogger()
+    root.handlers = [handler]
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+    # httpx логирует каждый запрос на INFO
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+    global _exporter
+    if OTLP_ENDPOINT and _exporter is None:
+        _exporter = OTLPExporter(OTLP_ENDPOINT)
+        _exporter.start()
+
+
+class OTLPExporter:
+    """Пакетная отправка спанов в OTLP/HTTP (JSON) коллектор из фонового потока"""
+
+    def __init__(self, endpoint: str, batch_size: int = 256, interval: float = 5.0):
+        self.url = endpoint.rstrip("/") + "/v1/traces"
+        self.batch_size = batch_size
+        self.interval = interval
+        self._queue: "queue.Queue[Span]" = queue.Queue(maxsize=10000)
+
+    def start(self):
+        threading.Thread(target=self._run, name="otlp-exporter", daemon=True).start()
+
+    def submit(self, finished: Span):
+        try:
+            self._queue.put_nowait(finished)
+        except queue.Full:
+            pass
+
+    def _run(self):
+        import httpx
+
+        with httpx.Client(timeout=5.0) as client:
+            while True:
+                batch = self._drain()
+                if not batch:
+                    continue
+                try:
+                    client.post(self.url, json=self._payload(batch))
+                except Exception as e:
+                    logger.warning(f"⚠️ OTLP экспорт не удался: {e}")
+
+    def _drain(self) -> List[Span]:
+        batch = []
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=timeout))
+            except queue.Empty:
+                break
+        return batch
+
+    @staticmethod
+    def _attribute(key: str, value: Any) -> Dict[str, Any]:
+        if isinstance(value, bool):
+            return {"key": key, "value": {"boolValue": value}}
+        if isinstance(value, int):
+            return {"key": key, "value": {"intValue": str(value)}}
+        if isinstance(value, float):
+            return {"key": key, "value": {"doubleValue": value}}
+        return {"key": key, "value": {"stringValue": str(value)}}
+
+    def _payload(self, batch: List[Span]) -> Dict[str, Any]:
+        spans = []
+        for s in batch:
+            item = {
+                "traceId": s.trace_id,
+                "spanId": s.span_id,
+                "name": s.name,
+                "kind": 1,
+                "startTimeUnixNano": str(s.start_ns),
+                "endTimeUnixNano": str(s.end_ns),
+                "attributes": [
+                    self._attribute(k, v) for k, v in s.attributes.items() if v is not None
+                ],
+                "status": {"code": 2, "message": s.error} if s.error else {"code": 1},
+            }
+            if s.parent_id:
+                item["parentSpanId"] = s.parent_id
+            spans.append(item)
+
+        return {
+            "resourceSpans": [{
+                "resource": {"attributes": [self._attribute("service.name", SERVICE_NAME)]},
+                "scopeSpans": [{"scope": {"name": "fsoul"}, "spans": spans}],
+            }]
+        }
+
+
+_exporter: Optional[OTLPExporter] = None
+
+
+def instrument_sqlalchemy(engine):
+    """Создает спан postgres.query на каждый SQL запрос внутри активного trace"""
+    from sqlalchemy import event
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("trace_query_start", []).append(time.time_ns())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["trace_query_start"].pop()
+        record_span(
+            "postgres.query",
+            started,
+            time.time_ns(),
+            statement=" ".join(statement.split())[:200]
+        )
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        conn = exception_context.connection
+        if conn is not None and conn.info.get("trace_query_start"):
+            started = conn.info["trace_query_start"].pop()
+            record_span(
+                "postgres.query",
+                started,
+                time.time_ns(),
+                error=str(exception_context.original_exception),
+                statement=" ".join((exception_context.statement or "").split())[:200]
+            )
@@ -0,0 +1,187 @@
+"""
+Webhook режим: Litestar + uvicorn принимают апдейты от Telegram
+и кладут их в ограниченную очередь, которую разбирают воркеры.
+
+WEBHOOK_SECRET обязателен: без заголовка X-Telegram-Bot-Api-Secret-Token
+любой, кто достучался до порта, мог бы прислать апдейт от имени админа
+"""
+
+import os
+import hmac
+import asyncio
+import logging
+from typing import Dict, List
+import uvicorn
+from litestar import Litestar, Request, Response, get, post
+from telegram import Bot, Update
+from telegram.ext import Application
+from bot.metrics import Gauge, Counter, REGISTRY
+from bot.workers import chat_id_of
+from utils.shared_state import get_store
+
+logger = logging.getLogger(__name__)
+
+UPDATE_DEDUP_TTL = 3600
+
+UPDATE_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "fsoul_update_queue_depth",
+    "Updates waiting in the ingress queue"
+))
+UPDATES_REJECTED = REGISTRY.register(Counter(
+    "fsoul_updates_rejected_total",
+    "Webhook updates rejected at ingress",
+    ["reason"]
+))
+
+
+class UpdateQueue:
+    """
+    Ограниченная очередь между ingress и обработчиками.
+    Апдейты одного чата обрабатываются по очереди (как в bot/workers.py)
+    """
+
+    def __init__(self, application: Application, maxsize: int, workers: int):
+        self.application = application
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=maxsize)
+        self.workers = workers
+        self._tasks: List[asyncio.Task] = []
+        self._chat_locks: Dict[int, asyncio.Lock] = {}
+        self._in_flight: Dict[int, int] = {}
+
+    def put_nowait(self, update: Update) -> bool:
+        try:
+            self.queue.put_nowait(update)
+        except asyncio.QueueFull:
+            return False
+        UPDATE_QUEUE_DEPTH.set(self.queue.qsize())
+        return True
+    
+    def qsize(self) -> int:
+        return self.queue.qsize()
+
+    async def _worker(self):
+        while True:
+            update = await self.queue.get()
+            UPDATE_QUEUE_DEPTH.set(self.queue.qsize())
+
+            chat_key = chat_id_of(update.to_dict())
+            chat_key = chat_key if chat_key is not None else -update.update_id
+            # Лок берется в порядке чтения из очереди (до первого await), поэтому апдейты чата идут по очереди
+            lock = self._chat_locks.setdefault(chat_key, asyncio.Lock())
+            self._in_flight[chat_key] = self._in_flight.get(chat_key, 0) + 1
+            try:
+                async with lock:
+                    if is_duplicate_update(update):
+                        continue
+                    await self.application.process_update(update)
+            except Exception as e:
+                logger.error(f"❌ Ошибка обработки апдейта {update.update_id}: {e}")
+            finally:
+                self._in_flight[chat_key] -= 1
+                if not self._in_flight[chat_key]:
+                    del self._in_flight[chat_key]
+                    del self._chat_locks[chat_key]
+                self.queue.task_done()
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+
+    async def stop(self):
+        """Дожидается уже принятых апдейтов и останавливает воркеров"""
+        await self.queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+def is_duplicate_update(update: Update) -> bool:
+    """Telegram может доставить апдейт повторно (ретраи, несколько ingress)"""
+    return not get_store().set_if_absent(f"update:{update.update_id}", True, ttl=UPDATE_DEDUP_TTL)
+
+
+def webhook_secret() -> str:
+    """WEBHOOK_SECRET из окружения; без него webhook не запускается"""
+    secret_token = os.getenv("WEBHOOK_SECRET", "")
+    if not secret_token:
+        raise ValueError("WEBHOOK_SECRET не установлен в .env (обязателен для webhook режима)")
+    return secret_token
+
+
+def create_app(sink, bot: Bot, path: str, secret_token: str) -> Litestar:
+    """
+    Собирает ASGI приложение с эндпоинтом для Telegram.
+    sink — очередь с методами put_nowait(update) -> bool и qsize()
+    """
+    if not secret_token:
+        raise ValueError("secret_token обязателен")
+
+    @post(path, status_code=200)
+    async def telegram_webhook(request: Request) -> Response:
+        received = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(received.encode(), secret_token.encode()):
+            UPDATES_REJECTED.inc(reason="secret")
+            return Response(content="", status_code=403)
+
+        update = Update.de_json(await request.json(), bot)
+
+        if not sink.put_nowait(update):
+            # Telegram повторит доставку позже
+            UPDATES_REJECTED.inc(reason="queue_full")
+            return Response(content="", status_code=503)
+
+        return Response(content="", status_code=200)
+
+    @get("/healthz")
+    async def healthz() -> dict:
+        return {"status": "ok", "queue": sink.qsize()}
+
+    return Litestar(route_handlers=[telegram_webhook, healthz], debug=False)
+
+
+async def run_webhook(application: Application, allowed_updates: List[str]):
+    """Запускает бота в webhook режиме до остановки uvicorn (SIGINT/SIGTERM)"""
+    public_url = os.getenv("WEBHOOK_URL")
+    if not public_url:
+        raise ValueError("WEBHOOK_URL не установлен в .env")
+
+    path = os.getenv("WEBHOOK_PATH", "/telegram")
+    listen = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+    port = int(os.getenv("WEBHOOK_PORT", "8080"))
+    secret_token = webhook_secret()
+
+    update_queue = UpdateQueue(
+        application,
+        maxsize=int(os.getenv("UPDATE_QUEUE_SIZE", "1000")),
+        workers=int(os.getenv("UPDATE_WORKERS", "8"))
+    )
+
+    server = uvicorn.Server(uvicorn.Config(
+        create_app(update_queue, application.bot, path, secret_token),
+        host=listen,
+        port=port,
+        log_level="warning",
+        access_log=False
+    ))
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+
+        await application.bot.set_webhook(
+            url=public_url.rstrip("/") + path,
+            allowed_updates=allowed_updates,
+            secret_token=secret_token
+        )
+        await application.start()
+        update_queue.start()
+
+        print(f"🌐 Webhook слушает {listen}:{port}{path}")
+        try:
+            await server.serve()
+        finally:
+            await update_queue.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+            await application.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
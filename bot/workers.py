@@ -0,0 +1,229 @@
+"""
+Горизонтальное масштабирование: ingress процесс получает апдейты
+(polling или webhook) и раздает их N воркер-процессам.
+
+Апдейты одного чата всегда попадают в один воркер (chat_id % N) и внутри
+него обрабатываются по порядку. Кеши, лимиты и дедупликация апдейтов
+живут в utils.shared_state — для нескольких воркеров нужен
+SHARED_STATE_BACKEND=postgres.
+"""
+
+import os
+import queue
+import signal
+import asyncio
+import logging
+import multiprocessing
+from typing import Dict, List, Optional
+import uvicorn
+from telegram import Bot, Update
+from telegram.ext import Updater
+from bot.metrics import Gauge, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+WORKER_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    "fsoul_worker_queue_depth",
+    "Updates waiting for a worker process",
+    ["worker"]
+))
+
+
+def chat_id_of(data: dict) -> Optional[int]:
+    """chat_id из сырого апдейта (update.to_dict())"""
+    for key in ("message", "edited_message", "callback_query"):
+        payload = data.get(key)
+        if not payload:
+            continue
+        chat = payload.get("chat") or (payload.get("message") or {}).get("chat")
+        if chat:
+            return chat["id"]
+    return None
+
+
+class UpdateDispatcher:
+    """Раскладывает апдейты по очередям воркеров с привязкой чата к воркеру"""
+
+    def __init__(self, queues: List[multiprocessing.Queue]):
+        self.queues = queues
+
+    def put_nowait(self, update: Update) -> bool:
+        data = update.to_dict()
+        key = chat_id_of(data)
+        index = (key if key is not None else update.update_id) % len(self.queues)
+        try:
+            self.queues[index].put_nowait(data)
+        except queue.Full:
+            return False
+        WORKER_QUEUE_DEPTH.set(self.queues[index].qsize(), worker=str(index))
+        return True
+
+    def qsize(self) -> int:
+        return sum(q.qsize() for q in self.queues)
+
+
+def worker_main(index: int, token: str, inbox: multiprocessing.Queue):
+    """Точка входа воркер-процесса"""
+    from bot.tracing import configure_logging, instrument_sqlalchemy
+    from bot.metrics import start_metrics_server
+    from database import engine
+
+    # Останавливает воркер ingress через sentinel, а не Ctrl+C всей группе
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    configure_logging()
+    instrument_sqlalchemy(engine)
+
+    base_port = int(os.getenv("METRICS_PORT", "9108"))
+    if base_port:
+        start_metrics_server(port=base_port + index + 1)
+
+    asyncio.run(_worker_loop(index, token, inbox))
+
+
+async def _worker_loop(index: int, token: str, inbox: multiprocessing.Queue):
+    from bot.main import build_application
+    from bot.webhook import is_duplicate_update
+
+    application = build_application(token, with_updater=False)
+    semaphore = asyncio.Semaphore(int(os.getenv("UPDATE_WORKERS", "8")))
+    chat_locks: Dict[int, asyncio.Lock] = {}
+    in_flight: Dict[int, int] = {}
+    tasks = set()
+
+    async def process(chat_key: int, update: Update):
+        try:
+            async with chat_locks[chat_key], semaphore:
+                await application.process_update(update)
+        except Exception as e:
+            logger.error(f"❌ Воркер {index}: ошибка обработки апдейта {update.update_id}: {e}")
+        finally:
+            in_flight[chat_key] -= 1
+            if not in_flight[chat_key]:
+                del in_flight[chat_key]
+                del chat_locks[chat_key]
+
+    loop = asyncio.get_running_loop()
+
+    async with application:
+        if application.post_init:
+            await application.post_init(application)
+        await application.start()
+        logger.info(f"👷 Воркер {index} запущен (pid {os.getpid()})")
+
+        try:
+            while True:
+                data = await loop.run_in_executor(None, inbox.get)
+                if data is None:
+                    break
+                WORKER_QUEUE_DEPTH.set(inbox.qsize(), worker=str(index))
+
+                update = Update.de_json(data, application.bot)
+                if is_duplicate_update(update):
+                    continue
+
+                chat_key = chat_id_of(data)
+                chat_key = chat_key if chat_key is not None else -update.update_id
+                # Лок создается в порядке чтения из очереди, поэтому апдейты чата идут по очереди
+                chat_locks.setdefault(chat_key, asyncio.Lock())
+                in_flight[chat_key] = in_flight.get(chat_key, 0) + 1
+
+                task = asyncio.create_task(process(chat_key, update))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        finally:
+            await asyncio.gather(*tasks, return_exceptions=True)
+            if application.post_stop:
+                await application.post_stop(application)
+            await application.stop()
+            if application.post_shutdown:
+                await application.post_shutdown(application)
+            logger.info(f"👷 Воркер {index} остановлен")
+
+
+async def _poll(bot: Bot, dispatcher: UpdateDispatcher, allowed_updates: List[str]):
+    """Polling ingress: забирает апдейты у Telegram и раздает воркерам"""
+    updates: asyncio.Queue = asyncio.Queue()
+    updater = Updater(bot=bot, update_queue=updates)
+
+    async with updater:
+        await updater.start_polling(allowed_updates=allowed_updates)
+        print("📡 Ingress: polling")
+        try:
+            while True:
+                update = await updates.get()
+                # Воркеры не успевают — придерживаем апдейт, не теряя его
+                while not dispatcher.put_nowait(update):
+                    await asyncio.sleep(0.05)
+        finally:
+            await updater.stop()
+
+
+async def _serve_webhook(bot: Bot, dispatcher: UpdateDispatcher, allowed_updates: List[str]):
+    """Webhook ingress: при заполненных очередях отвечает 503, Telegram повторит"""
+    from bot.webhook import create_app, webhook_secret
+
+    public_url = os.getenv("WEBHOOK_URL")
+    if not public_url:
+        raise ValueError("WEBHOOK_URL не установлен в .env")
+
+    path = os.getenv("WEBHOOK_PATH", "/telegram")
+    listen = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+    port = int(os.getenv("WEBHOOK_PORT", "8080"))
+    secret_token = webhook_secret()
+
+    server = uvicorn.Server(uvicorn.Config(
+        create_app(dispatcher, bot, path, secret_token),
+        host=listen,
+        port=port,
+        log_level="warning",
+        access_log=False
+    ))
+
+    async with bot:
+        await bot.set_webhook(
+            url=public_url.rstrip("/") + path,
+            allowed_updates=allowed_updates,
+            secret_token=secret_token
+        )
+        print(f"🌐 Ingress: webhook слушает {listen}:{port}{path}")
+        await server.serve()
+
+
+def _interrupt(signum, frame):
+    raise KeyboardInterrupt
+
+
+def run_multiworker(token: str, workers: int, mode: str, allowed_updates: List[str]):
+    """Запускает ingress в текущем процессе и workers воркер-процессов"""
+    if workers > 1 and os.getenv("SHARED_STATE_BACKEND", "memory").lower() == "memory":
+        logger.warning("⚠️ SHARED_STATE_BACKEND=memory: кеши и дедупликация не общие между воркерами")
+
+    context = multiprocessing.get_context("spawn")
+    maxsize = int(os.getenv("UPDATE_QUEUE_SIZE", "1000"))
+    queues = [context.Queue(maxsize=maxsize) for _ in range(workers)]
+    processes = [
+        context.Process(target=worker_main, args=(i, token, q), name=f"fsoul-worker-{i}", daemon=True)
+        for i, q in enumerate(queues)
+    ]
+    for process in processes:
+        process.start()
+
+    # SIGTERM (docker stop) превращаем в штатное завершение с остановкой воркеров
+    signal.signal(signal.SIGTERM, _interrupt)
+
+    dispatcher = UpdateDispatcher(queues)
+    ingress = _serve_webhook if mode == "webhook" else _poll
+
+    try:
+        asyncio.run(ingress(Bot(token), dispatcher, allowed_updates))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print("🛑 Останавливаем воркеров...")
+        for q in queues:
+            q.put(None)
+        for process in processes:
+            process.join(timeout=30)
+            if process.is_alive():
+                process.terminate()
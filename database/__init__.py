@@ -11,16 +11,48 @@ DATABASE_URL = os.getenv("DATABASE_URL")
 engine = create_engine(DATABASE_URL, echo=False)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Колонки, добавленные после первого релиза (create_all не меняет существующие таблицы)
+SCHEMA_UPGRADES = [
+    "ALTER TABLE knowledge_base ADD COLUMN IF NOT EXISTS last_used_at TIMESTAMP",
+    "ALTER TABLE questions ADD COLUMN IF NOT EXISTS confidence_signals JSONB",
+    "ALTER TABLE questions ADD COLUMN IF NOT EXISTS ai_answer TEXT",
+]
+
 
 def init_db():
     """Инициализация БД с pgvector"""
     from database.models import Base
     
+    from database.embeddings import check_storage_support, migrate_embedding_storage
+    
     with engine.connect() as conn:
         conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
         conn.commit()
+        check_storage_support(conn)
     
     Base.metadata.create_all(bind=engine)
+    
+    with engine.begin() as conn:
+        for statement in SCHEMA_UPGRADES:
+            conn.execute(text(statement))
+    
+    # Смена EMBEDDING_STORAGE (vector <-> halfvec) переписывает колонки эмбеддингов
+    for table in migrate_embedding_storage():
+        print(f"🔧 {table}.question_embedding переведена на новый тип хранения")
+    
+    from database.partitions import is_partitioned, ensure_partitions
+    
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            ensure_partitions(conn)
+        else:
+            print("⚠️ Таблица questions не партиционирована — переведи ее через utils/db_manager.py")
+    
+    # create_all не добавляет индексы в уже существующие таблицы
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    
     print("✅ База данных инициализирована")
 
 
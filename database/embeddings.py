@@ -0,0 +1,148 @@
+"""
+Поиск ближайших записей KB с учетом EMBEDDING_STORAGE и перевод
+существующих колонок между vector и halfvec.
+
+В режиме binary поиск двухфазный: HNSW по бинарному квантованию (hamming)
+отбирает EMBEDDING_RESCORE_CANDIDATES кандидатов, затем они
+сортируются точным косинусным расстоянием по halfvec.
+"""
+
+import os
+import logging
+from typing import List, Sequence, Set
+import numpy as np
+from sqlalchemy import Select, Float, cast, func, select, text
+from sqlalchemy.dialects.postgresql import BIT
+from sqlalchemy.engine import Connection
+from pgvector.sqlalchemy import HALFVEC
+from database import engine
+from database.models import KnowledgeBase, EMBEDDING_STORAGE, VECTOR_DIM
+
+logger = logging.getLogger(__name__)
+
+RESCORE_CANDIDATES = int(os.getenv("EMBEDDING_RESCORE_CANDIDATES", "40"))
+
+# halfvec, bit и binary_quantize появились в pgvector 0.7.0
+MIN_COMPACT_VERSION = (0, 7, 0)
+
+EMBEDDING_INDEX_PREFIX = "ix_knowledge_base_embedding"
+
+
+def nearest(query: Select, embedding: Sequence[float], limit: int) -> Select:
+    """
+    Добавляет к select(...) по knowledge_base колонку distance (косинусное
+    расстояние) и сортировку по ней; фильтры запроса применяются в обеих фазах
+    """
+    distance = KnowledgeBase.question_embedding.cosine_distance(embedding)
+    query = query.add_columns(distance.label("distance"))
+
+    if EMBEDDING_STORAGE == "binary":
+        hamming = func.binary_quantize(KnowledgeBase.question_embedding).cast(BIT(VECTOR_DIM)).op(
+            "<~>", return_type=Float
+        )(func.binary_quantize(cast(embedding, HALFVEC(VECTOR_DIM))).cast(BIT(VECTOR_DIM)))
+
+        candidates = select(KnowledgeBase.id)
+        if query.whereclause is not None:
+            candidates = candidates.where(query.whereclause)
+        candidates = candidates.order_by(hamming).limit(max(RESCORE_CANDIDATES, limit))
+
+        query = query.where(KnowledgeBase.id.in_(candidates))
+
+    return query.order_by(distance).limit(limit)
+
+
+def to_array(embedding) -> np.ndarray:
+    """Эмбеддинг из БД (numpy для vector, HalfVector для halfvec) как float32"""
+    if hasattr(embedding, "to_numpy"):
+        embedding = embedding.to_numpy()
+    return np.asarray(embedding, dtype=np.float32)
+
+
+def index_target(storage: str = EMBEDDING_STORAGE) -> str:
+    """Выражение и operator class индекса эмбеддингов KB для CREATE INDEX ... USING hnsw|ivfflat (...)"""
+    if storage == "binary":
+        return f"(binary_quantize(question_embedding)::bit({VECTOR_DIM})) bit_hamming_ops"
+    if storage == "halfvec":
+        return "question_embedding halfvec_cosine_ops"
+    return "question_embedding vector_cosine_ops"
+
+
+def embedding_indexes(conn: Connection) -> Set[str]:
+    """Существующие индексы эмбеддингов на knowledge_base"""
+    return set(conn.execute(text(
+        "SELECT indexname FROM pg_indexes "
+        "WHERE tablename = 'knowledge_base' AND indexname LIKE :prefix"
+    ), {"prefix": EMBEDDING_INDEX_PREFIX + "%"}).scalars().all())
+
+
+def drop_embedding_indexes(conn: Connection, names: Set[str] = None) -> Set[str]:
+    """Удаляет индексы эмбеддингов KB (по умолчанию все). Returns: удаленные"""
+    names = embedding_indexes(conn) if names is None else names
+    for index in names:
+        conn.execute(text(f'DROP INDEX IF EXISTS "{index}"'))
+    return names
+
+
+def pgvector_version(conn: Connection) -> tuple:
+    version = conn.execute(text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")).scalar()
+    return tuple(int(part) for part in version.split(".")) if version else ()
+
+
+def check_storage_support(conn: Connection):
+    if EMBEDDING_STORAGE == "vector":
+        return
+    version = pgvector_version(conn)
+    if version < MIN_COMPACT_VERSION:
+        raise RuntimeError(
+            f"EMBEDDING_STORAGE={EMBEDDING_STORAGE} требует pgvector >= 0.7.0, "
+            f"установлен {'.'.join(map(str, version)) or 'нет'}"
+        )
+
+
+def column_type(conn: Connection, table: str) -> str:
+    return conn.execute(text("""
+        SELECT format_type(atttypid, atttypmod)
+        FROM pg_attribute
+        WHERE attrelid = to_regclass(:table) AND attname = 'question_embedding'
+    """), {"table": table}).scalar()
+
+
+def migrate_embedding_storage() -> List[str]:
+    """
+    Переводит question_embedding в knowledge_base и questions на тип текущего
+    EMBEDDING_STORAGE. Индексы эмбеддингов KB, которых нет в текущей схеме
+    (halfvec <-> binary при том же типе колонки), удаляются; при смене типа
+    колонки удаляются все. init_db создает недостающие.
+    Returns: список измененных таблиц
+    """
+    target = "vector" if EMBEDDING_STORAGE == "vector" else "halfvec"
+    target_type = f"{target}({VECTOR_DIM})"
+    required = {
+        index.name for index in KnowledgeBase.__table__.indexes
+        if index.name.startswith(EMBEDDING_INDEX_PREFIX)
+    }
+    changed = []
+
+    with engine.begin() as conn:
+        check_storage_support(conn)
+
+        stale = embedding_indexes(conn) - required
+        if stale:
+            drop_embedding_indexes(conn, stale)
+            logger.info(f"🔧 Удалены индексы эмбеддингов KB другого режима хранения: {sorted(stale)}")
+
+        for table in ("knowledge_base", "questions"):
+            if column_type(conn, table) == target_type:
+                continue
+
+            if table == "knowledge_base":
+                drop_embedding_indexes(conn)
+
+            conn.execute(text(
+                f"ALTER TABLE {table} ALTER COLUMN question_embedding "
+                f"TYPE {target_type} USING question_embedding::{target_type}"
+            ))
+            changed.append(table)
+            logger.info(f"🔧 {table}.question_embedding → {target_type}")
+
+    return changed
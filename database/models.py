@@ -1,9 +1,10 @@
 import os
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, Text, ForeignKey, BigInteger
+from sqlalchemy import Column, Integer, String, DateTime, Boolean, Float, Text, ForeignKey, BigInteger, Index, LargeBinary, text
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
-from pgvector.sqlalchemy import Vector
+from sqlalchemy.dialects.postgresql import JSONB, ARRAY
+from pgvector.sqlalchemy import Vector, HALFVEC
 
 Base = declarative_base()
 
@@ -22,6 +23,52 @@ if LLM_PROVIDER == "openai":
 else:
     VECTOR_DIM = 768  
 
+# HNSW в pgvector поддерживает до 2000 измерений vector и до 4000 halfvec
+HNSW_MAX_DIM = 2000
+HALFVEC_HNSW_MAX_DIM = 4000
+
+# Хранение эмбеддингов (database/embeddings.py):
+# vector — float32; halfvec — float16, вдвое меньше таблица и индекс;
+# binary — float16 + HNSW по бинарному квантованию (индекс в 32 раза меньше),
+# кандидаты пересчитываются точным косинусом. halfvec/binary требуют pgvector >= 0.7
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "vector").lower()
+if EMBEDDING_STORAGE not in ("vector", "halfvec", "binary"):
+    raise ValueError(f"Unknown EMBEDDING_STORAGE: {EMBEDDING_STORAGE}")
+
+EmbeddingType = Vector if EMBEDDING_STORAGE == "vector" else HALFVEC
+
+
+def _embedding_indexes(column) -> list:
+    if EMBEDDING_STORAGE == "binary":
+        return [
+            Index(
+                "ix_knowledge_base_embedding_hnsw_bit",
+                text(f"(binary_quantize(question_embedding)::bit({VECTOR_DIM})) bit_hamming_ops"),
+                postgresql_using="hnsw"
+            )
+        ]
+    if EMBEDDING_STORAGE == "halfvec" and VECTOR_DIM <= HALFVEC_HNSW_MAX_DIM:
+        return [
+            Index(
+                "ix_knowledge_base_embedding_hnsw_halfvec",
+                column,
+                postgresql_using="hnsw",
+                postgresql_with={"m": 16, "ef_construction": 64},
+                postgresql_ops={"question_embedding": "halfvec_cosine_ops"}
+            )
+        ]
+    if EMBEDDING_STORAGE == "vector" and VECTOR_DIM <= HNSW_MAX_DIM:
+        return [
+            Index(
+                "ix_knowledge_base_embedding_hnsw",
+                column,
+                postgresql_using="hnsw",
+                postgresql_with={"m": 16, "ef_construction": 64},
+                postgresql_ops={"question_embedding": "vector_cosine_ops"}
+            )
+        ]
+    return []
+
 
 class User(Base):
     __tablename__ = "users"
@@ -37,22 +84,31 @@ class User(Base):
 
 
 class Question(Base):
+    # Партиционирована по месяцам created_at (database/partitions.py),
+    # поэтому created_at входит в первичный ключ
     __tablename__ = "questions"
     
-    id = Column(Integer, primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     message_id = Column(BigInteger)
     question_text = Column(Text, nullable=False)
-    question_embedding = Column(Vector(VECTOR_DIM))
+    question_embedding = Column(EmbeddingType(VECTOR_DIM))
     answer_text = Column(Text)
     confidence_score = Column(Float)
+    confidence_signals = Column(JSONB)  # utils/confidence.py, для калибровки
+    ai_answer = Column(Text)  # черновик AI для эскалированных вопросов
     answered_by_ai = Column(Boolean, default=True)
     answered_by_admin_id = Column(BigInteger)
     status = Column(String(50), default="pending")
-    created_at = Column(DateTime, default=datetime.utcnow)
+    created_at = Column(DateTime, primary_key=True, default=datetime.utcnow)
     answered_at = Column(DateTime)
     
     user = relationship("User", back_populates="questions")
+    
+    __table_args__ = (
+        Index("ix_questions_user_created", "user_id", "created_at"),
+        {"postgresql_partition_by": "RANGE (created_at)"},
+    )
 
 
 class KnowledgeBase(Base):
@@ -61,20 +117,58 @@ class KnowledgeBase(Base):
     id = Column(Integer, primary_key=True)
     question = Column(Text, nullable=False)
     answer = Column(Text, nullable=False)
-    question_embedding = Column(Vector(VECTOR_DIM))
+    question_embedding = Column(EmbeddingType(VECTOR_DIM))
     source = Column(String(255))
     verified = Column(Boolean, default=False)
     usage_count = Column(Integer, default=0)
+    last_used_at = Column(DateTime)
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = tuple(_embedding_indexes(question_embedding))
 
 
 class PendingQuestion(Base):
     __tablename__ = "pending_questions"
     
     id = Column(Integer, primary_key=True)
-    question_id = Column(Integer, ForeignKey("questions.id"), nullable=False)
+    # Без внешнего ключа: questions партиционирована, а ключ ссылается только на id
+    question_id = Column(Integer, nullable=False, index=True)
     user_telegram_id = Column(BigInteger, nullable=False)
     forwarded_to_admins = Column(Boolean, default=False)
     admin_message_ids = Column(String(255))
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class SharedState(Base):
+    __tablename__ = "shared_state"
+    
+    key = Column(String(255), primary_key=True)
+    value = Column(JSONB)
+    expires_at = Column(DateTime, index=True)
+
+
+class EmbeddingCacheEntry(Base):
+    __tablename__ = "embedding_cache"
+    
+    key = Column(String(64), primary_key=True)
+    model = Column(String(255), index=True)
+    dim = Column(Integer, nullable=False)
+    embedding = Column(LargeBinary, nullable=False)  # float32
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ResponseCacheEntry(Base):
+    __tablename__ = "response_cache"
+    
+    key = Column(String(64), primary_key=True)
+    model = Column(String(255))
+    kb_entry_ids = Column(ARRAY(Integer), nullable=False)
+    answer = Column(Text, nullable=False)
+    confidence = Column(Float)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    
+    __table_args__ = (
+        Index("ix_response_cache_kb_entry_ids", "kb_entry_ids", postgresql_using="gin"),
+    )
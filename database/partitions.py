@@ -0,0 +1,292 @@
+"""
+Партиционирование questions по месяцам (RANGE по created_at), retention и архив.
+
+- ensure_partitions: создает партиции на QUESTIONS_PARTITION_MONTHS_AHEAD месяцев вперед
+  (строки, успевшие попасть в questions_default, переносятся в новую партицию)
+- strip_old_embeddings: обнуляет эмбеддинги вопросов старше
+  QUESTIONS_EMBEDDING_RETENTION_DAYS — текст, статусы и confidence остаются
+- archive_partitions: партиции старше QUESTIONS_ARCHIVE_AFTER_MONTHS выгружаются
+  в QUESTIONS_ARCHIVE_DIR/<партиция>.jsonl.gz и удаляются из БД
+- migrate_to_partitioned: переводит существующую обычную таблицу questions
+"""
+
+import os
+import json
+import gzip
+import asyncio
+import logging
+from datetime import date, datetime, timedelta
+from typing import List, NamedTuple, Optional
+from sqlalchemy import text
+from sqlalchemy.engine import Connection
+from database import engine
+from database.embeddings import to_array
+
+logger = logging.getLogger(__name__)
+
+MONTHS_AHEAD = int(os.getenv("QUESTIONS_PARTITION_MONTHS_AHEAD", "2"))
+EMBEDDING_RETENTION_DAYS = int(os.getenv("QUESTIONS_EMBEDDING_RETENTION_DAYS", "90"))
+ARCHIVE_AFTER_MONTHS = int(os.getenv("QUESTIONS_ARCHIVE_AFTER_MONTHS", "0"))
+ARCHIVE_DIR = os.getenv("QUESTIONS_ARCHIVE_DIR", "archive")
+MAINTENANCE_INTERVAL = float(os.getenv("QUESTIONS_MAINTENANCE_INTERVAL", "21600"))
+
+DEFAULT_PARTITION = "questions_default"
+
+
+class Partition(NamedTuple):
+    name: str
+    start: date
+    end: date
+
+
+def month_start(day: date, shift: int = 0) -> date:
+    index = day.year * 12 + day.month - 1 + shift
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(start: date) -> str:
+    return f"questions_{start.year:04d}_{start.month:02d}"
+
+
+def is_partitioned(conn: Connection) -> bool:
+    return conn.execute(
+        text("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass('questions')")
+    ).scalar() or False
+
+
+def list_partitions(conn: Connection) -> List[Partition]:
+    """Месячные партиции questions по возрастанию (без DEFAULT)"""
+    names = conn.execute(text("""
+        SELECT c.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = 'questions'::regclass
+    """)).scalars().all()
+
+    partitions = []
+    for name in names:
+        if name == DEFAULT_PARTITION:
+            continue
+        year, month = name.rsplit("_", 2)[1:]
+        start = date(int(year), int(month), 1)
+        partitions.append(Partition(name, start, month_start(start, 1)))
+    return sorted(partitions, key=lambda p: p.start)
+
+
+def create_partition(conn: Connection, start: date) -> bool:
+    """
+    Создает месячную партицию, если ее нет.
+    Таблица наполняется строками из DEFAULT и только потом подключается —
+    иначе ATTACH упадет на строках этого диапазона в questions_default
+    """
+    name = partition_name(start)
+    if conn.execute(text("SELECT to_regclass(:name)"), {"name": name}).scalar():
+        return False
+
+    end = month_start(start, 1)
+    bounds = {"start": start, "end": end}
+    conn.execute(text(f"CREATE TABLE {name} (LIKE questions INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"))
+    conn.execute(text(f"""
+        WITH moved AS (
+            DELETE FROM {DEFAULT_PARTITION}
+            WHERE created_at >= :start AND created_at < :end
+            RETURNING *
+        )
+        INSERT INTO {name} SELECT * FROM moved
+    """), bounds)
+    conn.execute(text(
+        f"ALTER TABLE questions ATTACH PARTITION {name} FOR VALUES FROM ('{start}') TO ('{end}')"
+    ))
+    logger.info(f"🗂 Создана партиция {name}")
+    return True
+
+
+def ensure_partitions(conn: Connection, months_ahead: int = MONTHS_AHEAD, since: date = None) -> int:
+    """Создает DEFAULT и месячные партиции с since (по умолчанию текущий месяц) до +months_ahead"""
+    conn.execute(text(f"CREATE TABLE IF NOT EXISTS {DEFAULT_PARTITION} PARTITION OF questions DEFAULT"))
+
+    today = date.today()
+    current = month_start(since or today)
+    last = month_start(today, months_ahead)
+    created = 0
+    while current <= last:
+        created += create_partition(conn, current)
+        current = month_start(current, 1)
+    return created
+
+
+def strip_old_embeddings(days: int = EMBEDDING_RETENTION_DAYS) -> int:
+    """Обнуляет эмбеддинги старых вопросов и освобождает место VACUUM'ом затронутых партиций"""
+    if days <= 0:
+        return 0
+
+    cutoff = datetime.utcnow() - timedelta(days=days)
+    stripped = 0
+    touched = []
+    with engine.begin() as conn:
+        for partition in list_partitions(conn) + [Partition(DEFAULT_PARTITION, date.min, date.max)]:
+            if partition.start > cutoff.date():
+                continue
+            result = conn.execute(text(f"""
+                UPDATE {partition.name}
+                SET question_embedding = NULL
+                WHERE created_at < :cutoff AND question_embedding IS NOT NULL
+            """), {"cutoff": cutoff})
+            if result.rowcount:
+                stripped += result.rowcount
+                touched.append(partition.name)
+
+    # VACUUM не работает внутри транзакции
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        for name in touched:
+            conn.execute(text(f"VACUUM (ANALYZE) {name}"))
+
+    if stripped:
+        logger.info(f"🧹 Удалены эмбеддинги {stripped} вопросов старше {days} дн. ({', '.join(touched)})")
+    return stripped
+
+
+def export_partition(conn: Connection, name: str, directory: str = ARCHIVE_DIR) -> str:
+    """Выгружает партицию в gzip JSONL; файл появляется целиком или не появляется вовсе"""
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{name}.jsonl.gz")
+    tmp_path = path + ".tmp"
+
+    rows = conn.execute(
+        text(f"SELECT * FROM {name} ORDER BY id").execution_options(stream_results=True, yield_per=1000)
+    )
+    count = 0
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        for row in rows.mappings():
+            record = dict(row)
+            embedding = record.get("question_embedding")
+            if embedding is not None:
+                record["question_embedding"] = to_array(embedding).tolist()
+            f.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+            count += 1
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+    logger.info(f"📦 {name}: {count} вопросов выгружено в {path}")
+    return path
+
+
+def archive_partitions(after_months: int = ARCHIVE_AFTER_MONTHS, directory: str = ARCHIVE_DIR) -> List[str]:
+    """Выгружает и удаляет партиции, закончившиеся больше after_months месяцев назад"""
+    if after_months <= 0:
+        return []
+
+    boundary = month_start(date.today(), -after_months)
+    archived = []
+    with engine.connect() as conn:
+        cold = [p for p in list_partitions(conn) if p.end <= boundary]
+
+    for partition in cold:
+        with engine.begin() as conn:
+            export_partition(conn, partition.name, directory)
+            conn.execute(text(f"""
+                DELETE FROM pending_questions
+                WHERE question_id IN (SELECT id FROM {partition.name})
+            """))
+            conn.execute(text(f"ALTER TABLE questions DETACH PARTITION {partition.name}"))
+            conn.execute(text(f"DROP TABLE {partition.name}"))
+        archived.append(partition.name)
+
+    return archived
+
+
+def run_maintenance() -> dict:
+    """Плановое обслуживание: партиции вперед, retention эмбеддингов, архив"""
+    with engine.begin() as conn:
+        if not is_partitioned(conn):
+            logger.warning("⚠️ questions не партиционирована — обслуживание пропущено")
+            return {}
+        created = ensure_partitions(conn)
+
+    return {
+        "created": created,
+        "stripped": strip_old_embeddings(),
+        "archived": archive_partitions(),
+    }
+
+
+_maintenance_task: Optional[asyncio.Task] = None
+
+
+async def _maintenance_loop(interval: float):
+    from utils.shared_state import get_store
+
+    while True:
+        # Из нескольких воркеров обслуживание запускает только один
+        if get_store().set_if_absent("maintenance:questions", True, ttl=interval):
+            try:
+                result = await asyncio.to_thread(run_maintenance)
+                logger.info(f"🗂 Обслуживание questions: {result}")
+            except Exception as e:
+                logger.error(f"❌ Ошибка обслуживания questions: {e}")
+        await asyncio.sleep(interval)
+
+
+def start_maintenance(interval: float = MAINTENANCE_INTERVAL):
+    """Запускает периодическое обслуживание партиций в текущем event loop"""
+    global _maintenance_task
+    if interval <= 0 or (_maintenance_task and not _maintenance_task.done()):
+        return
+    _maintenance_task = asyncio.get_running_loop().create_task(_maintenance_loop(interval))
+
+
+async def stop_maintenance():
+    global _maintenance_task
+    if _maintenance_task:
+        _maintenance_task.cancel()
+        try:
+            await _maintenance_task
+        except asyncio.CancelledError:
+            pass
+        _maintenance_task = None
+
+
+def migrate_to_partitioned() -> bool:
+    """
+    Переносит обычную таблицу questions в партиционированную одной транзакцией.
+    Returns: False, если таблица уже партиционирована
+    """
+    from database.models import Question
+
+    with engine.begin() as conn:
+        if is_partitioned(conn):
+            return False
+
+        # Внешний ключ на партиционированную таблицу требует created_at в ссылке
+        for constraint in conn.execute(text("""
+            SELECT conname, conrelid::regclass::text
+            FROM pg_constraint
+            WHERE contype = 'f' AND confrelid = 'questions'::regclass
+        """)).fetchall():
+            conn.execute(text(f'ALTER TABLE {constraint[1]} DROP CONSTRAINT "{constraint[0]}"'))
+
+        conn.execute(text("ALTER TABLE questions RENAME TO questions_legacy"))
+        conn.execute(text("ALTER SEQUENCE IF EXISTS questions_id_seq RENAME TO questions_legacy_id_seq"))
+        for index in conn.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE tablename = 'questions_legacy'"
+        )).scalars().all():
+            conn.execute(text(f'ALTER INDEX "{index}" RENAME TO "{index}_legacy"'))
+
+        conn.execute(text("UPDATE questions_legacy SET created_at = now() WHERE created_at IS NULL"))
+        first = conn.execute(text("SELECT min(created_at) FROM questions_legacy")).scalar()
+
+        Question.__table__.create(conn)
+        ensure_partitions(conn, since=first.date() if first else None)
+
+        columns = ", ".join(c.name for c in Question.__table__.columns)
+        moved = conn.execute(text(
+            f"INSERT INTO questions ({columns}) SELECT {columns} FROM questions_legacy"
+        )).rowcount
+        conn.execute(text(
+            "SELECT setval('questions_id_seq', GREATEST((SELECT max(id) FROM questions), 1))"
+        ))
+        conn.execute(text("DROP TABLE questions_legacy"))
+
+    logger.info(f"✅ questions переведена на партиции, перенесено {moved} строк")
+    return True
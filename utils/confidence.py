@@ -0,0 +1,184 @@
+"""
+Итоговая уверенность ответа — логистическая модель поверх сигналов:
+самооценка модели (JSON / CONFIDENCE:), средняя вероятность токенов (logprobs),
+сходство лучшей записи KB, наличие контекста KB и веб-контекста.
+
+Без калибровки веса дают самооценку, сдвинутую сходством KB и веб-контекстом.
+Калибровка (benchmarks/confidence.py) обучает веса на истории вопросов:
+эскалированный вопрос, где черновик AI совпал по смыслу с ответом админа,
+— лишняя эскалация (1), не совпал — верная (0); ответы AI без эскалации — 1
+с меньшим весом. Модель хранится в shared_state (Postgres) и подхватывается
+всеми воркерами без деплоя.
+"""
+
+import os
+import math
+import time
+import logging
+from dataclasses import dataclass, asdict
+from datetime import datetime
+from typing import Dict, Optional, Sequence
+import numpy as np
+from bot.llm.structured import MISSING_CONFIDENCE
+from utils.shared_state import PostgresStore
+
+logger = logging.getLogger(__name__)
+
+CALIBRATION_KEY = "confidence:calibration"
+CALIBRATION_REFRESH = float(os.getenv("CONFIDENCE_CALIBRATION_REFRESH", "300"))
+
+FEATURES = ["self_logit", "token_logit", "similarity", "has_context", "has_web"]
+
+DEFAULT_MODEL = {
+    "source": "default",
+    "intercept": 0.0,
+    "weights": {"self_logit": 1.0, "token_logit": 0.0, "similarity": 1.0, "has_context": -0.5, "has_web": 0.4},
+    # чем заменить отсутствующий сигнал (Groq без logprobs, ответ из кеша)
+    "defaults": {"token_logit": 0.0},
+}
+
+
+def logit(p: float) -> float:
+    p = min(max(p, 0.02), 0.98)
+    return math.log(p / (1 - p))
+
+
+def sigmoid(z):
+    return 1 / (1 + np.exp(-z))
+
+
+@dataclass
+class ConfidenceSignals:
+    self_reported: float = MISSING_CONFIDENCE
+    token: Optional[float] = None
+    similarity: float = 0.0
+    has_context: bool = False
+    has_web: bool = False
+
+    def features(self, defaults: Optional[Dict[str, float]] = None) -> Dict[str, float]:
+        defaults = defaults or {}
+        return {
+            "self_logit": logit(self.self_reported),
+            "token_logit": logit(self.token) if self.token is not None else defaults.get("token_logit", 0.0),
+            "similarity": self.similarity if self.has_context else 0.0,
+            "has_context": float(self.has_context),
+            "has_web": float(self.has_web),
+        }
+
+    def to_dict(self) -> Dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: Dict) -> "ConfidenceSignals":
+        return cls(**{k: v for k, v in data.items() if k in cls.__dataclass_fields__})
+
+
+class ConfidenceScorer:
+    """Считает уверенность по текущей модели; откалиброванная модель перечитывается раз в refresh секунд"""
+
+    def __init__(self, refresh: float = CALIBRATION_REFRESH):
+        self.refresh = refresh
+        self._model: Dict = DEFAULT_MODEL
+        self._loaded_at = float("-inf")
+
+    def model(self) -> Dict:
+        if time.monotonic() - self._loaded_at >= self.refresh:
+            self._loaded_at = time.monotonic()
+            try:
+                self._model = PostgresStore().get(CALIBRATION_KEY) or DEFAULT_MODEL
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось загрузить калибровку уверенности: {e}")
+        return self._model
+
+    def score(self, signals: ConfidenceSignals, model: Optional[Dict] = None) -> float:
+        model = model or self.model()
+        features = signals.features(model.get("defaults"))
+        z = model["intercept"] + sum(w * features[name] for name, w in model["weights"].items())
+        return float(sigmoid(z))
+
+
+def fit(signals: Sequence[ConfidenceSignals], labels: Sequence[int], weights: Sequence[float], l2: float = 1.0) -> Dict:
+    """Логистическая регрессия (Newton / IRLS) с L2 по весам признаков"""
+    token_values = [logit(s.token) for s in signals if s.token is not None]
+    defaults = {"token_logit": float(np.mean(token_values)) if token_values else 0.0}
+
+    X = np.array([[1.0] + [s.features(defaults)[f] for f in FEATURES] for s in signals])
+    y = np.asarray(labels, dtype=float)
+    sample_weight = np.asarray(weights, dtype=float)
+    penalty = np.diag([0.0] + [l2] * len(FEATURES))
+
+    beta = np.zeros(X.shape[1])
+    for _ in range(50):
+        p = sigmoid(X @ beta)
+        gradient = X.T @ (sample_weight * (p - y)) + penalty @ beta
+        hessian = (X * (sample_weight * p * (1 - p))[:, None]).T @ X + penalty + 1e-9 * np.eye(len(beta))
+        step = np.linalg.solve(hessian, gradient)
+        beta -= step
+        if np.abs(step).max() < 1e-6:
+            break
+
+    return {
+        "source": "calibrated",
+        "intercept": float(beta[0]),
+        "weights": {name: float(w) for name, w in zip(FEATURES, beta[1:])},
+        "defaults": defaults,
+        "samples": len(y),
+        "fitted_at": datetime.utcnow().isoformat(),
+    }
+
+
+def evaluate(probs: Sequence[float], labels: Sequence[int], thresholds: Sequence[float], bins: int = 10) -> Dict:
+    """
+    Brier, log loss, ECE и таблица надежности; для каждого порога —
+    доля эскалаций и доля пропущенных плохих ответов (label 0, но не эскалирован)
+    """
+    p = np.clip(np.asarray(probs, dtype=float), 1e-6, 1 - 1e-6)
+    y = np.asarray(labels, dtype=float)
+
+    reliability = []
+    ece = 0.0
+    edges = np.linspace(0, 1, bins + 1)
+    for low, high in zip(edges[:-1], edges[1:]):
+        mask = (p >= low) & ((p < high) if high < 1 else (p <= high))
+        if not mask.any():
+            continue
+        predicted, observed = float(p[mask].mean()), float(y[mask].mean())
+        ece += mask.mean() * abs(predicted - observed)
+        reliability.append({"bin": f"{low:.1f}-{high:.1f}", "n": int(mask.sum()), "predicted": round(predicted, 3), "observed": round(observed, 3)})
+
+    by_threshold = []
+    for threshold in thresholds:
+        escalated = p < threshold
+        by_threshold.append({
+            "threshold": threshold,
+            "escalation_rate": round(float(escalated.mean()), 4),
+            "missed_bad_rate": round(float(((~escalated) & (y == 0)).mean()), 4),
+            "needless_escalation_rate": round(float((escalated & (y == 1)).mean()), 4),
+        })
+
+    return {
+        "n": len(y),
+        "positive_rate": round(float(y.mean()), 4),
+        "brier": round(float(np.mean((p - y) ** 2)), 4),
+        "log_loss": round(float(-np.mean(y * np.log(p) + (1 - y) * np.log(1 - p))), 4),
+        "ece": round(float(ece), 4),
+        "reliability": reliability,
+        "thresholds": by_threshold,
+    }
+
+
+def recommend_threshold(report: Dict, max_missed_bad_rate: float) -> Optional[float]:
+    """Порог с наименьшей долей эскалаций, при котором пропущенных плохих ответов не больше заданного"""
+    allowed = [t for t in report["thresholds"] if t["missed_bad_rate"] <= max_missed_bad_rate]
+    return min(allowed, key=lambda t: t["escalation_rate"])["threshold"] if allowed else None
+
+
+def save_calibration(model: Dict):
+    PostgresStore().set(CALIBRATION_KEY, model)
+
+
+def reset_calibration():
+    PostgresStore().delete(CALIBRATION_KEY)
+
+
+confidence_scorer = ConfidenceScorer()
@@ -6,130 +6,135 @@ import asyncio
 from database import get_db, init_db
 from database.models import User, Question, KnowledgeBase, PendingQuestion
 from bot.llm import get_llm
-from utils.rag import RAGSystem
-from utils.improved_rag import ImprovedRAGSystemWithTavily
+from utils.kb_dedup import compact_knowledge_base, DEDUP_THRESHOLD
+from database import partitions
 import os
 import dotenv
 
 dotenv.load_dotenv()
 
 
-async def seed_knowledge_base():
-    """Заполняет базу знаний начальными данными"""
-    print("🌱 Заполняю базу знаний начальными данными...")
-    
-    llm = get_llm()
-    rag = ImprovedRAGSystemWithTavily(
-    llm=llm,
-    tavily_api_key=os.getenv("TAVILY_API_KEY")
-    )
-    
-    initial_knowledge = [
+INITIAL_KNOWLEDGE = [
     ("Какие документы нужны для визы D7?",
      "Для визы D7 необходимы: действующий загранпаспорт (минимум 3 месяца после окончания визы), 2 фото 3.5x4.5 см, подтверждение пассивного дохода минимум 760 евро в месяц, справка о несудимости из всех стран где проживали более года, медицинская страховка с покрытием минимум 30000 евро, подтверждение проживания в Португалии (договор аренды или бронь отеля на первое время), заполненная анкета и оплата консульского сбора около 90 евро."),
-    
+
     ("Сколько времени занимает получение визы D7?",
      "Обработка визы D7 обычно занимает от 60 до 90 дней с момента подачи документов в консульство. В некоторых случаях может потребоваться до 4 месяцев. После получения визы у вас будет 120 дней чтобы въехать в Португалию и начать процесс оформления ВНЖ."),
-    
+
     ("Какой минимальный доход нужен для D7?",
      "Минимальный пассивный доход для D7 составляет 760 евро в месяц на основного заявителя это одна минимальная зарплата в Португалии. Для супруга добавляется 50 процентов то есть 380 евро, на каждого ребенка или иждивенца добавляется 30 процентов то есть 228 евро. Например для семьи из трех человек нужно показать доход около 1368 евро в месяц."),
-    
+
     ("Можно ли работать на визе D7?",
      "Да, виза D7 позволяет работать в Португалии как по найму так и вести бизнес. Однако главное требование это наличие стабильного пассивного дохода пенсия, рента, дивиденды. Работа рассматривается как дополнение а не основной источник средств для получения визы."),
-    
+
     ("Какие доходы подходят для D7?",
      "Для визы D7 подходят: пенсии государственные и частные, доход от сдачи недвижимости в аренду, дивиденды от акций и инвестиций, проценты от банковских вкладов, роялти от интеллектуальной собственности, доходы от удаленной работы если она стабильная. Важно чтобы доход был регулярным и документально подтвержденным за последние 6-12 месяцев."),
-    
+
     ("Нужно ли знать португальский для D7?",
      "Для получения визы D7 и первого ВНЖ знание португальского языка НЕ требуется. Однако для продления ВНЖ и особенно для получения гражданства потребуется сдать экзамен на уровень A2 по португальскому языку. Рекомендую начинать учить язык сразу после переезда."),
-    
+
     ("Как получить ВНЖ в Португалии?",
      "После въезда по визе D7 у вас есть максимум 4 месяца чтобы подать документы на ВНЖ. Нужно получить NIF налоговый номер, открыть банковский счет, оформить медстраховку SNS или частную, подтвердить адрес проживания договор аренды или право собственности. Затем записываетесь в AIMA бывший SEF и подаете документы. Первый ВНЖ выдается на 1 год, затем продлевается на 2 года, потом еще на 2 года."),
-    
+
     ("Сколько нужно прожить для гражданства?",
      "Для получения гражданства Португалии нужно легально прожить в стране минимум 5 лет. При этом важно физически находиться в Португалии и не выезжать на длительные периоды. Также требуется знание португальского языка уровень A2, отсутствие судимостей, подтверждение связей со страной работа или бизнес, интеграция в общество. Процесс рассмотрения заявления может занять от 1 до 2 лет."),
-    
+
     ("Можно ли иметь двойное гражданство?",
      "Да, Португалия разрешает двойное гражданство. Вы можете сохранить гражданство России, Украины, Беларуси или любой другой страны получив португальское. Это очень удобно и дает больше возможностей для путешествий и проживания."),
-    
+
     ("Что такое NIF и как его получить?",
      "NIF это налоговый идентификационный номер в Португалии аналог ИНН. Он нужен для всего открытия счета, аренды жилья, покупки недвижимости, оформления визы и ВНЖ. Получить можно в любом офисе Финансовой инспекции Financas предъявив паспорт и заполнив анкету. Обычно выдается в течение одного дня бесплатно. Также можно оформить через представителя если вы еще не в Португалии."),
-    
+
     ("Какие налоги в Португалии для резидентов?",
      "В Португалии прогрессивная шкала подоходного налога IRS от 14.5 процентов на доход до 7703 евро в год до 48 процентов на доход свыше 78834 евро в год. Также есть социальные взносы около 11 процентов для работающих по найму. НДС IVA составляет 23 процента на большинство товаров и услуг. Однако можно оптимизировать налоги через режим NHR или открытие компании."),
-    
+
     ("Что такое режим NHR?",
      "NHR Non-Habitual Resident это специальный налоговый режим для новых резидентов Португалии. Позволяет в течение 10 лет платить 0 процентов налога на иностранные пенсии и пассивный доход или 20 процентов фиксированную ставку на доходы от высококвалифицированной деятельности IT, консалтинг, медицина. Чтобы получить NHR нужно не быть налоговым резидентом Португалии в предыдущие 5 лет и зарегистрироваться в течение первого года после получения ВНЖ."),
-    
+
     ("Как получить статус NHR?",
      "Чтобы получить NHR нужно: во-первых стать налоговым резидентом Португалии прожить более 183 дней в году или иметь постоянное жилье, во-вторых подать заявление в налоговую через портал Financas или лично в течение первого года резидентства, в-третьих доказать что вы не были резидентом Португалии предыдущие 5 лет. Заявление обрабатывается примерно 2-3 месяца, статус действует 10 лет и не продлевается."),
-    
+
     ("Платят ли налоги с пенсии на NHR?",
      "С иностранной пенсии на режиме NHR вы платите 0 процентов налога в Португалии если пенсия может облагаться в стране источника согласно международному соглашению. Для России действует соглашение об избежании двойного налогообложения поэтому российские пенсии не облагаются в Португалии. Однако важно правильно оформить документы и получить сертификат налогового резидентства."),
-    
+
     ("Сколько стоит аренда жилья в Португалии?",
      "Стоимость аренды сильно зависит от города и района. В Лиссабоне однокомнатная квартира в центре стоит от 900 до 1500 евро в месяц, за городом от 600 до 900 евро. В Порту немного дешевле центр от 700 до 1200 евро, пригороды от 500 до 800 евро. В Алгарве цены сезонные летом дороже. Маленькие города типа Коимбры, Брага, Авейру значительно дешевле от 400 до 700 евро за хорошую квартиру."),
-    
+
     ("Можно ли купить недвижимость до получения ВНЖ?",
      "Да, иностранцы могут покупать недвижимость в Португалии без ограничений даже до получения визы или ВНЖ. Для покупки нужен только NIF налоговый номер и открытый банковский счет. Покупка недвижимости не дает автоматически ВНЖ за исключением программы Golden Visa при инвестициях от 500000 евро. Однако наличие собственного жилья упрощает получение визы D7 и ВНЖ."),
-    
+
     ("Какие налоги при покупке недвижимости?",
      "При покупке недвижимости в Португалии платится: IMT налог на передачу имущества от 0 процентов для жилья до 97064 евро до 6 процентов для дорогой недвижимости, гербовый сбор Imposto de Selo 0.8 процента от стоимости, расходы на нотариуса и регистрацию около 1-1.5 процента от стоимости, услуги юриста опционально около 1 процент. Итого дополнительно к цене недвижимости закладывайте 5-8 процентов на все расходы."),
-    
+
     ("Какой налог на недвижимость ежегодно?",
      "Ежегодный налог на недвижимость IMI составляет от 0.3 до 0.45 процента от кадастровой стоимости в зависимости от муниципалитета. Для квартиры стоимостью 200000 евро это примерно 600-900 евро в год. Также если сдаете в аренду нужно платить подоходный налог с арендных платежей 25 процентов или по прогрессивной шкале 14.5-48 процентов в зависимости от выбранного режима."),
-    
+
     ("Что такое Golden Visa?",
      "Golden Visa это программа получения ВНЖ Португалии через инвестиции. Варианты инвестиций: 500000 евро в недвижимость старше 30 лет или в зонах реновации, 280000 евро в недвижимость требующую реконструкции, 500000 евро в инвестиционные фонды, 500000 евро в португальскую компанию с созданием 5 рабочих мест, 250000 евро в науку искусство или культурное наследие. Golden Visa позволяет жить минимум 7 дней в году в Португалии и через 5 лет получить гражданство."),
-    
+
     ("Чем Golden Visa отличается от D7?",
      "Главные отличия: Golden Visa требует крупных инвестиций от 250000 евро но позволяет жить в Португалии всего 7 дней в году сохраняя бизнес и жизнь в другой стране. D7 не требует инвестиций только пассивный доход от 760 евро в месяц но нужно реально жить в Португалии большую часть времени. Golden Visa быстрее оформляется и дает больше свободы передвижения, D7 дешевле и подходит для реального переезда."),
-    
+
     ("Как открыть компанию в Португалии?",
      "Для открытия компании нужно: получить NIF, выбрать организационно-правовую форму Unipessoal LDA аналог ООО популярный вариант с минимальным капиталом 1 евро, зарегистрировать компанию онлайн через портал Empresa Online занимает 1-3 дня, открыть корпоративный банковский счет, зарегистрироваться в налоговой и соцстрахе. Стоимость регистрации около 360 евро, можно сделать самостоятельно или через юриста за 800-1500 евро. Годовое обслуживание бухгалтерия плюс налоги от 1200 евро в год."),
-    
+
     ("Какие налоги для бизнеса?",
      "Корпоративный налог IRC в Португалии составляет 21 процент от прибыли для компаний с оборотом свыше 25000 евро и 17 процентов для малого бизнеса до этой суммы. Дивиденды облагаются 28 процентов но можно оптимизировать. НДС IVA 23 процента нужно платить если оборот превышает 13500 евро в год. Социальные взносы для директора около 190-200 евро в месяц минимум. При режиме NHR можно платить 20 процентов подоходного налога с зарплаты вместо прогрессивной шкалы."),
-    
+
     ("Можно ли работать удаленно из Португалии?",
      "Да, многие переезжают в Португалию и продолжают работать удаленно на иностранные компании. Для этого подходит виза D7 показываете стабильный доход от удаленной работы или Digital Nomad Visa если работаете на зарубежного работодателя. Важный момент если вы становитесь налоговым резидентом Португалии то должны декларировать весь мировой доход но можно оптимизировать через NHR или открыть свою компанию в Португалии."),
-    
+
     ("Какое образование в Португалии?",
      "Система образования: дошкольное с 3 лет необязательное бесплатное, начальная школа 6-10 лет обязательное бесплатное, средняя школа 10-18 лет обязательное бесплатное, университеты платные для иностранцев от 1000 до 7000 евро в год в зависимости от вуза и программы. Качество государственных школ хорошее но зависит от района, есть много международных школ английская португальская французская немецкая системы стоимость от 5000 до 15000 евро в год."),
-    
+
     ("Нужно ли знать португальский для школы?",
      "В государственных школах обучение на португальском поэтому ребенку нужно знать язык или быстро его выучить обычно дети адаптируются за 6-12 месяцев. Многие школы предоставляют дополнительные уроки португальского для иностранных детей. Альтернатива международные школы где преподают на английском французском немецком но они платные. Для университета также нужен португальский уровень B2 или обучение на английском в некоторых вузах."),
-    
+
     ("Какая медицина в Португалии?",
      "В Португалии две системы: государственная SNS Servico Nacional de Saude и частная. SNS формально бесплатная для резидентов но реально нужно платить взносы модерадорас за прием около 5-20 евро и ждать очереди к специалистам. Качество хорошее но долго. Частная медицина дороже прием у врача 50-100 евро но без очередей и комфортнее. Многие оформляют частную страховку от 40 до 150 евро в месяц в зависимости от возраста и покрытия."),
-    
+
     ("Как получить доступ к SNS?",
      "Чтобы получить медкарту SNS нужно: иметь ВНЖ или визу долгосрочную, зарегистрироваться в Centro de Saude поликлиника по месту жительства, предоставить документы паспорт, ВНЖ, NIF, подтверждение адреса, получить номер Numero de Utente занимает 1-2 недели. После этого можете пользоваться госмедициной платя только модерадорас символические взносы. Экстренная помощь всегда бесплатная в больницах."),
-    
+
     ("Как открыть банковский счет?",
      "Для открытия счета нужны: паспорт, NIF налоговый номер, подтверждение адреса договор аренды или счет за коммуналку, иногда требуют справку о доходах или рабочий контракт. Популярные банки: Millennium BCP, Santander, Caixa, Novobanco, Activobank. Обслуживание счета от 0 до 10 евро в месяц в зависимости от пакета услуг. Онлайн-банки типа Revolut, N26, Wise также работают и удобны для международных переводов."),
-    
+
     ("Можно ли перевести деньги из России?",
      "Сейчас прямые переводы из России в Португалию усложнены из-за санкций. Варианты: криптовалюта купить в России продать в Европе, через посредников в третьих странах Турция ОАЭ Казахстан Грузия но комиссии высокие 5-10 процентов, наличные вывезти до 10000 долларов без декларации, международные платежные системы типа Wise но с ограничениями. Важно соблюдать законы обеих стран и декларировать крупные суммы чтобы избежать проблем с налоговыми."),
-    
+
     ("Сколько нужно денег для жизни?",
      "Средний бюджет на месяц в Лиссабоне для одного человека: аренда 600-1000 евро, еда и продукты 250-350 евро, коммунальные услуги 80-120 евро, транспорт проездной 40 евро или машина 150-200 евро на бензин, интернет и мобильная связь 40-60 евро, развлечения и прочее 200-300 евро. Итого минимум 1200-1500 евро комфортно 1800-2500 евро. Для семьи с двумя детьми закладывайте 2500-3500 евро в месяц."),
-    
+
     ("Безопасно ли в Португалии?",
      "Португалия одна из самых безопасных стран Европы по статистике преступности. Уровень насильственных преступлений очень низкий, терроризм практически отсутствует, полиция вежливая и профессиональная. Конечно есть мелкое воровство карманники в туристических местах Лиссабона и Порту но в целом можно гулять вечером не опасаясь. Особенно безопасно в небольших городах и на севере страны."),
-    
+
     ("Какой климат в Португалии?",
      "Климат средиземноморский на юге и океанический на севере. Лиссабон лето жаркое 28-35 градусов зима мягкая 10-15 градусов дожди с ноября по март. Порту чуть прохладнее и влажнее зимой до 10 градусов и частые дожди. Алгарве самый теплый регион зимой 15-18 градусов лето очень жаркое до 40. В целом климат комфортный круглый год можно жить без центрального отопления хватает обогревателей и кондиционеров."),
-    
+
     ("Нужна ли апостиль на документы?",
      "Да, все российские документы для визы и ВНЖ требуют апостиля: справка о несудимости, свидетельства о рождении браке разводе, документы об образовании, доверенности. После апостиля документы нужно перевести на португальский у присяжного переводчика в Португалии или в консульстве. Апостиль ставится в России в соответствующих органах МИД, ЗАГС, Министерство образования в зависимости от документа."),
-    
+
     ("Как записаться на визу в консульство?",
      "Для записи на визу D7 нужно: зарегистрироваться на сайте консульства Португалии в вашей стране, выбрать тип визы Long Stay National Visa D7, заполнить онлайн анкету, выбрать удобную дату собеседования обычно ждать 2-4 недели, подготовить все документы согласно чек-листу, оплатить консульский сбор около 90 евро. В день собеседования приехать лично сдать документы биометрию и пройти интервью на английском или португальском."),
-    ]
+]
+
+
+async def seed_knowledge_base():
+    """Заполняет базу знаний начальными данными"""
+    from utils.improved_rag import ImprovedRAGSystemWithTavily
+    
+    print("🌱 Заполняю базу знаний начальными данными...")
+    
+    llm = get_llm()
+    rag = ImprovedRAGSystemWithTavily(
+    llm=llm,
+    tavily_api_key=os.getenv("TAVILY_API_KEY")
+    )
+    embedded = await llm.prefetch_embeddings([question for question, _ in INITIAL_KNOWLEDGE])
+    print(f"🧮 Новых эмбеддингов: {embedded} из {len(INITIAL_KNOWLEDGE)}")
     
     with get_db() as db:
-        for question, answer in initial_knowledge:
+        for question, answer in INITIAL_KNOWLEDGE:
             try:
                 await rag.add_to_knowledge_base(
                     db,
@@ -142,7 +147,7 @@ async def seed_knowledge_base():
             except Exception as e:
                 print(f"  ❌ Ошибка: {e}")
     
-    print(f"✅ Добавлено {len(initial_knowledge)} записей в базу знаний")
+    print(f"✅ Добавлено {len(INITIAL_KNOWLEDGE)} записей в базу знаний")
 
 
 def show_stats():
@@ -238,6 +243,101 @@ def export_knowledge_base(filename: str = "knowledge_base_export.txt"):
         
         print(f"✅ Экспортировано {len(kb_entries)} записей")
 
+def compact_knowledge_base_command():
+    """Сливает почти одинаковые записи базы знаний"""
+    raw = input(f"Порог похожести (Enter для {DEDUP_THRESHOLD}): ").strip()
+    threshold = float(raw) if raw else DEDUP_THRESHOLD
+    
+    print(f"\n🔍 Ищу дубли с похожестью >= {threshold:.2f}...")
+    
+    with get_db() as db:
+        found = compact_knowledge_base(db, threshold=threshold, dry_run=True)
+    
+    if not found:
+        print("✅ Дублей не найдено")
+        return
+    
+    confirm = input(f"\nБудет удалено {found} записей. Введи 'MERGE' для подтверждения: ")
+    if confirm != "MERGE":
+        print("❌ Отменено")
+        return
+    
+    with get_db() as db:
+        removed = compact_knowledge_base(db, threshold=threshold)
+    
+    print(f"✅ Слито дублей: {removed}")
+
+
+async def test_rag_search(query: str):
+    """Показывает результаты поиска обеих RAG систем для одного вопроса"""
+    from utils.rag import RAGSystem
+    from utils.improved_rag import ImprovedRAGSystemWithTavily
+    
+    llm = get_llm()
+    systems = {
+        "RAGSystem": RAGSystem(llm=llm),
+        "ImprovedRAGSystemWithTavily": ImprovedRAGSystemWithTavily(llm=llm),
+    }
+    
+    with get_db() as db:
+        for name, rag in systems.items():
+            print(f"\n🔎 {name}:")
+            results = await rag.search_similar(db, query)
+            if not results:
+                print("   ничего не найдено")
+            for i, item in enumerate(results, 1):
+                similarity = f" ({item[2]:.2%})" if len(item) > 2 else ""
+                print(f"   {i}. {item[0]}{similarity}")
+
+
+def run_retrieval_benchmark():
+    """Запускает бенчмарк RAG поиска с параметрами по умолчанию"""
+    from benchmarks.retrieval import build_parser, run
+    
+    print("\n⚠️  Бенчмарк пересоздает индексы knowledge_base — запускай на отдельной БД")
+    if input("Продолжить? (yes/no): ").strip().lower() != "yes":
+        print("❌ Отменено")
+        return
+    
+    asyncio.run(run(build_parser().parse_args([])))
+
+
+def questions_maintenance():
+    """Переводит questions на партиции и выполняет retention/архивацию"""
+    with partitions.engine.connect() as conn:
+        partitioned = partitions.is_partitioned(conn)
+    
+    if not partitioned:
+        print("\n⚠️  Таблица questions еще не партиционирована")
+        if input("Перевести сейчас (таблица блокируется на время переноса)? (yes/no): ").strip().lower() != "yes":
+            print("❌ Отменено")
+            return
+        partitions.migrate_to_partitioned()
+        print("✅ questions переведена на месячные партиции")
+    
+    result = partitions.run_maintenance()
+    print(f"🗂 Создано партиций: {result['created']}")
+    print(f"🧹 Удалено эмбеддингов старше {partitions.EMBEDDING_RETENTION_DAYS} дн.: {result['stripped']}")
+    if result["archived"]:
+        print(f"📦 В архив ({partitions.ARCHIVE_DIR}): {', '.join(result['archived'])}")
+    
+    with partitions.engine.connect() as conn:
+        for p in partitions.list_partitions(conn):
+            print(f"   {p.name}: {p.start} — {p.end}")
+
+
+def backfill_question_embeddings():
+    """Досчитывает эмбеддинги вопросов (по умолчанию — положенные политикой)"""
+    from utils.question_embeddings import question_backfill, backfill_statuses
+    
+    default = ",".join(backfill_statuses() or []) or "все"
+    raw = input(f"Статусы через запятую (Enter для {default}, * — все): ").strip()
+    statuses = None if raw == "*" else [s.strip() for s in raw.split(",")] if raw else backfill_statuses()
+    
+    filled = asyncio.run(question_backfill.run(get_llm(), statuses=statuses))
+    print(f"✅ Досчитано эмбеддингов: {filled}")
+
+
 def main_menu():
     """Главное меню утилиты"""
     while True:
@@ -249,6 +349,10 @@ def main_menu():
         print("3. Экспортировать базу знаний")
         print("4. Тест RAG поиска")
         print("5. Очистить базу данных (⚠️  опасно)")
+        print("6. Сжать базу знаний (слить дубли)")
+        print("7. Бенчмарк RAG поиска (recall@k, MRR, латентность)")
+        print("8. Партиции вопросов: миграция, retention, архив")
+        print("9. Досчитать эмбеддинги вопросов")
         print("0. Выход")
         
         choice = input("\nВыбери опцию: ")
@@ -262,8 +366,18 @@ def main_menu():
             export_knowledge_base(filename or "knowledge_base_export.txt")
         elif choice == "4":
             query = input("Введи вопрос для поиска: ").strip()
+            if query:
+                asyncio.run(test_rag_search(query))
         elif choice == "5":
             clear_database()
+        elif choice == "6":
+            compact_knowledge_base_command()
+        elif choice == "7":
+            run_retrieval_benchmark()
+        elif choice == "8":
+            questions_maintenance()
+        elif choice == "9":
+            backfill_question_embeddings()
         elif choice == "0":
             print("👋 До встречи!")
             break
@@ -0,0 +1,240 @@
+"""
+Кеш эмбеддингов: один и тот же текст эмбеддится один раз на модель.
+
+Ключ — sha256 от идентификатора embedding модели и нормализованного текста
+(NFC, схлопнутые пробелы); на промахе эмбеддится сам нормализованный текст,
+так что кеш не меняет результат. Два уровня: LRU в памяти процесса
+(float32 массивы) и хранилище EMBEDDING_CACHE_BACKEND:
+- postgres (по умолчанию) — таблица embedding_cache, float32 байтами
+- file — файлы в EMBEDDING_CACHE_DIR
+- memory — только LRU
+
+Нулевые векторы и векторы чужой размерности (fallback провайдера при ошибке)
+не кешируются.
+"""
+
+import os
+import asyncio
+import hashlib
+import logging
+import threading
+import unicodedata
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime
+from typing import Dict, List, Optional, Sequence
+import numpy as np
+from sqlalchemy import select
+from sqlalchemy.dialects.postgresql import insert
+from database import get_db
+from database.models import EmbeddingCacheEntry, VECTOR_DIM
+from bot.llm.base import BaseLLM
+from bot.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_ENABLED = os.getenv("EMBEDDING_CACHE", "true").lower() == "true"
+EMBEDDING_CACHE_BACKEND = os.getenv("EMBEDDING_CACHE_BACKEND", "postgres").lower()
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "5000"))
+EMBEDDING_CACHE_DIR = os.getenv("EMBEDDING_CACHE_DIR", ".cache/embedding_vectors")
+
+
+def normalize_text(text: str) -> str:
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def make_key(model: str, text: str) -> str:
+    return hashlib.sha256(f"{model}\x1f{normalize_text(text)}".encode()).hexdigest()
+
+
+class EmbeddingStore(ABC):
+    """Постоянное хранилище векторов по ключу"""
+
+    @abstractmethod
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        pass
+
+    @abstractmethod
+    def put_many(self, model: str, vectors: Dict[str, np.ndarray]):
+        pass
+
+
+class PostgresEmbeddingStore(EmbeddingStore):
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        with get_db() as db:
+            rows = db.execute(
+                select(EmbeddingCacheEntry.key, EmbeddingCacheEntry.embedding)
+                .where(EmbeddingCacheEntry.key.in_(list(keys)))
+            ).fetchall()
+        return {key: np.frombuffer(blob, dtype=np.float32) for key, blob in rows}
+
+    def put_many(self, model: str, vectors: Dict[str, np.ndarray]):
+        now = datetime.utcnow()
+        with get_db() as db:
+            db.execute(
+                insert(EmbeddingCacheEntry).values([
+                    {"key": key, "model": model, "dim": len(vector), "embedding": vector.tobytes(), "created_at": now}
+                    for key, vector in vectors.items()
+                ]).on_conflict_do_nothing(index_elements=[EmbeddingCacheEntry.key])
+            )
+            db.commit()
+
+
+class FileEmbeddingStore(EmbeddingStore):
+    """Файл на вектор (сырые float32), каталоги по первым символам ключа"""
+
+    def __init__(self, directory: str = EMBEDDING_CACHE_DIR):
+        self.directory = directory
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.f32")
+
+    def get_many(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        found = {}
+        for key in keys:
+            try:
+                found[key] = np.fromfile(self._path(key), dtype=np.float32)
+            except FileNotFoundError:
+                continue
+        return found
+
+    def put_many(self, model: str, vectors: Dict[str, np.ndarray]):
+        for key, vector in vectors.items():
+            path = self._path(key)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.tmp"
+            vector.tofile(tmp_path)
+            os.replace(tmp_path, path)
+
+
+def make_store(backend: str) -> Optional[EmbeddingStore]:
+    if backend == "postgres":
+        return PostgresEmbeddingStore()
+    if backend == "file":
+        return FileEmbeddingStore()
+    if backend == "memory":
+        return None
+    raise ValueError(f"Unknown EMBEDDING_CACHE_BACKEND: {backend}")
+
+
+class EmbeddingCache:
+    def __init__(self, size: int = EMBEDDING_CACHE_SIZE, store: Optional[EmbeddingStore] = None):
+        self.size = size
+        self.store = store
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"memory_hits": 0, "store_hits": 0, "misses": 0}
+
+    def _remember(self, key: str, vector: np.ndarray):
+        if self.size <= 0:
+            return
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.size:
+                self._memory.popitem(last=False)
+
+    def lookup(self, keys: Sequence[str]) -> Dict[str, np.ndarray]:
+        """Ищет ключи в памяти, остальные — одним запросом в хранилище"""
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+        for key in keys:
+            record_cache("embedding_memory", key in found)
+        self.stats["memory_hits"] += len(found)
+
+        missing = [key for key in dict.fromkeys(keys) if key not in found]
+        if missing and self.store is not None:
+            try:
+                stored = self.store.get_many(missing)
+            except Exception as e:
+                logger.warning(f"⚠️ Кеш эмбеддингов недоступен: {e}")
+                stored = {}
+            for key in missing:
+                record_cache("embedding_store", key in stored)
+            for key, vector in stored.items():
+                self._remember(key, vector)
+            found.update(stored)
+            self.stats["store_hits"] += len(stored)
+
+        self.stats["misses"] += len([key for key in missing if key not in found])
+        return found
+
+    def save(self, model: str, vectors: Dict[str, np.ndarray]):
+        for key, vector in vectors.items():
+            self._remember(key, vector)
+        if vectors and self.store is not None:
+            try:
+                self.store.put_many(model, vectors)
+            except Exception as e:
+                logger.warning(f"⚠️ Не удалось сохранить эмбеддинги в кеш: {e}")
+
+    def hit_rate(self) -> Optional[float]:
+        total = sum(self.stats.values())
+        return (self.stats["memory_hits"] + self.stats["store_hits"]) / total if total else None
+
+
+class CachedEmbeddingsLLM(BaseLLM):
+    """
+    Обертка над LLM: generate_embedding(s) идут через кеш,
+    остальное (generate_answer, health, ...) — напрямую к обернутому провайдеру
+    """
+
+    def __init__(self, llm: BaseLLM, cache: EmbeddingCache):
+        self.llm = llm
+        self.cache = cache
+
+    def __getattr__(self, name):
+        return getattr(self.llm, name)
+
+    @property
+    def embedding_model_id(self) -> str:
+        return self.llm.embedding_model_id
+
+    async def generate_answer(self, *args, **kwargs):
+        return await self.llm.generate_answer(*args, **kwargs)
+
+    async def generate_embedding(self, text: str) -> List[float]:
+        return (await self.generate_embeddings([text]))[0]
+
+    async def generate_embeddings(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+
+        model = self.embedding_model_id
+        keys = [make_key(model, text) for text in texts]
+        found = await asyncio.to_thread(self.cache.lookup, keys)
+
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in found:
+                missing.setdefault(key, normalize_text(text))
+
+        if missing:
+            vectors = await self.llm.generate_embeddings(list(missing.values()))
+            fresh = {}
+            for key, vector in zip(missing, vectors):
+                array = np.asarray(vector, dtype=np.float32)
+                found[key] = array
+                if len(array) == VECTOR_DIM and array.any():
+                    fresh[key] = array
+            await asyncio.to_thread(self.cache.save, model, fresh)
+
+        return [found[key].tolist() for key in keys]
+
+    async def prefetch_embeddings(self, texts: List[str]) -> int:
+        """
+        Прогревает кеш для пакетной задачи: известные векторы поднимаются
+        в память, недостающие эмбеддятся одним батчем.
+        Returns: сколько текстов пришлось эмбеддить
+        """
+        misses = self.cache.stats["misses"]
+        await self.generate_embeddings(texts)
+        return self.cache.stats["misses"] - misses
+
+
+embedding_cache = EmbeddingCache(store=make_store(EMBEDDING_CACHE_BACKEND))
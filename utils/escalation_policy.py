@@ -0,0 +1,303 @@
+"""
+Политика эскалации: язык, интенты и решение «эскалировать ли» за один проход.
+
+Правила (utils/escalation_rules.yaml или ESCALATION_RULES_PATH) компилируются
+в одно регулярное выражение: ключевые слова всех языков и интентов собраны
+в префиксное дерево (общие префиксы проверяются один раз), рядом — диапазоны
+алфавитов для определения языка. Текст сканируется один раз, без lower().
+
+Интенты с reply — small talk (приветствия, благодарности): сообщение целиком
+из их ключевых слов получает шаблонный ответ из того же файла.
+
+Файл перечитывается, если изменился (проверка не чаще ESCALATION_RULES_CHECK_INTERVAL);
+при ошибке в правилах остается прежняя версия.
+"""
+
+import os
+import re
+import time
+import logging
+import threading
+from dataclasses import dataclass, field
+from typing import Dict, FrozenSet, List, Optional, Tuple
+import yaml
+from bot.metrics import Counter, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+RULES_PATH = os.getenv(
+    "ESCALATION_RULES_PATH", os.path.join(os.path.dirname(__file__), "escalation_rules.yaml")
+)
+CHECK_INTERVAL = float(os.getenv("ESCALATION_RULES_CHECK_INTERVAL", "5"))
+
+ESCALATION_DECISIONS = REGISTRY.register(Counter(
+    "fsoul_escalation_decisions_total",
+    "Escalation decisions by outcome and deciding rule",
+    ["escalate", "reason"]
+))
+
+WILDCARD = "*"
+LOOKUP_CACHE_SIZE = 4096
+WORD = re.compile(r"\w+")
+
+
+def _trie_regex(words: List[str]) -> str:
+    """Альтернатива слов в виде префиксного дерева: (?:от(?:каз\\w*|вет)|...)"""
+    trie: Dict = {}
+    for word in words:
+        node = trie
+        for char in word:
+            node = node.setdefault(char, {})
+        node[""] = {}
+
+    def build(node: Dict) -> str:
+        branches = []
+        for char in sorted(c for c in node if c):
+            if char == WILDCARD:
+                piece = r"\w*"
+            elif char == " ":
+                # между словами фразы — пробелы и пунктуация ("hello, there")
+                piece = r"\W+"
+            else:
+                piece = re.escape(char)
+            branches.append(piece + build(node[char]))
+        if not branches:
+            return ""
+        if "" in node:
+            return "(?:" + "|".join(branches) + ")?"
+        return branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+
+    return build(trie)
+
+
+def _normalize_keyword(keyword: str) -> str:
+    keyword = str(keyword).lower()
+    wildcard = WILDCARD if keyword.endswith(WILDCARD) else ""
+    return " ".join(WORD.findall(keyword)) + wildcard
+
+
+@dataclass
+class Analysis:
+    language: str
+    intents: FrozenSet[str] = field(default_factory=frozenset)
+    words: int = 0
+    # сообщение целиком из интента с simple: true и match: full — дешевая модель, без веб-поиска
+    is_simple: bool = False
+    # сообщение целиком small talk — интент с reply (первый по порядку в файле)
+    small_talk: Optional[str] = None
+
+
+class EscalationPolicy:
+    def __init__(self, rules: Dict):
+        language = rules.get("language", {})
+        self.default_language = language.get("default", "en")
+        self.intent_rules: Dict[str, Dict] = rules.get("intents", {})
+        self.context_min_confidence = float(rules.get("escalation", {}).get("context_min_confidence", 1.0))
+
+        scripts = language.get("scripts", {})
+        self._script_letters = {lang: re.compile(f"[{letters}]", re.IGNORECASE) for lang, letters in scripts.items()}
+
+        # ключевое слово → теги ("lang", "pt") / ("intent", "critical") / ("script", "ru")
+        self._tags: Dict[str, List[Tuple[str, str]]] = {}
+        self._prefixes: List[Tuple[str, Tuple[str, str]]] = []
+        for lang, markers in language.get("markers", {}).items():
+            for marker in markers:
+                self._add(marker, ("lang", lang))
+        for intent, rule in self.intent_rules.items():
+            if rule.get("reply") and rule.get("match") != "full":
+                raise ValueError(f"Интент {intent}: reply допустим только с match: full")
+            keywords = rule.get("keywords", [])
+            # словарь язык → список: ключевые слова заодно маркеры языка
+            by_language = keywords.items() if isinstance(keywords, dict) else [(None, keywords)]
+            for lang, words in by_language:
+                for keyword in words:
+                    self._add(keyword, ("intent", intent))
+                    if lang:
+                        self._add(keyword, ("lang", lang))
+
+        self._scripts: Dict[str, str] = {}
+        keywords = []
+        if self._tags or self._prefixes:
+            words = list(self._tags) + [prefix + WILDCARD for prefix, _ in self._prefixes]
+            keywords.append(r"(?<!\w)(?P<kw>" + _trie_regex(words) + r")(?!\w)")
+        alternatives = list(keywords)
+        for i, (lang, letters) in enumerate(scripts.items()):
+            self._scripts[f"s{i}"] = lang
+            alternatives.append(f"(?P<s{i}>[{letters}]+)")
+        # пока алфавит не найден — ищем и его, после — только ключевые слова с той же позиции
+        self._pattern = re.compile("|".join(alternatives) or "(?!)", re.IGNORECASE)
+        self._keyword_pattern = re.compile("|".join(keywords) or "(?!)", re.IGNORECASE)
+        self._lookup_cache: Dict[str, List[Tuple[str, str]]] = {}
+
+    def _add(self, keyword: str, tag: Tuple[str, str]):
+        keyword = _normalize_keyword(keyword)
+        # слово целиком уходит в ветку ключевых слов — его алфавит учитываем здесь
+        tags = [tag] + [("script", lang) for lang, pattern in self._script_letters.items() if pattern.search(keyword)]
+        for item in tags:
+            if keyword.endswith(WILDCARD):
+                self._prefixes.append((keyword[:-1], item))
+            else:
+                self._tags.setdefault(keyword, []).append(item)
+
+    def _lookup(self, matched: str) -> List[Tuple[str, str]]:
+        tags = self._lookup_cache.get(matched)
+        if tags is None:
+            keyword = _normalize_keyword(matched)
+            tags = list(self._tags.get(keyword, ()))
+            tags.extend(tag for prefix, tag in self._prefixes if keyword.startswith(prefix))
+            if len(self._lookup_cache) < LOOKUP_CACHE_SIZE:
+                self._lookup_cache[matched] = tags
+        return tags
+
+    def _is_full(self, intent: str) -> bool:
+        return self.intent_rules[intent].get("match") == "full"
+
+    def analyze(self, text: str) -> Analysis:
+        """
+        Язык и интенты сообщения за один проход по тексту.
+        Интенты с match: full засчитываются, только если все слова сообщения
+        покрыты ключевыми словами таких интентов ("да", "понятно, спасибо")
+        """
+        words = len(text.split())
+        script_language = None
+        marker_hits: Dict[str, int] = {}
+        intents = set()
+        covered = 0
+
+        pos = 0
+        while True:
+            pattern = self._keyword_pattern if script_language else self._pattern
+            match = pattern.search(text, pos)
+            if match is None:
+                break
+            pos = match.end()
+            if match.lastgroup != "kw":
+                script_language = self._scripts[match.lastgroup]
+                continue
+            full = False
+            for kind, value in self._lookup(match.group("kw")):
+                if kind == "script":
+                    script_language = script_language or value
+                elif kind == "lang":
+                    marker_hits[value] = marker_hits.get(value, 0) + 1
+                else:
+                    intents.add(value)
+                    full = full or self._is_full(value)
+            if full:
+                covered += len(WORD.findall(match.group("kw")))
+
+        intents = {
+            intent for intent in intents
+            if words <= self.intent_rules[intent].get("max_words", words)
+        }
+        if covered and covered < len(WORD.findall(text)):
+            intents = {intent for intent in intents if not self._is_full(intent)}
+
+        if script_language:
+            language = script_language
+        elif marker_hits:
+            # при равенстве — не язык по умолчанию ("Olá, thanks" → pt)
+            language = max(marker_hits, key=lambda lang: (marker_hits[lang], lang != self.default_language))
+        else:
+            language = self.default_language
+
+        return Analysis(
+            language=language,
+            intents=frozenset(intents),
+            words=words,
+            # дешевая модель без веб-поиска — только если все сообщение подтверждение
+            is_simple=any(self.intent_rules[intent].get("simple") and self._is_full(intent) for intent in intents),
+            small_talk=next(
+                (intent for intent, rule in self.intent_rules.items() if intent in intents and rule.get("reply")),
+                None
+            )
+        )
+
+    def reply(self, intent: str, language: str) -> str:
+        """Шаблонный ответ интента на языке сообщения (иначе — на языке по умолчанию)"""
+        replies = self.intent_rules[intent]["reply"]
+        return replies.get(language) or replies.get(self.default_language) or next(iter(replies.values()))
+
+    def decide(
+        self,
+        analysis: Analysis,
+        confidence: float,
+        threshold: float,
+        context_available: bool
+    ) -> Tuple[bool, str]:
+        """
+        Порядок: интенты с min_confidence (рискованные темы) → интенты
+        с escalation: never → контекст KB → CONFIDENCE_THRESHOLD.
+        Returns: (эскалировать ли, правило, которое решило)
+        """
+        for intent in sorted(analysis.intents):
+            min_confidence = self.intent_rules[intent].get("min_confidence")
+            if min_confidence is not None and confidence < float(min_confidence):
+                return True, intent
+
+        for intent in sorted(analysis.intents):
+            if self.intent_rules[intent].get("escalation") == "never":
+                return False, intent
+
+        if context_available and confidence >= self.context_min_confidence:
+            return False, "context"
+
+        if confidence >= threshold:
+            return False, "confident"
+        return True, "low_confidence"
+
+    def should_escalate(self, analysis: Analysis, confidence: float, threshold: float, context_available: bool) -> bool:
+        escalate, reason = self.decide(analysis, confidence, threshold, context_available)
+        ESCALATION_DECISIONS.inc(escalate=str(escalate).lower(), reason=reason)
+        return escalate
+
+
+def load_policy(path: str = RULES_PATH) -> EscalationPolicy:
+    with open(path, encoding="utf-8") as f:
+        return EscalationPolicy(yaml.safe_load(f) or {})
+
+
+class PolicyLoader:
+    """Держит скомпилированную политику и перечитывает файл при изменении mtime"""
+
+    def __init__(self, path: str = RULES_PATH, check_interval: float = CHECK_INTERVAL):
+        self.path = path
+        self.check_interval = check_interval
+        self._policy: Optional[EscalationPolicy] = None
+        self._mtime: Optional[float] = None
+        self._checked_at = float("-inf")
+        self._lock = threading.Lock()
+
+    def get(self) -> EscalationPolicy:
+        if self._policy is not None and time.monotonic() - self._checked_at < self.check_interval:
+            return self._policy
+
+        with self._lock:
+            self._checked_at = time.monotonic()
+            try:
+                mtime = os.stat(self.path).st_mtime
+            except OSError as e:
+                if self._policy is None:
+                    raise
+                logger.error(f"❌ Файл правил эскалации недоступен: {e}")
+                return self._policy
+
+            if mtime != self._mtime:
+                try:
+                    self._policy = load_policy(self.path)
+                    if self._mtime is not None:
+                        logger.info(f"🔄 Правила эскалации перечитаны: {self.path}")
+                    self._mtime = mtime
+                except Exception as e:
+                    if self._policy is None:
+                        raise
+                    logger.error(f"❌ Ошибка в правилах эскалации, остаются прежние: {e}")
+                    self._mtime = mtime
+        return self._policy
+
+
+_loader = PolicyLoader()
+
+
+def get_policy() -> EscalationPolicy:
+    return _loader.get()
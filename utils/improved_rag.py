@@ -1,72 +1,182 @@
 import os
+import time
+import random
 import httpx
+import asyncio
+import hashlib
 import logging
 from typing import Optional, List, Dict, Any, Tuple
-from datetime import datetime, timedelta
+from datetime import timedelta
 from sqlalchemy import select
 from sqlalchemy.orm import Session
+from database import get_db
 from database.models import KnowledgeBase, Question
+from database.embeddings import nearest
+from utils.kb_dedup import upsert_knowledge_entry
+from utils.kb_usage import KBHit, usage_tracker, hot_set
+from utils.shared_state import get_store
+from utils.rate_limit import llm_budget, embedding_budget, tavily_budget
+from utils.response_cache import response_cache, make_key
+from utils.confidence import ConfidenceSignals, confidence_scorer
+from utils.escalation_policy import Analysis, get_policy
+from bot.metrics import track_stage, record_cache, ERRORS, Counter, REGISTRY
+from bot.llm.tiers import choose_tier, record_route
+from bot.tracing import span
 
 logger = logging.getLogger(__name__)
 
+KB_SEARCH_TIMEOUT = float(os.getenv("KB_SEARCH_TIMEOUT", "5"))
+HISTORY_TIMEOUT = float(os.getenv("HISTORY_TIMEOUT", "2"))
+WEB_SEARCH_TIMEOUT = float(os.getenv("WEB_SEARCH_TIMEOUT", "12"))
+# Tavily платный и отмена не возвращает запрос: спекулятивный поиск выключен
+# по умолчанию и стартует, только если KB не ответила за SPECULATIVE_WEB_DELAY
+SPECULATIVE_WEB_SEARCH = os.getenv("SPECULATIVE_WEB_SEARCH", "false").lower() == "true"
+SPECULATIVE_WEB_DELAY = float(os.getenv("SPECULATIVE_WEB_DELAY", "0.3"))
+# Непроверенные записи из веб-поиска участвуют в поиске с пониженным весом
+KB_UNVERIFIED_WEIGHT = float(os.getenv("KB_UNVERIFIED_WEIGHT", "0.85"))
+
+SPECULATIVE_WEB = REGISTRY.register(Counter(
+    "fsoul_speculative_web_search_total",
+    "Speculatively started web searches by outcome",
+    ["result"]
+))
+
+
+TAVILY_CONNECT_TIMEOUT = float(os.getenv("TAVILY_CONNECT_TIMEOUT", "3"))
+TAVILY_READ_TIMEOUT = float(os.getenv("TAVILY_READ_TIMEOUT", "10"))
+TAVILY_RETRIES = int(os.getenv("TAVILY_RETRIES", "2"))
+TAVILY_INCLUDE_RAW_CONTENT = os.getenv("TAVILY_INCLUDE_RAW_CONTENT", "false").lower() == "true"
+TAVILY_RAW_CONTENT_CHARS = int(os.getenv("TAVILY_RAW_CONTENT_CHARS", "2000"))
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
 
 class TavilyWebSearch:
     """Интеграция с Tavily API для веб-поиска"""
     
+    # Один пул соединений на процесс: keep-alive, HTTP/2 и прокси
+    _client: Optional[httpx.AsyncClient] = None
+    _loop: Optional[asyncio.AbstractEventLoop] = None
+    
     def __init__(self, api_key: Optional[str] = None):
         self.api_key = api_key or os.getenv("TAVILY_API_KEY")
-        self.base_url = "https://api.tavily.com/search"
-        self.timeout = 10.0
+        self.base_url = os.getenv("TAVILY_BASE_URL", "https://api.tavily.com/search")
+        self.timeout = httpx.Timeout(TAVILY_READ_TIMEOUT, connect=TAVILY_CONNECT_TIMEOUT)
         
         if not self.api_key:
             logger.warning("⚠️ TAVILY_API_KEY не установлен. Веб-поиск отключен.")
     
+    @classmethod
+    def client(cls) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        if cls._client is None or cls._client.is_closed or cls._loop is not loop:
+            # Соединения пула привязаны к event loop, в котором созданы
+            cls._loop = loop
+            proxy_url = os.getenv("TAVILY_PROXY") or os.getenv("SHADOWSOCKS_PROXY")
+            if proxy_url:
+                logger.info(f"🔐 Using proxy for Tavily: {proxy_url}")
+            
+            http2 = os.getenv("TAVILY_HTTP2", "true").lower() == "true"
+            if http2:
+                try:
+                    import h2  # noqa: F401
+                except ImportError:
+                    logger.warning("⚠️ Пакет h2 не установлен, Tavily работает по HTTP/1.1")
+                    http2 = False
+            
+            max_connections = int(os.getenv("TAVILY_CONCURRENCY", "4"))
+            cls._client = httpx.AsyncClient(
+                http2=http2,
+                proxy=proxy_url or None,
+                timeout=httpx.Timeout(TAVILY_READ_TIMEOUT, connect=TAVILY_CONNECT_TIMEOUT),
+                limits=httpx.Limits(
+                    max_connections=max_connections,
+                    max_keepalive_connections=max_connections,
+                    keepalive_expiry=float(os.getenv("TAVILY_KEEPALIVE_EXPIRY", "60"))
+                )
+            )
+        return cls._client
+    
+    @classmethod
+    async def aclose(cls):
+        if cls._client is not None:
+            await cls._client.aclose()
+            cls._client = None
+    
+    @staticmethod
+    def _retry_delay(attempt: int, response: Optional[httpx.Response]) -> float:
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return float(response.headers["Retry-After"])
+        return 0.5 * (2 ** attempt) * random.uniform(0.5, 1.5)
+    
+    @staticmethod
+    def _trim(data: Dict[str, Any]) -> Dict[str, Any]:
+        """Обрезает raw_content сразу после парсинга, чтобы не держать страницы целиком"""
+        for item in data.get("results", []):
+            raw = item.get("raw_content")
+            if raw and len(raw) > TAVILY_RAW_CONTENT_CHARS:
+                item["raw_content"] = raw[:TAVILY_RAW_CONTENT_CHARS]
+        return data
+    
     async def search(
         self, 
         query: str,
         max_results: int = 5,
         include_answer: bool = True,
         search_depth: str = "basic",
-        topic: str = "general"
+        topic: str = "general",
+        timeout: Optional[httpx.Timeout] = None
     ) -> Optional[Dict[str, Any]]:
-        """Выполняет веб-поиск через Tavily"""
+        """Выполняет веб-поиск через Tavily (с повторами на 429/5xx)"""
         if not self.api_key:
             logger.error("❌ API ключ Tavily не установлен")
             return None
         
-        try:
-            payload = {
-                "api_key": self.api_key,
-                "query": query,
-                "max_results": min(max_results, 20),
-                "include_answer": include_answer,
-                "search_depth": search_depth,
-                "topic": topic,
-                "include_images": False,
-                "include_raw_content": True
-            }
-            
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    self.base_url,
-                    json=payload,
-                    timeout=self.timeout
-                )
-                response.raise_for_status()
+        payload = {
+            "api_key": self.api_key,
+            "query": query,
+            "max_results": min(max_results, 20),
+            "include_answer": include_answer,
+            "search_depth": search_depth,
+            "topic": topic,
+            "include_images": False,
+            "include_raw_content": TAVILY_INCLUDE_RAW_CONTENT
+        }
+        
+        for attempt in range(TAVILY_RETRIES + 1):
+            response = None
+            try:
+                with span("tavily.search", search_depth=search_depth, attempt=attempt) as call:
+                    response = await self.client().post(
+                        self.base_url,
+                        json=payload,
+                        timeout=timeout or self.timeout
+                    )
+                    call.set(status_code=response.status_code, http_version=response.http_version)
+                    response.raise_for_status()
                 
-                data = response.json()
+                data = self._trim(response.json())
                 logger.info(f"✅ Tavily поиск успешен: {query}")
                 return data
+            
+            except httpx.HTTPStatusError as e:
+                retryable = e.response.status_code in RETRY_STATUSES
+                logger.error(f"❌ HTTP ошибка Tavily ({e.response.status_code}): {e.response.text[:500]}")
+            except (httpx.ConnectError, httpx.ConnectTimeout) as e:
+                retryable = True
+                logger.error(f"❌ Не удалось подключиться к Tavily: {e}")
+            except httpx.TimeoutException:
+                retryable = False
+                logger.error(f"⏱️ Timeout при запросе к Tavily")
+            except Exception as e:
+                retryable = False
+                logger.error(f"❌ Ошибка запроса Tavily: {e}")
+            
+            ERRORS.inc(provider="tavily", stage="tavily")
+            if not retryable or attempt == TAVILY_RETRIES:
+                return None
+            await asyncio.sleep(self._retry_delay(attempt, response))
         
-        except httpx.HTTPStatusError as e:
-            logger.error(f"❌ HTTP ошибка Tavily ({e.response.status_code}): {e.response.text}")
-            return None
-        except httpx.TimeoutException:
-            logger.error(f"⏱️ Timeout при запросе к Tavily")
-            return None
-        except Exception as e:
-            logger.error(f"❌ Ошибка запроса Tavily: {e}")
-            return None
+        return None
     
     async def format_results(
         self, 
@@ -105,10 +215,15 @@ class ImprovedRAGSystemWithTavily:
     def __init__(self, llm, top_k: int = 5, tavily_api_key: Optional[str] = None):
         self.llm = llm
         self.top_k = top_k
+        self.max_distance = 0.5
         self.conversation_cache = {}
         self.web_search = TavilyWebSearch(api_key=tavily_api_key)
+        # Эмбеддинг последнего вопроса из search_entries — его переиспользует запись в questions
+        self.query_embedding: Optional[List[float]] = None
+        # Сигналы уверенности последнего ответа — сохраняются в questions для калибровки
+        self.confidence_signals: Optional[ConfidenceSignals] = None
         
-        self.search_cache = {}
+        self.search_cache = get_store()
         self.cache_ttl = timedelta(hours=1)
     
     async def search_similar(
@@ -122,29 +237,59 @@ class ImprovedRAGSystemWithTavily:
         Returns:
             List[(question, answer, similarity)]
         """
+        hits = await self.search_entries(db, question)
+        return [(h.question, h.answer, h.similarity) for h in hits]
+    
+    async def search_entries(
+        self,
+        db: Session,
+        question: str
+    ) -> List[KBHit]:
+        """
+        Ищет похожие записи: сначала горячий кеш, затем Postgres.
+        Сходство непроверенных записей умножается на KB_UNVERIFIED_WEIGHT.
+        Попадания учитываются в usage_count пакетно.
+        """
         try:
-            question_embedding = await self.llm.generate_embedding(question)
+            async with embedding_budget.slot():
+                with track_stage("embedding"):
+                    question_embedding = await self.llm.generate_embedding(question)
+            self.query_embedding = question_embedding
             
-            results = db.execute(
-                select(
+            hits = hot_set.lookup(question_embedding, self.top_k, self.max_distance)
+            record_cache("kb_hot_set", hits is not None)
+            
+            if hits is None:
+                query = select(
+                    KnowledgeBase.id,
                     KnowledgeBase.question,
                     KnowledgeBase.answer,
-                    KnowledgeBase.question_embedding.cosine_distance(question_embedding).label('distance')
+                    KnowledgeBase.updated_at,
+                    KnowledgeBase.verified
                 )
-                .where(KnowledgeBase.verified == True)
-                .order_by('distance')
-                .limit(self.top_k)
-            ).fetchall()
+                if KB_UNVERIFIED_WEIGHT <= 0:
+                    query = query.where(KnowledgeBase.verified == True)
+                
+                with track_stage("kb_search"):
+                    results = db.execute(
+                        nearest(query, question_embedding, self.top_k * 2)
+                    ).fetchall()
+                
+                hits = []
+                for r in results:
+                    similarity = 1 - r.distance
+                    if not r.verified:
+                        similarity *= KB_UNVERIFIED_WEIGHT
+                    if 1 - similarity < self.max_distance:
+                        hits.append(KBHit(r.id, r.question, r.answer, similarity, r.updated_at, r.verified))
+                hits = sorted(hits, key=lambda h: h.similarity, reverse=True)[:self.top_k]
             
-            similar = [
-                (r.question, r.answer, 1 - r.distance) 
-                for r in results 
-                if r.distance < 0.5
-            ]
+            usage_tracker.record(h.id for h in hits)
             
-            return similar
+            return hits
         except Exception as e:
             logger.error(f"❌ Ошибка поиска похожих: {e}")
+            ERRORS.inc(provider="postgres", stage="kb_search")
             return []
     
     def get_conversation_history(
@@ -155,11 +300,12 @@ class ImprovedRAGSystemWithTavily:
     ) -> List[Tuple[str, str]]:
         """Получает историю разговора пользователя"""
         try:
-            history = db.query(Question).filter(
-                Question.user_id == user_id,
-                Question.status == "answered",
-                Question.answer_text.isnot(None)
-            ).order_by(Question.created_at.desc()).limit(limit).all()
+            with track_stage("history"):
+                history = db.query(Question).filter(
+                    Question.user_id == user_id,
+                    Question.status == "answered",
+                    Question.answer_text.isnot(None)
+                ).order_by(Question.created_at.desc()).limit(limit).all()
             
             return [
                 (q.question_text, q.answer_text) 
@@ -167,6 +313,7 @@ class ImprovedRAGSystemWithTavily:
             ]
         except Exception as e:
             logger.error(f"❌ Ошибка получения истории: {e}")
+            ERRORS.inc(provider="postgres", stage="history")
             return []
     
     async def _search_web(
@@ -176,19 +323,25 @@ class ImprovedRAGSystemWithTavily:
         search_depth: str = "basic"
     ) -> Optional[str]:
         """Поиск в интернете с поддержкой кеша"""
-        if use_cache and query in self.search_cache:
-            cached_time, cached_result = self.search_cache[query]
-            if datetime.utcnow() - cached_time < self.cache_ttl:
+        query_hash = hashlib.sha1(query.strip().lower().encode()).hexdigest()
+        cache_key = f"web:{search_depth}:{query_hash}"
+        
+        if use_cache:
+            cached_result = self.search_cache.get(cache_key)
+            record_cache("web_search", cached_result is not None)
+            if cached_result is not None:
                 logger.info(f"📦 Результат из кеша для: {query}")
                 return cached_result
         
-        search_data = await self.web_search.search(
-            query=query,
-            max_results=5,
-            include_answer=True,
-            search_depth=search_depth,
-            topic="general"
-        )
+        async with tavily_budget.slot():
+            with track_stage("tavily"):
+                search_data = await self.web_search.search(
+                    query=query,
+                    max_results=5,
+                    include_answer=True,
+                    search_depth=search_depth,
+                    topic="general"
+                )
         
         if not search_data:
             return None
@@ -196,65 +349,158 @@ class ImprovedRAGSystemWithTavily:
         formatted = await self.web_search.format_results(search_data, max_sources=5)
         
         if use_cache:
-            self.search_cache[query] = (datetime.utcnow(), formatted)
+            self.search_cache.set(cache_key, formatted, ttl=self.cache_ttl.total_seconds())
         
         return formatted
     
+    async def _stage(self, stage: str, awaitable, timeout: float, default):
+        """Ждет этап не дольше timeout; при таймауте конвейер идет дальше без него"""
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"⏱ Этап {stage} не уложился в {timeout} с")
+            ERRORS.inc(provider="pipeline", stage=f"{stage}_timeout")
+            return default
+    
+    def _load_history(self, user_id: int, limit: int) -> List[Tuple[str, str]]:
+        # Своя сессия: основная в это время занята поиском по KB
+        with get_db() as db:
+            return self.get_conversation_history(db, user_id, limit=limit)
+    
+    async def _gather_context(
+        self,
+        db: Session,
+        question: str,
+        user_id: int,
+        use_web_search: bool,
+        search_depth: str,
+        simple: bool
+    ) -> Tuple[List[KBHit], List[Tuple[str, str]], Optional[str]]:
+        """
+        История, эмбеддинг + поиск по KB и веб-поиск идут параллельно.
+        С SPECULATIVE_WEB_SEARCH веб-поиск стартует, если KB медлит дольше
+        SPECULATIVE_WEB_DELAY, и отменяется, если KB что-то нашла
+        """
+        
+        def start_web_search() -> asyncio.Task:
+            return asyncio.create_task(self._stage(
+                "tavily",
+                self._search_web(question, use_cache=True, search_depth=search_depth),
+                WEB_SEARCH_TIMEOUT,
+                None
+            ))
+        
+        kb_task = asyncio.create_task(
+            self._stage("kb_search", self.search_entries(db, question), KB_SEARCH_TIMEOUT, [])
+        )
+        history_task = asyncio.create_task(
+            self._stage("history", asyncio.to_thread(self._load_history, user_id, 3), HISTORY_TIMEOUT, [])
+        )
+        web_task = start_web_search() if use_web_search else None
+        
+        try:
+            if web_task is None and SPECULATIVE_WEB_SEARCH and not simple and self.web_search.api_key:
+                done, _ = await asyncio.wait({kb_task}, timeout=SPECULATIVE_WEB_DELAY)
+                if not done:
+                    web_task = start_web_search()
+            
+            hits = await kb_task
+            
+            if hits and web_task and not use_web_search:
+                web_task.cancel()
+                web_task = None
+                SPECULATIVE_WEB.inc(result="cancelled")
+            elif not hits and not simple:
+                if web_task is None:
+                    web_task = start_web_search()
+                elif not use_web_search:
+                    SPECULATIVE_WEB.inc(result="used")
+            
+            conversation_history = await history_task
+            web_context = await web_task if web_task else None
+        finally:
+            for task in (kb_task, history_task, web_task):
+                if task and not task.done():
+                    task.cancel()
+        
+        return hits, conversation_history, web_context
+    
     async def get_answer_with_web_search(
         self,
         db: Session,
         question: str,
         user_id: int,
         use_web_search: bool = False,
-        search_depth: str = "basic"
+        search_depth: str = "basic",
+        analysis: Optional[Analysis] = None
     ) -> Tuple[str, float, List[Tuple[str, str]]]:
         """
-        Получает ответ с использованием RAG + контекст + веб-поиск
+        Получает ответ с использованием RAG + контекст + веб-поиск.
+        analysis — разбор вопроса политикой эскалации, если он уже сделан
         
         Returns:
             (answer, confidence, context_sources)
         """
-        kb_context = await self.search_similar(db, question)
-        
-        conversation_history = self.get_conversation_history(db, user_id, limit=3)
+        analysis = analysis or get_policy().analyze(question)
+        hits, conversation_history, web_context = await self._gather_context(
+            db, question, user_id, use_web_search, search_depth, analysis.is_simple
+        )
+        kb_context = [(h.question, h.answer, h.similarity) for h in hits]
         
-        web_context = None
-        if use_web_search or (not kb_context and not self.is_simple_question(question)):
-            web_context = await self._search_web(
-                question, 
-                use_cache=True,
-                search_depth=search_depth
-            )
-            if web_context:
-                logger.info(f"🌐 Добавлен веб-контекст для вопроса: {question}")
+        if web_context:
+            logger.info(f"🌐 Добавлен веб-контекст для вопроса: {question}")
         
-        response = await self.llm.generate_answer(
-            question=question,
-            context=[(q, a) for q, a, _ in kb_context],
-            conversation_history=conversation_history,
-            web_context=web_context
+        tier, reason = choose_tier(
+            question,
+            kb_context,
+            is_simple=analysis.is_simple,
+            has_web_context=bool(web_context)
         )
         
-        if kb_context and kb_context[0][2] > 0.8:
-            response.confidence = max(response.confidence, 0.85)
-        elif web_context:
-            response.confidence = max(response.confidence, 0.75)
+        # Ответ, опирающийся только на KB, однозначно задан вопросом и версиями записей
+        cache_key = None
+        if response_cache.enabled and hits and not web_context:
+            model = getattr(self.llm, "models", {}).get(tier) or getattr(self.llm, "model", "")
+            cache_key = make_key(question, hits, model, tier)
+        
+        response = response_cache.get(db, cache_key) if cache_key else None
+        if response is not None:
+            logger.info(f"📦 Ответ из кеша для: {question[:50]}")
+        else:
+            async with llm_budget.slot():
+                started = time.perf_counter()
+                response = await self.llm.generate_answer(
+                    question=question,
+                    context=[(q, a) for q, a, _ in kb_context],
+                    conversation_history=conversation_history,
+                    web_context=web_context,
+                    tier=tier
+                )
+            record_route(tier, reason, response, time.perf_counter() - started)
+            
+            if cache_key:
+                response_cache.put(db, cache_key, hits, response)
+        
+        self.confidence_signals = ConfidenceSignals(
+            self_reported=response.confidence,
+            token=response.token_confidence,
+            similarity=kb_context[0][2] if kb_context else 0.0,
+            has_context=bool(kb_context),
+            has_web=bool(web_context)
+        )
+        # Оборванный или пустой ответ клиенту не уходит — только админу как черновик
+        unusable = response.failed or response.truncated or not response.answer.strip()
+        confidence = 0.0 if unusable else confidence_scorer.score(self.confidence_signals)
         
         sources = [(q, a) for q, a, _ in kb_context]
         if web_context:
             sources.append(("Web Search", web_context))
         
-        return response.answer, response.confidence, sources
+        return response.answer, confidence, sources
     
     def is_simple_question(self, question: str) -> bool:
-        """Определяет простые вопросы"""
-        simple_patterns = [
-            'спасибо', 'thanks', 'obrigado',
-            'понятно', 'ясно', 'got it', 'ok',
-            'да', 'нет', 'yes', 'no'
-        ]
-        q_lower = question.lower().strip()
-        return any(p in q_lower for p in simple_patterns) and len(question.split()) < 10
+        """Определяет простые вопросы (интенты с simple: true в правилах эскалации)"""
+        return get_policy().analyze(question).is_simple
     
     async def add_to_knowledge_base(
         self,
@@ -264,20 +510,21 @@ class ImprovedRAGSystemWithTavily:
         source: str = "admin",
         verified: bool = True
     ):
-        """Добавляет новую пару Q&A в базу знаний"""
+        """Добавляет новую пару Q&A в базу знаний (с дедупликацией)"""
         try:
-            embedding = await self.llm.generate_embedding(question)
+            async with embedding_budget.slot():
+                embedding = await self.llm.generate_embedding(question)
             
-            kb_entry = KnowledgeBase(
+            kb_entry = upsert_knowledge_entry(
+                db,
                 question=question,
                 answer=answer,
-                question_embedding=embedding,
+                embedding=embedding,
                 source=source,
                 verified=verified
             )
-            
-            db.add(kb_entry)
             db.commit()
+            hot_set.invalidate()
             
             return kb_entry
         except Exception as e:
@@ -287,5 +534,5 @@ class ImprovedRAGSystemWithTavily:
     
     def clear_cache(self):
         """Очищает кеш поиска"""
-        self.search_cache.clear()
+        self.search_cache.clear("web:")
         logger.info("🗑️ Кеш поиска очищен")
\ No newline at end of file
@@ -0,0 +1,155 @@
+"""
+Дедупликация базы знаний: поиск и слияние почти одинаковых Q&A пар
+"""
+
+import os
+import logging
+from typing import List, Optional
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from database.models import KnowledgeBase
+from database.embeddings import nearest
+from utils.response_cache import response_cache
+
+logger = logging.getLogger(__name__)
+
+DEDUP_THRESHOLD = float(os.getenv("KB_DEDUP_THRESHOLD", "0.95"))
+COMPACTION_CANDIDATES = 10
+
+
+def find_near_duplicates(
+    db: Session,
+    embedding: List[float],
+    threshold: Optional[float] = None,
+    limit: int = 1,
+    exclude_id: Optional[int] = None
+) -> List[KnowledgeBase]:
+    """
+    Ищет записи, похожие на эмбеддинг выше порога.
+    ORDER BY distance LIMIT n обслуживается HNSW индексом.
+    """
+    threshold = DEDUP_THRESHOLD if threshold is None else threshold
+
+    query = select(KnowledgeBase)
+    if exclude_id is not None:
+        query = query.where(KnowledgeBase.id != exclude_id)
+
+    rows = db.execute(nearest(query, embedding, limit)).all()
+
+    return [entry for entry, dist in rows if dist is not None and 1 - dist >= threshold]
+
+
+def merge_entries(db: Session, entries: List[KnowledgeBase]) -> KnowledgeBase:
+    """
+    Сливает группу дублей в одну запись.
+    Остается самый свежий проверенный ответ, usage_count суммируется.
+    """
+    verified = [e for e in entries if e.verified]
+    pool = verified or entries
+    survivor = max(pool, key=lambda e: e.updated_at or e.created_at)
+
+    survivor.usage_count = sum(e.usage_count or 0 for e in entries)
+    survivor.verified = bool(verified)
+
+    for entry in entries:
+        if entry.id != survivor.id:
+            db.delete(entry)
+
+    response_cache.invalidate(db, [e.id for e in entries])
+
+    return survivor
+
+
+def upsert_knowledge_entry(
+    db: Session,
+    question: str,
+    answer: str,
+    embedding: List[float],
+    source: str = "admin",
+    verified: bool = True
+) -> KnowledgeBase:
+    """Добавляет Q&A, сливая с почти одинаковой записью если она есть"""
+    duplicates = find_near_duplicates(db, embedding)
+
+    if not duplicates:
+        kb_entry = KnowledgeBase(
+            question=question,
+            answer=answer,
+            question_embedding=embedding,
+            source=source,
+            verified=verified
+        )
+        db.add(kb_entry)
+        return kb_entry
+
+    existing = duplicates[0]
+
+    if verified or not existing.verified:
+        existing.answer = answer
+        existing.source = source
+        existing.verified = existing.verified or verified
+        response_cache.invalidate(db, [existing.id])
+
+    logger.info(f"🔁 Дубль KB #{existing.id} обновлен вместо вставки: {question[:50]}")
+    return existing
+
+
+def compact_knowledge_base(
+    db: Session,
+    threshold: Optional[float] = None,
+    dry_run: bool = False
+) -> int:
+    """
+    Офлайн-сжатие базы знаний: сливает все группы почти одинаковых записей.
+
+    Returns:
+        Количество удаленных записей
+    """
+    threshold = DEDUP_THRESHOLD if threshold is None else threshold
+
+    entry_ids = db.execute(
+        select(KnowledgeBase.id)
+        .where(KnowledgeBase.question_embedding.isnot(None))
+        .order_by(KnowledgeBase.id)
+    ).scalars().all()
+
+    removed_ids = set()
+
+    for entry_id in entry_ids:
+        if entry_id in removed_ids:
+            continue
+
+        entry = db.get(KnowledgeBase, entry_id)
+        if entry is None:
+            continue
+
+        duplicates = [
+            d for d in find_near_duplicates(
+                db,
+                entry.question_embedding,
+                threshold=threshold,
+                limit=COMPACTION_CANDIDATES,
+                exclude_id=entry.id
+            )
+            if d.id not in removed_ids
+        ]
+        if not duplicates:
+            continue
+
+        group = [entry] + duplicates
+
+        if dry_run:
+            survivor = entry
+            print(f"  🔍 #{entry.id}: {len(duplicates)} дубл(ей) — {entry.question[:60]}")
+        else:
+            survivor = merge_entries(db, group)
+            db.flush()
+
+        removed_ids.update(e.id for e in group if e.id != survivor.id)
+
+    if dry_run:
+        db.rollback()
+    else:
+        db.commit()
+
+    return len(removed_ids)
@@ -0,0 +1,260 @@
+"""
+Учет использования базы знаний и горячий in-memory кеш популярных записей
+"""
+
+import os
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, NamedTuple, Optional
+import numpy as np
+from sqlalchemy import select, text
+from database import get_db
+from database.models import KnowledgeBase
+from database.embeddings import to_array
+from utils.shared_state import get_store
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = float(os.getenv("KB_USAGE_FLUSH_INTERVAL", "30"))
+FLUSH_MAX_PENDING = int(os.getenv("KB_USAGE_FLUSH_MAX_PENDING", "500"))
+
+HOT_SET_SIZE = int(os.getenv("KB_HOT_SET_SIZE", "50"))
+HOT_SET_MIN_SIMILARITY = float(os.getenv("KB_HOT_SET_MIN_SIMILARITY", "0.9"))
+HOT_SET_REFRESH = timedelta(seconds=float(os.getenv("KB_HOT_SET_REFRESH", "600")))
+# Версия KB в shared_state: меняется при правке записей, воркеры перечитывают горячий кеш
+HOT_SET_VERSION_KEY = "kb:hot_set_version"
+
+
+class KBHit(NamedTuple):
+    """Найденная запись базы знаний"""
+    id: int
+    question: str
+    answer: str
+    similarity: float
+    updated_at: Optional[datetime] = None
+    verified: bool = True
+
+
+class UsageTracker:
+    """
+    Копит попадания в записи KB в памяти и сбрасывает их в Postgres
+    одним UPDATE раз в FLUSH_INTERVAL секунд (или при FLUSH_MAX_PENDING)
+    """
+
+    def __init__(self, flush_interval: float = FLUSH_INTERVAL, max_pending: int = FLUSH_MAX_PENDING):
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self._hits: Counter = Counter()
+        self._last_used: Dict[int, datetime] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self):
+        """Запускает фоновый сброс счетчиков в текущем event loop"""
+        if self._task and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    def record(self, entry_ids: Iterable[int]):
+        """Регистрирует попадания в записи (без обращения к БД)"""
+        now = datetime.utcnow()
+        for entry_id in entry_ids:
+            self._hits[entry_id] += 1
+            self._last_used[entry_id] = now
+
+        try:
+            self.start()
+        except RuntimeError:
+            return
+
+        if sum(self._hits.values()) >= self.max_pending:
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+                if hot_set.is_stale():
+                    await asyncio.to_thread(hot_set.load)
+            except Exception as e:
+                logger.error(f"❌ Ошибка сброса счетчиков KB: {e}")
+
+    async def flush(self):
+        """Сбрасывает накопленные счетчики в БД"""
+        if not self._hits:
+            return
+
+        hits, last_used = self._hits, self._last_used
+        self._hits, self._last_used = Counter(), {}
+
+        try:
+            await asyncio.to_thread(self._write, hits, last_used)
+        except Exception:
+            self._hits.update(hits)
+            for entry_id, used_at in last_used.items():
+                self._last_used[entry_id] = max(used_at, self._last_used.get(entry_id, used_at))
+            raise
+
+    async def stop(self):
+        """Останавливает фоновый сброс и сбрасывает остаток"""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    @staticmethod
+    def _write(hits: Counter, last_used: Dict[int, datetime]):
+        ids = list(hits.keys())
+        with get_db() as db:
+            db.execute(
+                text("""
+                    UPDATE knowledge_base AS kb
+                    SET usage_count = COALESCE(kb.usage_count, 0) + u.hits,
+                        last_used_at = GREATEST(kb.last_used_at, u.used_at)
+                    FROM unnest(:ids, :hits, :used_at) AS u(id, hits, used_at)
+                    WHERE kb.id = u.id
+                """),
+                {
+                    "ids": ids,
+                    "hits": [hits[i] for i in ids],
+                    "used_at": [last_used[i] for i in ids]
+                }
+            )
+            db.commit()
+        logger.info(f"📈 Сброшены счетчики использования KB: {len(ids)} записей")
+
+
+class HotSetCache:
+    """
+    Топ-N самых используемых записей KB с эмбеддингами в памяти.
+    Проверяется до похода в Postgres.
+    """
+
+    def __init__(
+        self,
+        size: int = HOT_SET_SIZE,
+        min_similarity: float = HOT_SET_MIN_SIMILARITY,
+        refresh_interval: timedelta = HOT_SET_REFRESH
+    ):
+        self.size = size
+        self.min_similarity = min_similarity
+        self.refresh_interval = refresh_interval
+        self.entries: List[KBHit] = []
+        self._matrix: Optional[np.ndarray] = None
+        self.loaded_at: Optional[datetime] = None
+        self._version = None
+
+    @staticmethod
+    def _shared_version():
+        try:
+            return get_store().get(HOT_SET_VERSION_KEY)
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось прочитать версию горячего кеша KB: {e}")
+            return None
+
+    def is_stale(self) -> bool:
+        if self.size <= 0:
+            return False
+        if self.loaded_at is None or datetime.utcnow() - self.loaded_at > self.refresh_interval:
+            return True
+        # запись KB изменили в другом процессе
+        return self._shared_version() != self._version
+
+    def invalidate(self):
+        """
+        Сбрасывает кеш: до перезагрузки поиск идет в Postgres.
+        Версия в shared_state заставляет перечитать кеш и другие процессы
+        """
+        self.entries, self._matrix = [], None
+        self.loaded_at = None
+        try:
+            get_store().update(HOT_SET_VERSION_KEY, lambda old: ((old or 0) + 1, None))
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось обновить версию горячего кеша KB: {e}")
+
+    def load(self):
+        """Загружает горячие записи из БД"""
+        if self.size <= 0:
+            return
+
+        # версия читается до запроса: правка во время загрузки вызовет повторную
+        version = self._shared_version()
+        with get_db() as db:
+            rows = db.execute(
+                select(
+                    KnowledgeBase.id,
+                    KnowledgeBase.question,
+                    KnowledgeBase.answer,
+                    KnowledgeBase.updated_at,
+                    KnowledgeBase.question_embedding
+                )
+                .where(
+                    KnowledgeBase.verified == True,
+                    KnowledgeBase.usage_count > 0,
+                    KnowledgeBase.question_embedding.isnot(None)
+                )
+                .order_by(KnowledgeBase.usage_count.desc())
+                .limit(self.size)
+            ).fetchall()
+
+        entries = [KBHit(r.id, r.question, r.answer, 1.0, r.updated_at) for r in rows]
+        matrix = None
+        if rows:
+            matrix = np.stack([to_array(r.question_embedding) for r in rows])
+            matrix /= np.linalg.norm(matrix, axis=1, keepdims=True) + 1e-12
+
+        self.entries, self._matrix = entries, matrix
+        self.loaded_at = datetime.utcnow()
+        self._version = version
+        logger.info(f"🔥 Горячий кеш KB загружен: {len(entries)} записей")
+
+    def lookup(
+        self,
+        embedding: List[float],
+        top_k: int,
+        max_distance: float
+    ) -> Optional[List[KBHit]]:
+        """
+        Возвращает совпадения из горячего кеша, если лучшее из них
+        не хуже min_similarity и в пределах max_distance набралось top_k записей.
+        Иначе None — нужно идти в Postgres.
+        """
+        if self._matrix is None:
+            return None
+
+        query = np.asarray(embedding, dtype=np.float32)
+        if query.shape[0] != self._matrix.shape[1]:
+            return None
+        # без /=: float32 массив вызывающего не копируется asarray
+        query = query / (np.linalg.norm(query) + 1e-12)
+
+        similarities = self._matrix @ query
+        order = np.argsort(-similarities)[:top_k]
+
+        if similarities[order[0]] < self.min_similarity:
+            return None
+
+        hits = [
+            self.entries[i]._replace(similarity=float(similarities[i]))
+            for i in order
+            if 1 - similarities[i] < max_distance
+        ]
+        # меньше top_k — в Postgres могут быть подходящие записи вне горячего набора
+        return hits if len(hits) >= top_k else None
+
+
+usage_tracker = UsageTracker()
+hot_set = HotSetCache()
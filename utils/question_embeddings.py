@@ -0,0 +1,168 @@
+"""
+Политика хранения эмбеддингов входящих вопросов (QUESTION_EMBEDDING_POLICY):
+- escalated (по умолчанию) — только эскалированные, для кластеризации очереди админа
+- sampled — эскалированные и доля QUESTION_EMBEDDING_SAMPLE_RATE остальных (аналитика)
+- all — все вопросы, none — ни одного
+
+Отдельного вызова эмбеддинга нет: сохраняется вектор, уже посчитанный
+для поиска по KB. Пропуски (таймаут поиска, смена политики) досчитывает
+фоновый backfill пачками; из нескольких воркеров его запускает только
+тот, кто взял lease в shared_state.
+"""
+
+import os
+import random
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import List, Optional
+from sqlalchemy import select, update
+from database import get_db
+from database.models import Question
+from database.partitions import EMBEDDING_RETENTION_DAYS
+from utils.rate_limit import embedding_budget
+
+logger = logging.getLogger(__name__)
+
+POLICY = os.getenv("QUESTION_EMBEDDING_POLICY", "escalated").lower()
+SAMPLE_RATE = float(os.getenv("QUESTION_EMBEDDING_SAMPLE_RATE", "0.1"))
+BACKFILL_BATCH = int(os.getenv("QUESTION_EMBEDDING_BACKFILL_BATCH", "64"))
+BACKFILL_INTERVAL = float(os.getenv("QUESTION_EMBEDDING_BACKFILL_INTERVAL", "3600"))
+# Срок lease на случай, если воркер упал посреди backfill
+BACKFILL_LEASE_TTL = 600
+BACKFILL_LEASE_KEY = "backfill:question_embeddings"
+
+
+def should_persist(status: str) -> bool:
+    """Нужен ли эмбеддинг вопросу с таким итоговым статусом"""
+    if POLICY == "all":
+        return True
+    if POLICY == "none":
+        return False
+    if status == "escalated":
+        return True
+    return POLICY == "sampled" and random.random() < SAMPLE_RATE
+
+
+def backfill_statuses() -> Optional[List[str]]:
+    """Статусы, которые backfill досчитывает (None — все)"""
+    if POLICY == "all":
+        return None
+    if POLICY == "none":
+        return []
+    return ["escalated"]
+
+
+class QuestionEmbeddingBackfill:
+    """Досчитывает недостающие эмбеддинги вопросов по запросу или раз в interval секунд"""
+
+    def __init__(self, interval: float = BACKFILL_INTERVAL, batch_size: int = BACKFILL_BATCH):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.llm = None
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self):
+        if self._task and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._loop())
+
+    def request(self, llm):
+        """Будит воркер: есть вопросы, которым не хватает эмбеддинга"""
+        self.llm = llm
+        try:
+            self.start()
+        except RuntimeError:
+            return
+        self._wakeup.set()
+
+    async def _loop(self):
+        while True:
+            try:
+                timeout = self.interval if self.interval > 0 else None
+                await asyncio.wait_for(self._wakeup.wait(), timeout=timeout)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            from utils.shared_state import get_store
+
+            store = get_store()
+            # Одни и те же строки question_embedding IS NULL видят все воркеры — считает один
+            if not store.set_if_absent(BACKFILL_LEASE_KEY, True, ttl=BACKFILL_LEASE_TTL):
+                continue
+            try:
+                if self.llm is None:
+                    from bot.llm import get_llm
+                    self.llm = get_llm()
+                await self.run(self.llm)
+            except Exception as e:
+                logger.error(f"❌ Ошибка backfill эмбеддингов вопросов: {e}")
+            finally:
+                store.delete(BACKFILL_LEASE_KEY)
+
+    async def run(self, llm, statuses: Optional[List[str]] = None, limit: Optional[int] = None) -> int:
+        """
+        Заполняет эмбеддинги пачками по batch_size.
+        Вопросы старше срока хранения эмбеддингов (retention) пропускаются.
+        Returns: сколько вопросов обработано
+        """
+        statuses = backfill_statuses() if statuses is None else statuses
+        if statuses == []:
+            return 0
+
+        filled = 0
+        while limit is None or filled < limit:
+            size = self.batch_size if limit is None else min(self.batch_size, limit - filled)
+            rows = await asyncio.to_thread(self._pending, statuses, size)
+            if not rows:
+                break
+
+            async with embedding_budget.slot():
+                embeddings = await llm.generate_embeddings([r.question_text for r in rows])
+
+            await asyncio.to_thread(self._write, rows, embeddings)
+            filled += len(rows)
+
+        if filled:
+            logger.info(f"🧮 Досчитаны эмбеддинги вопросов: {filled}")
+        return filled
+
+    @staticmethod
+    def _pending(statuses: Optional[List[str]], size: int):
+        query = select(Question.id, Question.created_at, Question.question_text).where(
+            Question.question_embedding.is_(None)
+        )
+        if statuses is not None:
+            query = query.where(Question.status.in_(statuses))
+        if EMBEDDING_RETENTION_DAYS > 0:
+            query = query.where(Question.created_at >= datetime.utcnow() - timedelta(days=EMBEDDING_RETENTION_DAYS))
+
+        with get_db() as db:
+            return db.execute(query.order_by(Question.created_at.desc()).limit(size)).fetchall()
+
+    @staticmethod
+    def _write(rows, embeddings: List[List[float]]):
+        with get_db() as db:
+            db.execute(
+                update(Question),
+                [
+                    {"id": r.id, "created_at": r.created_at, "question_embedding": embedding}
+                    for r, embedding in zip(rows, embeddings)
+                ]
+            )
+            db.commit()
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+question_backfill = QuestionEmbeddingBackfill()
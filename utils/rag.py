@@ -1,8 +1,10 @@
 from typing import List, Tuple
-from sqlalchemy import select, func
+from sqlalchemy import select
 from sqlalchemy.orm import Session
 from database.models import KnowledgeBase
+from database.embeddings import nearest
 from bot.llm.base import BaseLLM
+from utils.kb_dedup import upsert_knowledge_entry
 
 
 class RAGSystem:
@@ -11,6 +13,7 @@ class RAGSystem:
     def __init__(self, llm: BaseLLM, top_k: int = 3):
         self.llm = llm
         self.top_k = top_k
+        self.max_distance = 0.5
     
     async def search_similar(
         self, 
@@ -26,17 +29,15 @@ class RAGSystem:
         question_embedding = await self.llm.generate_embedding(question)
         
         results = db.execute(
-            select(
-                KnowledgeBase.question,
-                KnowledgeBase.answer,
-                KnowledgeBase.question_embedding.cosine_distance(question_embedding).label('distance')
+            nearest(
+                select(KnowledgeBase.question, KnowledgeBase.answer)
+                .where(KnowledgeBase.verified == True),
+                question_embedding,
+                self.top_k
             )
-            .where(KnowledgeBase.verified == True)
-            .order_by('distance')
-            .limit(self.top_k)
         ).fetchall()
         
-        similar = [(r.question, r.answer) for r in results if r.distance < 0.5]
+        similar = [(r.question, r.answer) for r in results if r.distance < self.max_distance]
         
         return similar
     
@@ -65,18 +66,17 @@ class RAGSystem:
         source: str = "admin",
         verified: bool = True
     ):
-        """Добавляет новую пару Q&A в базу знаний"""
+        """Добавляет новую пару Q&A в базу знаний (с дедупликацией)"""
         embedding = await self.llm.generate_embedding(question)
         
-        kb_entry = KnowledgeBase(
+        kb_entry = upsert_knowledge_entry(
+            db,
             question=question,
             answer=answer,
-            question_embedding=embedding,
+            embedding=embedding,
             source=source,
             verified=verified
         )
-        
-        db.add(kb_entry)
         db.commit()
         
         return kb_entry
\ No newline at end of file
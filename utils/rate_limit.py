@@ -0,0 +1,140 @@
+"""
+Защита от флуда и перегрузки внешних API:
+- token bucket на пользователя (в shared_state, общий для всех воркеров)
+- глобальный бюджет одновременных вызовов LLM/эмбеддингов/Tavily
+  с weighted-fair очередью: пользователь с десятком запросов в очереди
+  не задерживает того, у кого один
+"""
+
+import os
+import time
+import heapq
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from itertools import count
+from typing import Dict, List, Optional, Tuple
+from utils.shared_state import get_store
+from bot.metrics import Counter, Gauge, Histogram, REGISTRY
+
+logger = logging.getLogger(__name__)
+
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "6"))
+RATE_LIMIT_BURST = float(os.getenv("RATE_LIMIT_BURST", "5"))
+
+THROTTLED = REGISTRY.register(Counter(
+    "fsoul_throttled_messages_total",
+    "Messages rejected by the per-user rate limiter"
+))
+BUDGET_WAIT = REGISTRY.register(Histogram(
+    "fsoul_budget_wait_seconds",
+    "Time spent waiting for an outbound call slot",
+    ["kind"]
+))
+BUDGET_IN_USE = REGISTRY.register(Gauge(
+    "fsoul_budget_in_use",
+    "Outbound call slots in use",
+    ["kind"]
+))
+
+# Telegram ID пользователя, от имени которого идут вызовы (ставит handle_question)
+current_requester: ContextVar[Optional[int]] = ContextVar("current_requester", default=None)
+
+
+def check_rate_limit(user_id: int) -> Tuple[bool, float]:
+    """
+    Списывает токен из корзины пользователя.
+    Returns: (разрешено, через сколько секунд появится следующий токен)
+    """
+    rate = RATE_LIMIT_PER_MINUTE / 60.0
+    if rate <= 0:
+        return True, 0.0
+
+    def take(bucket: Optional[Dict]) -> Tuple[Dict, Tuple[bool, float]]:
+        now = time.time()
+        tokens = RATE_LIMIT_BURST
+        if bucket:
+            tokens = min(RATE_LIMIT_BURST, bucket["tokens"] + (now - bucket["ts"]) * rate)
+
+        if tokens >= 1:
+            return {"tokens": tokens - 1, "ts": now}, (True, 0.0)
+        return {"tokens": tokens, "ts": now}, (False, (1 - tokens) / rate)
+
+    ttl = RATE_LIMIT_BURST / rate
+    allowed, retry_after = get_store().update(f"ratelimit:{user_id}", take, ttl=ttl)
+    if not allowed:
+        THROTTLED.inc()
+    return allowed, retry_after
+
+
+def should_notify_throttled(user_id: int, retry_after: float) -> bool:
+    """Одно предупреждение на окно ограничения, а не ответ на каждое сообщение"""
+    return get_store().set_if_absent(f"ratelimit_notice:{user_id}", True, ttl=max(retry_after, 1.0))
+
+
+class FairScheduler:
+    """
+    Семафор на capacity слотов с очередью start-time fair queuing:
+    каждый запрос получает тег max(V, конец предыдущего запроса того же
+    пользователя), слоты выдаются по возрастанию тега
+    """
+
+    def __init__(self, kind: str, capacity: int):
+        self.kind = kind
+        self.capacity = capacity
+        self.active = 0
+        self._virtual_time = 0.0
+        self._finish: Dict[Optional[int], float] = {}
+        self._waiting: List[Tuple[float, int, asyncio.Future]] = []
+        self._seq = count()
+
+    @asynccontextmanager
+    async def slot(self, weight: float = 1.0):
+        started = time.perf_counter()
+        await self._acquire(current_requester.get(), weight)
+        BUDGET_WAIT.observe(time.perf_counter() - started, kind=self.kind)
+        try:
+            yield
+        finally:
+            self._release()
+
+    async def _acquire(self, key: Optional[int], weight: float):
+        start = max(self._virtual_time, self._finish.get(key, 0.0))
+        self._finish[key] = start + 1.0 / weight
+
+        if self.active < self.capacity and not self._waiting:
+            self.active += 1
+            self._virtual_time = start
+            BUDGET_IN_USE.set(self.active, kind=self.kind)
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiting, (start, next(self._seq), future))
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Слот успели передать, но задачу отменили — возвращаем его
+            if future.done() and not future.cancelled():
+                self._release()
+            raise
+
+    def _release(self):
+        while self._waiting:
+            start, _, future = heapq.heappop(self._waiting)
+            if future.cancelled():
+                continue
+            # Слот переходит следующему без изменения active
+            self._virtual_time = start
+            future.set_result(None)
+            return
+
+        self.active -= 1
+        BUDGET_IN_USE.set(self.active, kind=self.kind)
+        if not self.active:
+            self._finish = {k: v for k, v in self._finish.items() if v > self._virtual_time}
+
+
+llm_budget = FairScheduler("llm", int(os.getenv("LLM_CONCURRENCY", "8")))
+embedding_budget = FairScheduler("embedding", int(os.getenv("EMBEDDING_CONCURRENCY", "16")))
+tavily_budget = FairScheduler("tavily", int(os.getenv("TAVILY_CONCURRENCY", "4")))
@@ -0,0 +1,148 @@
+"""
+Кеш готовых ответов LLM для повторяющихся вопросов.
+
+Ключ — sha256 от нормализованного вопроса, ID и версий (updated_at)
+найденных записей KB, модели и tier. Изменение записи KB меняет ключ,
+а строки с ее ID дополнительно удаляются в invalidate().
+
+Два уровня: LRU в памяти процесса и таблица response_cache в Postgres.
+Включается вместе с LLM_DETERMINISTIC (или явно RESPONSE_CACHE=true).
+"""
+
+import os
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+from sqlalchemy import delete, update
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import Session
+from database.models import ResponseCacheEntry
+from bot.llm.base import LLMResponse, DETERMINISTIC
+from bot.metrics import record_cache
+from utils.kb_usage import KBHit
+from utils.small_talk import normalize
+
+logger = logging.getLogger(__name__)
+
+CACHE_ENABLED = os.getenv("RESPONSE_CACHE", "true" if DETERMINISTIC else "false").lower() == "true"
+CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "1000"))
+CACHE_TTL = timedelta(days=float(os.getenv("RESPONSE_CACHE_TTL_DAYS", "7")))
+
+
+def make_key(question: str, hits: List[KBHit], model: str, tier: str) -> str:
+    versions = ",".join(
+        f"{h.id}@{h.updated_at.isoformat() if h.updated_at else ''}"
+        for h in sorted(hits, key=lambda h: h.id)
+    )
+    raw = "\x1f".join([normalize(question), versions, model, tier])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+class ResponseCache:
+    def __init__(self, size: int = CACHE_SIZE, ttl: timedelta = CACHE_TTL, enabled: bool = CACHE_ENABLED):
+        self.size = size
+        self.ttl = ttl
+        self.enabled = enabled and size > 0
+        self._memory: "OrderedDict[str, Tuple[LLMResponse, List[int]]]" = OrderedDict()
+        self._keys_by_entry: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+
+    def _remember(self, key: str, response: LLMResponse, entry_ids: List[int]):
+        with self._lock:
+            self._memory[key] = (response, entry_ids)
+            self._memory.move_to_end(key)
+            for entry_id in entry_ids:
+                self._keys_by_entry.setdefault(entry_id, set()).add(key)
+            while len(self._memory) > self.size:
+                evicted, (_, evicted_ids) = self._memory.popitem(last=False)
+                for entry_id in evicted_ids:
+                    keys = self._keys_by_entry.get(entry_id)
+                    if keys:
+                        keys.discard(evicted)
+                        if not keys:
+                            del self._keys_by_entry[entry_id]
+
+    def get(self, db: Session, key: str) -> Optional[LLMResponse]:
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                self._memory.move_to_end(key)
+        if item is not None:
+            record_cache("response_memory", True)
+            return item[0].model_copy()
+        record_cache("response_memory", False)
+
+        row = db.query(ResponseCacheEntry).filter(
+            ResponseCacheEntry.key == key,
+            ResponseCacheEntry.created_at > datetime.utcnow() - self.ttl
+        ).first()
+        record_cache("response_db", row is not None)
+        if row is None:
+            return None
+
+        db.execute(
+            update(ResponseCacheEntry)
+            .where(ResponseCacheEntry.key == key)
+            .values(hits=ResponseCacheEntry.hits + 1)
+        )
+        db.commit()
+
+        response = LLMResponse(
+            answer=row.answer,
+            confidence=row.confidence or 0.0,
+            reasoning="response cache",
+            model=row.model or ""
+        )
+        self._remember(key, response, list(row.kb_entry_ids))
+        return response.model_copy()
+
+    def put(self, db: Session, key: str, hits: List[KBHit], response: LLMResponse):
+        if response.failed or response.truncated or not response.answer.strip():
+            return
+
+        entry_ids = [h.id for h in hits]
+        self._remember(key, response.model_copy(), entry_ids)
+
+        statement = insert(ResponseCacheEntry).values(
+            key=key,
+            model=response.model,
+            kb_entry_ids=entry_ids,
+            answer=response.answer,
+            confidence=response.confidence,
+            hits=0,
+            created_at=datetime.utcnow()
+        ).on_conflict_do_nothing(index_elements=[ResponseCacheEntry.key])
+        try:
+            db.execute(statement)
+            db.commit()
+        except Exception as e:
+            logger.warning(f"⚠️ Не удалось сохранить ответ в кеш: {e}")
+            db.rollback()
+
+    def invalidate(self, db: Session, entry_ids: Iterable[int]):
+        """Удаляет ответы, построенные на этих записях KB (коммит — на вызывающем)"""
+        entry_ids = [i for i in entry_ids if i is not None]
+        if not entry_ids:
+            return
+
+        with self._lock:
+            for entry_id in entry_ids:
+                for key in self._keys_by_entry.pop(entry_id, ()):
+                    self._memory.pop(key, None)
+
+        db.execute(
+            delete(ResponseCacheEntry).where(ResponseCacheEntry.kb_entry_ids.overlap(entry_ids))
+        )
+
+    def purge_expired(self, db: Session) -> int:
+        result = db.execute(
+            delete(ResponseCacheEntry).where(ResponseCacheEntry.created_at < datetime.utcnow() - self.ttl)
+        )
+        db.commit()
+        return result.rowcount
+
+
+response_cache = ResponseCache()
@@ -0,0 +1,197 @@
+"""
+Общее состояние между процессами бота: кеши, лимиты, дедупликация апдейтов.
+
+SHARED_STATE_BACKEND=memory — в памяти процесса (по умолчанию, один воркер)
+SHARED_STATE_BACKEND=postgres — таблица shared_state, общая для всех воркеров
+"""
+
+import os
+import random
+import logging
+import threading
+from abc import ABC, abstractmethod
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, Optional, Tuple
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+from database import get_db
+from database.models import SharedState
+
+logger = logging.getLogger(__name__)
+
+PURGE_PROBABILITY = 0.01
+
+
+def _expires_at(ttl: Optional[float]) -> Optional[datetime]:
+    return datetime.utcnow() + timedelta(seconds=ttl) if ttl else None
+
+
+class StateStore(ABC):
+    """Key-value хранилище с TTL"""
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        pass
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        pass
+
+    @abstractmethod
+    def set_if_absent(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        """Записывает значение, только если ключа нет (или он истек). True — записали"""
+        pass
+
+    @abstractmethod
+    def update(
+        self,
+        key: str,
+        fn: Callable[[Optional[Any]], Tuple[Any, Any]],
+        ttl: Optional[float] = None
+    ) -> Any:
+        """
+        Атомарно читает значение, вызывает fn(old) -> (new_value, result),
+        сохраняет new_value и возвращает result
+        """
+        pass
+
+    @abstractmethod
+    def delete(self, key: str):
+        pass
+
+    @abstractmethod
+    def clear(self, prefix: str = ""):
+        pass
+
+
+class MemoryStore(StateStore):
+    """Хранилище в памяти процесса"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[Any, Optional[datetime]]] = {}
+        self._lock = threading.RLock()
+
+    def _live(self, key: str) -> Optional[Tuple[Any, Optional[datetime]]]:
+        item = self._data.get(key)
+        if item and item[1] and item[1] < datetime.utcnow():
+            del self._data[key]
+            return None
+        return item
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            item = self._live(key)
+            return item[0] if item else None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        with self._lock:
+            self._data[key] = (value, _expires_at(ttl))
+            if random.random() < PURGE_PROBABILITY:
+                now = datetime.utcnow()
+                for k in [k for k, (_, exp) in self._data.items() if exp and exp < now]:
+                    del self._data[k]
+
+    def set_if_absent(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        with self._lock:
+            if self._live(key):
+                return False
+            self._data[key] = (value, _expires_at(ttl))
+            return True
+
+    def update(self, key, fn, ttl=None):
+        with self._lock:
+            item = self._live(key)
+            new_value, result = fn(item[0] if item else None)
+            self._data[key] = (new_value, _expires_at(ttl))
+            return result
+
+    def delete(self, key: str):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self, prefix: str = ""):
+        with self._lock:
+            for key in [k for k in self._data if k.startswith(prefix)]:
+                del self._data[key]
+
+
+class PostgresStore(StateStore):
+    """Хранилище в таблице shared_state — видно всем процессам"""
+
+    def get(self, key: str) -> Optional[Any]:
+        with get_db() as db:
+            row = db.execute(
+                select(SharedState.value, SharedState.expires_at).where(SharedState.key == key)
+            ).first()
+        if not row or (row.expires_at and row.expires_at < datetime.utcnow()):
+            return None
+        return row.value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None):
+        statement = insert(SharedState).values(key=key, value=value, expires_at=_expires_at(ttl))
+        statement = statement.on_conflict_do_update(
+            index_elements=[SharedState.key],
+            set_={"value": statement.excluded.value, "expires_at": statement.excluded.expires_at}
+        )
+        with get_db() as db:
+            db.execute(statement)
+            if random.random() < PURGE_PROBABILITY:
+                db.execute(delete(SharedState).where(SharedState.expires_at < datetime.utcnow()))
+            db.commit()
+
+    def set_if_absent(self, key: str, value: Any, ttl: Optional[float] = None) -> bool:
+        statement = insert(SharedState).values(key=key, value=value, expires_at=_expires_at(ttl))
+        statement = statement.on_conflict_do_update(
+            index_elements=[SharedState.key],
+            set_={"value": statement.excluded.value, "expires_at": statement.excluded.expires_at},
+            where=SharedState.expires_at < datetime.utcnow()
+        ).returning(SharedState.key)
+        with get_db() as db:
+            written = db.execute(statement).first() is not None
+            db.commit()
+        return written
+
+    def update(self, key, fn, ttl=None):
+        with get_db() as db:
+            db.execute(
+                insert(SharedState)
+                .values(key=key, value=None, expires_at=_expires_at(ttl))
+                .on_conflict_do_nothing(index_elements=[SharedState.key])
+            )
+            row = db.execute(
+                select(SharedState).where(SharedState.key == key).with_for_update()
+            ).scalar_one()
+
+            expired = row.expires_at and row.expires_at < datetime.utcnow()
+            new_value, result = fn(None if expired else row.value)
+            row.value = new_value
+            row.expires_at = _expires_at(ttl)
+            db.commit()
+        return result
+
+    def delete(self, key: str):
+        with get_db() as db:
+            db.execute(delete(SharedState).where(SharedState.key == key))
+            db.commit()
+
+    def clear(self, prefix: str = ""):
+        with get_db() as db:
+            db.execute(delete(SharedState).where(SharedState.key.startswith(prefix)))
+            db.commit()
+
+
+_store: Optional[StateStore] = None
+
+
+def get_store() -> StateStore:
+    """Возвращает хранилище, выбранное через SHARED_STATE_BACKEND"""
+    global _store
+    if _store is None:
+        backend = os.getenv("SHARED_STATE_BACKEND", "memory").lower()
+        if backend == "postgres":
+            _store = PostgresStore()
+        elif backend == "memory":
+            _store = MemoryStore()
+        else:
+            raise ValueError(f"Unknown SHARED_STATE_BACKEND: {backend}")
+    return _store
@@ -0,0 +1,17 @@
+"""
+Нормализация коротких сообщений для ключей кэшей (response_cache, web_knowledge).
+
+Приветствия, благодарности и прощания с шаблонными ответами — интенты с reply
+в utils/escalation_rules.yaml; их распознает EscalationPolicy.analyze
+(Analysis.small_talk) в том же проходе, что язык и эскалацию
+"""
+
+import re
+
+_PUNCTUATION = re.compile(r"[^\w\s]+")
+_SPACES = re.compile(r"\s+")
+
+
+def normalize(text: str) -> str:
+    text = _PUNCTUATION.sub(" ", text.lower())
+    return _SPACES.sub(" ", text).strip()
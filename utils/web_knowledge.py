@@ -0,0 +1,113 @@
+"""
+Ответы, построенные на веб-поиске, попадают в базу знаний
+непроверенными (verified=False, source='web'): копятся в памяти,
+эмбеддятся пачкой и сливаются с почти одинаковыми записями.
+Админ просматривает их через /review и подтверждает /promote
+"""
+
+import os
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+from database import get_db
+from utils.kb_dedup import upsert_knowledge_entry
+from utils.kb_usage import hot_set
+from utils.rate_limit import embedding_budget
+from utils.small_talk import normalize
+
+logger = logging.getLogger(__name__)
+
+WEB_KB_ENABLED = os.getenv("WEB_KB_ENABLED", "true").lower() == "true"
+WEB_KB_MIN_CONFIDENCE = float(os.getenv("WEB_KB_MIN_CONFIDENCE", "0.75"))
+WEB_KB_FLUSH_INTERVAL = float(os.getenv("WEB_KB_FLUSH_INTERVAL", "60"))
+WEB_KB_BATCH_SIZE = int(os.getenv("WEB_KB_BATCH_SIZE", "20"))
+
+
+class WebKnowledgeCollector:
+    """Копит веб-ответы и пачкой записывает их в knowledge_base"""
+
+    def __init__(self, flush_interval: float = WEB_KB_FLUSH_INTERVAL, batch_size: int = WEB_KB_BATCH_SIZE):
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.llm = None
+        self._pending: Dict[str, Tuple[str, str]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._wakeup: Optional[asyncio.Event] = None
+
+    def start(self):
+        if self._task and not self._task.done():
+            return
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    def record(self, llm, question: str, answer: str, confidence: float):
+        """Ставит веб-ответ в очередь на запись в KB (повторы вопроса схлопываются)"""
+        if not WEB_KB_ENABLED or confidence < WEB_KB_MIN_CONFIDENCE:
+            return
+
+        self.llm = llm
+        self._pending[normalize(question)] = (question, answer)
+
+        try:
+            self.start()
+        except RuntimeError:
+            return
+
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"❌ Ошибка записи веб-ответов в KB: {e}")
+
+    async def flush(self):
+        if not self._pending or self.llm is None:
+            return
+
+        batch = list(self._pending.values())
+        self._pending = {}
+
+        async with embedding_budget.slot():
+            embeddings = await self.llm.generate_embeddings([q for q, _ in batch])
+
+        await asyncio.to_thread(self._write, batch, embeddings)
+        hot_set.invalidate()
+
+    @staticmethod
+    def _write(batch: List[Tuple[str, str]], embeddings: List[List[float]]):
+        with get_db() as db:
+            for (question, answer), embedding in zip(batch, embeddings):
+                upsert_knowledge_entry(
+                    db,
+                    question=question,
+                    answer=answer,
+                    embedding=embedding,
+                    source="web",
+                    verified=False
+                )
+                # сессия без autoflush: следующий поиск дубликатов должен видеть эту запись
+                db.flush()
+            db.commit()
+        logger.info(f"🌐 Веб-ответы добавлены в KB на проверку: {len(batch)}")
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+web_knowledge = WebKnowledgeCollector()